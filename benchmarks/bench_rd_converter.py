@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python bench_rd_converter.py [--n_points 1000000]
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import time
+import argparse
+
+import numpy as np
+
+from pct.utils.rd_converter import RDWGS84Converter
+
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script compares the scalar and array RD <-> WGS84 conversions.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('--n_points', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    conv = RDWGS84Converter()
+    rng = np.random.default_rng(0)
+    x = rng.uniform(10_000, 280_000, args.n_points)
+    y = rng.uniform(300_000, 620_000, args.n_points)
+
+    # Warm up (numba compilation or cache loading).
+    conv.from_wgs84_array(*conv.from_rd_array(x[:10], y[:10]))
+
+    for name, scalar_fn, array_fn, (a, b) in [
+            ('from_rd', conv.from_rd, conv.from_rd_array, (x, y)),
+            ('from_wgs84', conv.from_wgs84, conv.from_wgs84_array, conv.from_rd_array(x, y))]:
+        start = time.perf_counter()
+        scalar = np.array([scalar_fn(a_, b_) for a_, b_ in zip(a.tolist(), b.tolist())]).T
+        t_scalar = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector = np.vstack(array_fn(a, b))
+        t_array = time.perf_counter() - start
+
+        max_diff = np.max(np.abs(scalar - vector))
+        print(f"{name:>10s}: {args.n_points:,d} points | scalar {t_scalar:7.2f}s "
+              f"({args.n_points / t_scalar:12,.0f} pts/s) | array {t_array:7.3f}s "
+              f"({args.n_points / t_array:12,.0f} pts/s) | speedup {t_scalar / t_array:6.0f}x | "
+              f"max diff {max_diff:.2e}")
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python bench_subsample.py [--n_points 5000000] [--grid_size 0.01]
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import os
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import laspy
+
+from pct.utils.las_utils import subsample_las_file
+from pct.utils.metrics_utils import PipelineMetrics
+
+from synthetic import make_point_cloud
+
+
+def run_backend(in_file, out_file, grid_size, backend, queue):
+    """Subsample in a fresh process and report wall time, stage times and peak RSS (MB).
+
+    The 'subsample' stage excludes reading, writing and (for 'cloudcompare') the per-point export of
+    the kept indices, which is reported as 'index_export'.
+    """
+    metrics = PipelineMetrics()
+    start = time.perf_counter()
+    try:
+        subsample_las_file(in_file, out_file, grid_size, backend=backend, metrics=metrics)
+        error = None
+    except Exception as e:
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    stages = {stage: timer['seconds'] for stage, timer in metrics.timers.items()}
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((elapsed, stages, peak_mb, error))
+
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script compares the subsampling backends on a synthetic tile.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('--n_points', type=int, default=5_000_000)
+    parser.add_argument('--grid_size', type=float, default=0.01)
+    parser.add_argument('--backends', type=str, nargs='+', default=['numpy', 'cloudcompare'])
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_file = os.path.join(tmp_dir, 'tile.las')
+        make_point_cloud(in_file, args.n_points, width=50, height=50)
+        print(f"{args.n_points:,d} points, grid_size {args.grid_size}")
+
+        for backend in args.backends:
+            out_file = os.path.join(tmp_dir, f'{backend}.las')
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_backend, args=(in_file, out_file, args.grid_size, backend, queue))
+            proc.start()
+            elapsed, stages, peak_mb, error = queue.get()
+            proc.join()
+
+            if error is not None:
+                print(f"{backend:>14s}: failed ({error})")
+                continue
+            with laspy.open(out_file) as las:
+                n_out = las.header.point_count
+            print(f"{backend:>14s}: {elapsed:8.2f}s | subsample {stages.get('subsample', 0):8.2f}s | "
+                  f"index export {stages.get('index_export', 0):6.2f}s | peak RSS {peak_mb:8.0f} MB | "
+                  f"{n_out:,d} points kept")
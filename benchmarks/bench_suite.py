@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python bench_suite.py [--n_points 20000000] [--out bench_results.json] [--baseline old_results.json]
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import datetime
+import tempfile
+import itertools
+import subprocess
+import multiprocessing as mp
+
+import laspy
+import numba
+import numpy as np
+
+from pct.utils.las_utils import tile_las_file, tile_las_folder, subsample_las_file
+from pct.utils.math_utils import get_octree_level
+from pct.utils.plan_utils import get_available_memory
+from pct.utils.metrics_utils import get_peak_rss_bytes
+
+from synthetic import DISTRIBUTIONS, make_point_cloud, make_point_cloud_folder
+
+
+def bench_tile_las_file(in_file, out_folder, tile_size, points_per_iter):
+    start = time.perf_counter()
+    tile_las_file(in_file, out_folder, 'filtered_', tile_size=tile_size, points_per_iter=points_per_iter)
+    return time.perf_counter() - start
+
+
+def bench_tile_las_folder(in_folder, out_folder, tile_size, points_per_iter, workers):
+    start = time.perf_counter()
+    tile_las_folder(in_folder, out_folder, glob_pattern='*.laz', tile_size=tile_size,
+                    points_per_iter=points_per_iter, workers=workers)
+    return time.perf_counter() - start
+
+
+def bench_subsample_las_file(in_file, out_folder, grid_size, points_per_iter):
+    start = time.perf_counter()
+    subsample_las_file(in_file, os.path.join(out_folder, 'subsampled.laz'), grid_size,
+                       points_per_iter=points_per_iter)
+    return time.perf_counter() - start
+
+
+def bench_get_octree_level(in_file, out_folder, grid_size):
+    """Time `get_octree_level` on the coordinates of a file, after a warm-up call for the JIT compilation."""
+    xyz = laspy.read(in_file).xyz
+    get_octree_level(xyz[:1000], grid_size)
+    start = time.perf_counter()
+    get_octree_level(xyz, grid_size)
+    return time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'tile_las_file': bench_tile_las_file,
+    'tile_las_folder': bench_tile_las_folder,
+    'subsample_las_file': bench_subsample_las_file,
+    'get_octree_level': bench_get_octree_level,
+}
+
+
+def run_benchmark(name, kwargs, queue):
+    """Run a benchmark in a fresh process and report wall time, peak RSS (MB) and error.
+
+    Two peaks are reported: that of the benchmark process itself, and the largest peak of its terminated
+    child processes, e.g. the workers of `tile_las_folder` (RUSAGE_CHILDREN, 0 without workers). The
+    benchmarks shut down their process pools before returning, so all workers are accounted for.
+    """
+    out_folder = tempfile.mkdtemp(dir=os.path.dirname(kwargs.get('in_file', kwargs.get('in_folder'))))
+    try:
+        elapsed, error = BENCHMARKS[name](out_folder=out_folder, **kwargs), None
+    except Exception as e:
+        elapsed, error = None, f"{type(e).__name__}: {e}"
+    finally:
+        shutil.rmtree(out_folder, ignore_errors=True)
+    queue.put((elapsed, get_peak_rss_bytes() / 1024**2, get_peak_rss_bytes(resource.RUSAGE_CHILDREN) / 1024**2,
+               error))
+
+
+def run_case(ctx, case, kwargs):
+    """Run a benchmark case, see `run_benchmark`, and complete its result record."""
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_benchmark, args=(case['benchmark'], kwargs, queue))
+    proc.start()
+    elapsed, peak_mb, peak_children_mb, error = queue.get()
+    proc.join()
+
+    case.update(seconds=elapsed, peak_rss_mb=round(peak_mb, 1), peak_children_rss_mb=round(peak_children_mb, 1),
+                error=error,
+                points_per_s=None if elapsed is None else case['n_points'] / max(elapsed, 1e-9))
+    return case
+
+
+def get_cases(args):
+    """Yield tuples (case, kwargs) of all benchmarks per dataset.
+
+    Each dataset starts with a tuple (dataset, None), on which the caller writes its inputs with
+    `make_datasets` before the benchmarks of the dataset are yielded.
+    """
+    chunk_sizes = [n or None for n in args.points_per_iter]
+    for distribution, point_format in itertools.product(args.distributions, args.point_formats):
+        dataset = {'distribution': distribution, 'point_format': point_format}
+        yield dataset, None
+
+        for tile_size, points_per_iter in itertools.product(args.tile_sizes, chunk_sizes):
+            params = {'tile_size': tile_size, 'points_per_iter': points_per_iter}
+            yield dict(dataset, benchmark='tile_las_file', n_points=args.n_points, params=params), \
+                dict(in_file=dataset['file'], **params)
+            for workers in args.workers:
+                folder_params = dict(params, workers=workers)
+                yield dict(dataset, benchmark='tile_las_folder', n_points=args.n_points, params=folder_params), \
+                    dict(in_folder=dataset['folder'], **folder_params)
+
+        for points_per_iter in [n or None for n in args.subsample_points_per_iter]:
+            params = {'grid_size': args.grid_size, 'points_per_iter': points_per_iter}
+            yield dict(dataset, benchmark='subsample_las_file', n_points=args.tile_points, params=params), \
+                dict(in_file=dataset['tile_file'], **params)
+
+        params = {'grid_size': args.grid_size}
+        yield dict(dataset, benchmark='get_octree_level', n_points=args.tile_points, params=params), \
+            dict(in_file=dataset['tile_file'], **params)
+
+
+def make_datasets(dataset, tmp_dir, args):
+    """Write the synthetic inputs of a dataset and add their paths to it."""
+    name = f"{dataset['distribution']}_{dataset['point_format']}"
+    kwargs = dict(distribution=dataset['distribution'], point_format=dataset['point_format'])
+    dataset['file'] = make_point_cloud(os.path.join(tmp_dir, f'{name}.laz'), args.n_points, **kwargs)
+    dataset['folder'] = os.path.join(tmp_dir, name)
+    make_point_cloud_folder(dataset['folder'], args.n_files, args.n_points // args.n_files,
+                            width=400 / args.n_files, **kwargs)
+    dataset['tile_file'] = make_point_cloud(os.path.join(tmp_dir, f'{name}_tile.laz'), args.tile_points,
+                                            width=50, height=50, **kwargs)
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'available_memory_gb': round(get_available_memory() / 1024**3, 1),
+            'numpy': np.__version__, 'laspy': laspy.__version__, 'numba': numba.__version__}
+
+
+def get_case_key(case):
+    return (case['benchmark'], case['distribution'], case['point_format'], case['n_points'],
+            json.dumps(case['params'], sort_keys=True))
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """Print the cases that are slower or use more memory than in the baseline, by more than `tolerance`.
+
+    Returns:
+        The number of regressions.
+    """
+    baseline = {get_case_key(case): case for case in baseline if case['error'] is None}
+    regressions = 0
+    for case in results:
+        old = baseline.get(get_case_key(case))
+        if old is None or case['error'] is not None:
+            continue
+        speed = case['points_per_s'] / old['points_per_s']
+        memory = case['peak_rss_mb'] / old['peak_rss_mb']
+        # Baselines from before the worker peak was recorded only have the peak of the benchmark process.
+        if old.get('peak_children_rss_mb'):
+            memory = max(memory, case['peak_children_rss_mb'] / old['peak_children_rss_mb'])
+        if speed < 1 - tolerance or memory > 1 + tolerance:
+            regressions += 1
+            print(f"REGRESSION {case['benchmark']} {case['distribution']} {case['params']}: "
+                  f"{speed:5.2f}x points/s, {memory:5.2f}x peak RSS")
+    print(f"{regressions} regressions in {len(results)} cases.")
+    return regressions
+
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script benchmarks the tiling and subsampling throughput on synthetic point clouds.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('--n_points', type=int, default=20_000_000,
+                        help='points of the (400 x 200 m) tiling input')
+    parser.add_argument('--n_files', type=int, default=4,
+                        help='number of files the tiling input is split into for tile_las_folder')
+    parser.add_argument('--tile_points', type=int, default=5_000_000,
+                        help='points of the (50 x 50 m) subsampling input')
+    parser.add_argument('--distributions', type=str, nargs='+', default=list(DISTRIBUTIONS),
+                        choices=DISTRIBUTIONS)
+    parser.add_argument('--point_formats', type=int, nargs='+', default=[3])
+    parser.add_argument('--tile_sizes', type=float, nargs='+', default=[25, 50, 100])
+    parser.add_argument('--points_per_iter', type=int, nargs='+', default=[1_000_000, 5_000_000, 20_000_000, 0],
+                        help='chunk sizes for tiling, 0 is automatic')
+    parser.add_argument('--subsample_points_per_iter', type=int, nargs='+', default=[0, 1_000_000],
+                        help='chunk sizes for subsampling, 0 reads the file at once')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1])
+    parser.add_argument('--grid_size', type=float, default=0.01)
+    parser.add_argument('--out', type=str, default='bench_results.json')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for case, kwargs in get_cases(args):
+            if kwargs is None:
+                print(f"Generating {case['distribution']} point cloud, point format {case['point_format']}..")
+                make_datasets(case, tmp_dir, args)
+                continue
+
+            case = run_case(ctx, {key: value for key, value in case.items()
+                                  if key not in ('file', 'folder', 'tile_file')}, kwargs)
+            results.append(case)
+            if case['error'] is not None:
+                print(f"{case['benchmark']:>20s} {case['params']}: failed ({case['error']})")
+            else:
+                print(f"{case['benchmark']:>20s} {case['params']}: {case['seconds']:8.2f}s | "
+                      f"{case['points_per_s'] / 1e6:7.2f} M points/s | peak RSS {case['peak_rss_mb']:8.0f} MB | "
+                      f"workers {case['peak_children_rss_mb']:8.0f} MB")
+
+    with open(args.out, 'w') as f:
+        json.dump({'metadata': get_metadata(), 'args': vars(args), 'results': results}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare_results(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
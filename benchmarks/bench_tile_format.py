@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python bench_tile_format.py [--n_points 20000000] [--formats las laz:lazrs-parallel laz:lazrs laz:laszip]
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from pct.utils.las_utils import tile_las_folder, subsample_las_folder
+from pct.utils.tile_writer import get_laz_backend
+
+from synthetic import make_point_cloud
+
+
+def folder_size_mb(folder, extension):
+    return sum(f.stat().st_size for f in os.scandir(folder) if f.name.endswith(extension)) / 1024**2
+
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script compares the intermediate tile formats on the tiling -> subsampling path.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('--n_points', type=int, default=20_000_000)
+    parser.add_argument('--grid_size', type=float, default=0.05)
+    parser.add_argument('--formats', type=str, nargs='+',
+                        default=['las', 'laz:lazrs-parallel', 'laz:lazrs', 'laz:laszip'],
+                        help='tile formats as <extension>[:<laz backend>]')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_folder = os.path.join(tmp_dir, 'in')
+        os.makedirs(in_folder)
+        make_point_cloud(os.path.join(in_folder, 'strip.laz'), args.n_points)
+        print(f"{args.n_points:,d} points, grid_size {args.grid_size}")
+        print(f"{'format':>20s} | {'tile':>8s} | {'subsample':>9s} | {'total':>8s} | {'tiles MB':>9s} | {'final MB':>9s}")
+
+        for tile_format in args.formats:
+            extension, _, laz_backend = tile_format.partition(':')
+            laz_backend = laz_backend or None
+            try:
+                get_laz_backend(laz_backend)
+            except ImportError as e:
+                print(f"{tile_format:>20s} | skipped ({e})")
+                continue
+
+            out_folder = os.path.join(tmp_dir, 'out')
+            start = time.perf_counter()
+            tile_las_folder(in_folder, out_folder, glob_pattern='*.laz', extension=f'.{extension}',
+                            laz_backend=laz_backend)
+            tiled = time.perf_counter()
+            tiles_mb = folder_size_mb(out_folder, f'.{extension}')
+
+            # The final product is always compressed.
+            subsample_las_folder(out_folder, grid_size=args.grid_size, min_points=0, extension='.laz',
+                                 laz_backend=laz_backend)
+            done = time.perf_counter()
+            final_mb = folder_size_mb(out_folder, '.laz')
+
+            print(f"{tile_format:>20s} | {tiled - start:7.2f}s | {done - tiled:8.2f}s | {done - start:7.2f}s | "
+                  f"{tiles_mb:9.1f} | {final_mb:9.1f}")
+            shutil.rmtree(out_folder)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python bench_tile_partition.py [--n_points 10000000 40000000 100000000]
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import time
+import argparse
+
+import numpy as np
+
+from pct.utils.las_utils import partition_by_tile
+
+from synthetic import ORIGIN, generate_xyz
+
+
+def digitize_partition(x, y, tile_size=50):
+    """Reference implementation: the nested np.where loop previously used in tile_las_file."""
+    x_bins = np.arange(x.min()//tile_size - 1, 2 + x.max()//tile_size, dtype=int) * tile_size
+    y_bins = np.arange(y.min()//tile_size - 1, 2 + y.max()//tile_size, dtype=int) * tile_size
+
+    tile_codes = np.vstack([np.digitize(x, x_bins), np.digitize(y, y_bins)]).T - 1
+    for x_ in range(len(x_bins)):
+        xm_ = np.where(tile_codes[:,0] == x_)[0]
+        for y_ in np.unique(tile_codes[xm_,1]):
+            if y_ in range(len(y_bins)):
+                clip_idx = xm_[tile_codes[xm_,1] == y_]
+                if len(clip_idx) > 0:
+                    yield f"{int(x_bins[x_]//tile_size)}_{int(y_bins[y_]//tile_size)}", clip_idx
+
+
+def time_partition(fn, x, y, tile_size):
+    start = time.perf_counter()
+    n_tiles = 0
+    n_points = 0
+    for _, idx in fn(x, y, tile_size):
+        n_tiles += 1
+        n_points += len(idx)
+    return time.perf_counter() - start, n_tiles, n_points
+
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script compares sort-based and digitize-based tile partitioning.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('--n_points', type=int, nargs='+', default=[10_000_000, 40_000_000, 100_000_000])
+    parser.add_argument('--tile_size', type=int, default=50)
+    parser.add_argument('--width', type=float, default=50_000, help='strip width (m)')
+    parser.add_argument('--height', type=float, default=500, help='strip height (m)')
+    parser.add_argument('--skip_reference', action='store_true')
+    args = parser.parse_args()
+
+    for n_points in args.n_points:
+        x, y, _ = generate_xyz(np.random.default_rng(0), n_points, 'uniform', args.width, args.height)
+        x, y = x + ORIGIN[0], y + ORIGIN[1]
+
+        t_sort, n_tiles, n_out = time_partition(partition_by_tile, x, y, args.tile_size)
+        assert n_out == n_points
+        print(f"{n_points:>12,d} points, {n_tiles:>7,d} tiles | sort-based: {t_sort:8.2f}s", end='', flush=True)
+
+        if not args.skip_reference:
+            t_ref, ref_tiles, _ = time_partition(digitize_partition, x, y, args.tile_size)
+            assert ref_tiles == n_tiles
+            print(f" | digitize loop: {t_ref:8.2f}s | speedup: {t_ref / t_sort:6.1f}x", end='')
+        print()
+
+        del x, y
@@ -0,0 +1,127 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Synthetic point cloud utility methods - Module (Python)
+
+Deterministic synthetic LAS files for the benchmarks. A point cloud is generated
+in chunks, each from its own random stream seeded by (seed, chunk), so the same
+arguments always give the same points, independent of the chunk size, and
+clouds larger than memory can be written. Three distributions are supported:
+
+* uniform: points uniformly distributed over the extent (e.g. an airborne survey).
+* urban: dense clusters (buildings, trees) on a sparse ground surface.
+* strip: a mobile mapping strip along the x-axis, dense at the centre line and
+  sparse towards its edges.
+"""
+
+import os
+import pathlib
+
+import laspy
+import numpy as np
+
+DISTRIBUTIONS = ('uniform', 'urban', 'strip')
+
+# Origin of the synthetic clouds, in RD coordinates (Amsterdam).
+ORIGIN = (120_000, 480_000)
+
+# Points are generated in blocks of this size, which fixes the random streams.
+BLOCK_POINTS = 1_000_000
+
+
+def get_header(point_format=3):
+    """Header with millimetre scales at `ORIGIN` for a LAS point format."""
+    header = laspy.LasHeader(point_format=point_format, version="1.4" if point_format >= 6 else "1.2")
+    header.scales = np.array([0.001, 0.001, 0.001])
+    header.offsets = np.array([ORIGIN[0], ORIGIN[1], 0])
+    return header
+
+
+def generate_xyz(rng, n_points, distribution='uniform', width=400, height=200):
+    """Coordinates, relative to the origin, of `n_points` points of a distribution over (width x height).
+
+    Returns:
+        Tuple (x, y, z) of arrays.
+    """
+    if distribution == 'uniform':
+        x = rng.random(n_points) * width
+        y = rng.random(n_points) * height
+        z = rng.random(n_points) * 20
+    elif distribution == 'urban':
+        # Cluster centres and sizes are drawn from a fixed stream, so all blocks share the same "city".
+        city = np.random.default_rng(0)
+        n_clusters = max(1, int(width * height / 2_500))
+        centres = city.random((n_clusters, 2)) * [width, height]
+        sigmas = city.uniform(2, 15, n_clusters)
+        heights = city.uniform(5, 40, n_clusters)
+
+        on_ground = rng.random(n_points) < 0.2
+        cluster = rng.integers(0, n_clusters, n_points)
+        x = np.where(on_ground, rng.random(n_points) * width,
+                     centres[cluster, 0] + rng.normal(size=n_points) * sigmas[cluster])
+        y = np.where(on_ground, rng.random(n_points) * height,
+                     centres[cluster, 1] + rng.normal(size=n_points) * sigmas[cluster])
+        z = np.where(on_ground, rng.normal(size=n_points) * 0.05, rng.random(n_points) * heights[cluster])
+        x = np.clip(x, 0, width)
+        y = np.clip(y, 0, height)
+    elif distribution == 'strip':
+        x = rng.random(n_points) * width
+        y = np.clip(height / 2 + rng.normal(size=n_points) * height / 8, 0, height)
+        z = rng.random(n_points) ** 3 * 20
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    return x, y, z
+
+
+def make_point_cloud(path, n_points, distribution='uniform', point_format=3, width=400, height=200,
+                     x_offset=0, seed=0):
+    """Write a synthetic point cloud to a LAS or LAZ file (by extension of `path`).
+
+    Args:
+        path: The output file.
+        n_points: The number of points.
+        distribution: One of `DISTRIBUTIONS`. Defaults to 'uniform'.
+        point_format: The LAS point format. Defaults to 3.
+        width: The extent along x (m). Defaults to 400.
+        height: The extent along y (m). Defaults to 200.
+        x_offset: Shift of the cloud along x (m), to place several files next to each other. Defaults to 0.
+        seed: The random seed. Defaults to 0.
+
+    Returns:
+        The path of the output file.
+    """
+    header = get_header(point_format)
+    dimensions = set(header.point_format.dimension_names)
+    with laspy.open(path, mode="w", header=header) as out_las:
+        for block, start in enumerate(range(0, n_points, BLOCK_POINTS)):
+            n = min(BLOCK_POINTS, n_points - start)
+            rng = np.random.default_rng([seed, block])
+            x, y, z = generate_xyz(rng, n, distribution, width, height)
+
+            points = laspy.ScaleAwarePointRecord.zeros(n, header=header)
+            points.x = ORIGIN[0] + x_offset + x
+            points.y = ORIGIN[1] + y
+            points.z = z
+            points.intensity = rng.integers(0, 2**16, n, dtype=np.uint16)
+            if 'gps_time' in dimensions:
+                points.gps_time = start + np.arange(n) * 1e-5
+            if 'red' in dimensions:
+                points.red = points.green = points.blue = rng.integers(0, 2**16, n, dtype=np.uint16)
+            out_las.write_points(points)
+    return path
+
+
+def make_point_cloud_folder(folder, n_files, n_points, extension='.laz', **kwargs):
+    """Write `n_files` synthetic point clouds of `n_points` each, next to each other along x.
+
+    The keyword arguments are passed to `make_point_cloud`; each file gets its own seed.
+
+    Returns:
+        The list of output files.
+    """
+    pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+    width = kwargs.pop('width', 400)
+    seed = kwargs.pop('seed', 0)
+    return [make_point_cloud(os.path.join(folder, f'cloud_{i:03d}{extension}'), n_points, width=width,
+                             x_offset=i * width, seed=seed + i, **kwargs)
+            for i in range(n_files)]
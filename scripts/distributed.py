@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python distributed.py coordinator --in_folder '..' --out_folder '..' [--local_workers 4]
+#          python distributed.py worker --queue_folder '..'
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import os
+import sys
+import argparse
+
+from pct.utils.distributed_utils import run_coordinator, run_worker
+from pct.utils.metrics_utils import PipelineMetrics
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script tiles and subsamples a pointcloud dataset with workers on several nodes,
+                  coordinated through a job queue on shared storage.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    subparsers = parser.add_subparsers(dest='role', required=True)
+
+    coordinator = subparsers.add_parser('coordinator', help='plan the work, submit the jobs and wait for them')
+    coordinator.add_argument('--in_folder', metavar='path', action='store',
+                             type=str, required=True)
+    coordinator.add_argument('--out_folder', metavar='path', action='store',
+                             type=str, required=True)
+    coordinator.add_argument('--queue_folder', metavar='path', type=str, default=None,
+                             help='shared queue folder, by default .queue in the output folder')
+    coordinator.add_argument('--out_prefix', type=str, default="filtered_")
+    coordinator.add_argument('--tile_size', type=int, default=50)
+    coordinator.add_argument('--grid_size', type=float, default=0.01)
+    coordinator.add_argument('--points_per_iter', type=int, default=None,
+                             help='points per chunk, by default derived from the available memory')
+    coordinator.add_argument('--subsample_points_per_iter', type=int, default=None,
+                             help='stream tiles in chunks of this many points while subsampling')
+    coordinator.add_argument('--chunks_per_job', type=int, default=None,
+                             help='split input files into tile jobs of this many chunks')
+    coordinator.add_argument('--roi', type=float, nargs=4, default=None,
+                             metavar=('X_MIN', 'Y_MIN', 'X_MAX', 'Y_MAX'), help='only tile the points inside this bbox')
+    coordinator.add_argument('--tile_format', type=str, default='laz', choices=['laz', 'las'])
+    coordinator.add_argument('--lease_seconds', type=int, default=600)
+    coordinator.add_argument('--max_attempts', type=int, default=3)
+    coordinator.add_argument('--local_workers', type=int, default=0,
+                             help='number of workers to run on this node')
+    coordinator.add_argument('--metrics_file', type=str, default=None,
+                             help='write the stage timers, counters and per-file results to this JSON file')
+
+    worker = subparsers.add_parser('worker', help='claim and run jobs until the queue is closed')
+    worker.add_argument('--queue_folder', metavar='path', type=str, required=True)
+    worker.add_argument('--worker_id', type=str, default=None)
+    worker.add_argument('--max_jobs', type=int, default=None)
+
+    for subparser in (coordinator, worker):
+        subparser.add_argument('--poll_seconds', type=float, default=5)
+        subparser.add_argument('--laz_backend', type=str, default=None,
+                               choices=['lazrs-parallel', 'lazrs', 'laszip'],
+                               help='LAZ backend, by default the first one available')
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        n_jobs = run_worker(args.queue_folder, args.worker_id, args.poll_seconds, args.laz_backend, args.max_jobs)
+        print(f"Ran {n_jobs} jobs. Exit.")
+        sys.exit()
+
+    if not os.path.isdir(args.in_folder):
+        print('The input path does not exist')
+        sys.exit()
+
+    metrics = PipelineMetrics()
+    run_coordinator(args.in_folder, args.out_folder, args.queue_folder, args.out_prefix,
+                    points_per_iter=args.points_per_iter, tile_size=args.tile_size, grid_size=args.grid_size,
+                    roi=args.roi, extension=f'.{args.tile_format}',
+                    subsample_points_per_iter=args.subsample_points_per_iter,
+                    chunks_per_job=args.chunks_per_job, lease_seconds=args.lease_seconds,
+                    max_attempts=args.max_attempts, poll_seconds=args.poll_seconds,
+                    local_workers=args.local_workers, laz_backend=args.laz_backend, metrics=metrics)
+
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.save(args.metrics_file)
+
+    print("Done. Exit.")
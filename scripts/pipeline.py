@@ -11,7 +11,9 @@ import sys
 import argparse
 from pathlib import Path
 
-from pct.utils.las_utils import tile_las_folder, subsample_las_folder
+from pct.utils.las_utils import tile_las_folder, subsample_las_folder, tile_subsample_las_folder
+from pct.utils.index_utils import refresh_tile_index
+from pct.utils.metrics_utils import PipelineMetrics
 
 MIN_FILE_SIZE = 1 # threshold for deleting small tiles
 
@@ -26,10 +28,44 @@ if __name__ == '__main__':
                         type=str, required=True)
     parser.add_argument('--out_prefix', type=str, default="filtered_")
     parser.add_argument('--grid_size', type=float, default=0.01)
+    parser.add_argument('--backend', type=str, default='numpy', choices=['numpy', 'cloudcompare'])
+    parser.add_argument('--subsample_points_per_iter', type=int, default=None,
+                        help='stream tiles in chunks of this many points while subsampling')
     parser.add_argument('--tile_size', type=int, default=50)
-    parser.add_argument('--points_per_iter', type=int, default=30_000_000)
+    parser.add_argument('--points_per_iter', type=int, default=None,
+                        help='points per chunk, by default derived from the available memory')
+    parser.add_argument('--max_open_files', type=int, default=128)
+    parser.add_argument('--buffer_mb', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--roi', type=float, nargs=4, default=None, metavar=('X_MIN', 'Y_MIN', 'X_MAX', 'Y_MAX'),
+                        help='only tile the points inside this bbox')
+    parser.add_argument('--max_memory_gb', type=float, default=None,
+                        help='memory budget for parallel subsampling (default: the available memory), '
+                             'or for the tile states with --fused (default: half the available memory)')
+    parser.add_argument('--buffer', type=float, default=0,
+                        help='margin around each tile, whose points are also written to the tile and flagged')
+    parser.add_argument('--max_tile_points', type=int, default=None,
+                        help='split tiles with more points into four (adaptive tiling)')
+    parser.add_argument('--max_level', type=int, default=4,
+                        help='maximum number of splits of a tile for adaptive tiling')
+    parser.add_argument('--tile_counts', type=str, default='histogram', choices=['histogram', 'header'],
+                        help='count the points per tile exactly (extra read pass) or estimate them from the headers')
+    parser.add_argument('--tile_format', type=str, default='laz', choices=['laz', 'las'],
+                        help='format of the (intermediate) tiles, las is uncompressed')
+    parser.add_argument('--laz_backend', type=str, default=None, choices=['lazrs-parallel', 'lazrs', 'laszip'],
+                        help='LAZ backend, by default the first one available')
+    parser.add_argument('--resume', action='store_true',
+                        help='journal the tiling and resume an interrupted run at the last committed chunk')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only rebuild the tiles of added, changed and removed input files')
     parser.add_argument('--delete_small', action='store_true')
+    parser.add_argument('--fused', action='store_true',
+                        help='tile and subsample in a single pass, without writing full resolution tiles')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='write the stage timers, counters and per-file results to this JSON file')
     args = parser.parse_args()
+    if args.fused and (args.resume or args.incremental or args.buffer > 0 or args.max_tile_points):
+        parser.error('--resume, --incremental, --buffer and --max_tile_points are not supported with --fused')
     
     if not os.path.isdir(args.in_folder):
         print('The input path does not exist')
@@ -38,16 +74,43 @@ if __name__ == '__main__':
     if not os.path.isdir(args.out_folder):
         Path(args.out_folder).mkdir(parents=True, exist_ok=True)
     
-    tile_las_folder(args.in_folder, args.out_folder, args.out_prefix,
-                    points_per_iter=args.points_per_iter, tile_size=args.tile_size)
+    metrics = PipelineMetrics()
+    tile_codes = None
+    max_memory_bytes = int(args.max_memory_gb * 1024**3) if args.max_memory_gb else None
+    if args.fused:
+        tile_subsample_las_folder(args.in_folder, args.out_folder, args.out_prefix,
+                                  points_per_iter=args.points_per_iter, tile_size=args.tile_size,
+                                  grid_size=args.grid_size, roi=args.roi, laz_backend=args.laz_backend,
+                                  max_memory_bytes=max_memory_bytes, metrics=metrics)
+    else:
+        tile_codes = tile_las_folder(args.in_folder, args.out_folder, args.out_prefix,
+                                     points_per_iter=args.points_per_iter, tile_size=args.tile_size,
+                                     max_open_files=args.max_open_files,
+                                     max_buffer_bytes=args.buffer_mb * 1024 * 1024, workers=args.workers,
+                                     roi=args.roi, resume=args.resume, incremental=args.incremental,
+                                     extension=f'.{args.tile_format}', laz_backend=args.laz_backend,
+                                     buffer=args.buffer, max_tile_points=args.max_tile_points,
+                                     max_level=args.max_level, tile_counts=args.tile_counts, metrics=metrics)
     
+    # Note: in fused mode the (already subsampled) tiles are checked.
     if args.delete_small:
         print(f"Deleting small tiles less than {MIN_FILE_SIZE} MB..")
-        for f in Path(args.out_folder).glob(f'{args.out_prefix}*.laz'):
+        tile_format = 'laz' if args.fused else args.tile_format
+        for f in Path(args.out_folder).glob(f'{args.out_prefix}*.{tile_format}'):
             if os.stat(f).st_size / (1024 * 1024) < MIN_FILE_SIZE:
                 f.unlink()
+        refresh_tile_index(args.out_folder)
         print("Done.")
     
-    subsample_las_folder(args.out_folder, out_prefix=args.out_prefix, grid_size=args.grid_size)
+    if not args.fused:
+        subsample_las_folder(args.out_folder, out_prefix=args.out_prefix, grid_size=args.grid_size,
+                             workers=args.workers, max_memory_bytes=max_memory_bytes, backend=args.backend,
+                             points_per_iter=args.subsample_points_per_iter,
+                             tile_codes=tile_codes if args.incremental else None,
+                             extension='.laz', laz_backend=args.laz_backend, metrics=metrics)
+    
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.save(args.metrics_file)
     
     print("Done. Exit.")
\ No newline at end of file
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+
+# PointCloud_Tiling, GPL-3.0 license
+# command: python pyramid.py --in_folder '..' --out_folder '..' [--grid_sizes 0.01 0.05 0.25 1]
+
+# Helper script to allow importing from parent folder.
+import set_path  # noqa: F401
+
+import os
+import sys
+import argparse
+
+from pct.utils.pyramid_utils import build_lod_pyramid
+
+if __name__ == '__main__':
+    global args
+
+    desc_str = '''This script builds a level of detail pyramid from a folder of tiles.'''
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('--in_folder', metavar='path', action='store',
+                        type=str, required=True)
+    parser.add_argument('--out_folder', metavar='path', action='store',
+                        type=str, required=True)
+    parser.add_argument('--prefix', type=str, default="filtered_")
+    parser.add_argument('--grid_sizes', type=float, nargs='+', default=[0.01, 0.05, 0.25, 1.0],
+                        help='grid size of each level, from fine to coarse')
+    parser.add_argument('--tile_size', type=float, default=None,
+                        help='size of the input tiles, by default from the tile index')
+    parser.add_argument('--laz_backend', type=str, default=None, choices=['lazrs-parallel', 'lazrs', 'laszip'],
+                        help='LAZ backend, by default the first one available')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.in_folder):
+        print('The input path does not exist')
+        sys.exit()
+
+    levels = build_lod_pyramid(args.in_folder, args.out_folder, args.grid_sizes, args.prefix,
+                               tile_size=args.tile_size, laz_backend=args.laz_backend)
+    for level in levels:
+        print(f"lod{level['level']}: grid size {level['grid_size']}, tile size {level['tile_size']}, "
+              f"{level['tile_count']} tiles, {level['point_count']:,d} points")
+
+    print("Done. Exit.")
@@ -12,6 +12,7 @@ import argparse
 from pathlib import Path
 
 from pct.utils.las_utils import subsample_las_folder
+from pct.utils.metrics_utils import PipelineMetrics
 
 MIN_FILE_SIZE = 1 # threshold for deleting small tiles
 
@@ -25,7 +26,17 @@ if __name__ == '__main__':
     parser.add_argument('--out_folder', metavar='path', action='store',
                         type=str)
     parser.add_argument('--grid_size', type=float, default=0.01)
+    parser.add_argument('--backend', type=str, default='numpy', choices=['numpy', 'cloudcompare'])
+    parser.add_argument('--subsample_points_per_iter', type=int, default=None,
+                        help='stream tiles in chunks of this many points while subsampling')
     parser.add_argument('--out_prefix', type=str, default="filtered_")
+    parser.add_argument('--in_prefix', type=str, default=None,
+                        help='prefix of the input tiles, defaults to out_prefix')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max_memory_gb', type=float, default=None,
+                        help='memory budget for parallel subsampling, defaults to the available memory')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='write the stage timers, counters and per-file results to this JSON file')
     args = parser.parse_args()
     
     if not os.path.isdir(args.in_folder):
@@ -35,7 +46,16 @@ if __name__ == '__main__':
     if args.out_folder and not os.path.isdir(args.out_folder):
         Path(args.out_folder).mkdir(parents=True, exist_ok=True)
     
+    metrics = PipelineMetrics()
+    max_memory_bytes = int(args.max_memory_gb * 1024**3) if args.max_memory_gb else None
     subsample_las_folder(args.in_folder, args.out_folder, out_prefix=args.out_prefix,
-                         grid_size=args.grid_size)
+                         grid_size=args.grid_size,
+                         workers=args.workers, max_memory_bytes=max_memory_bytes, backend=args.backend,
+                         points_per_iter=args.subsample_points_per_iter, in_prefix=args.in_prefix,
+                         metrics=metrics)
+    
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.save(args.metrics_file)
     
     print("Done. Exit.")
\ No newline at end of file
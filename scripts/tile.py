@@ -12,6 +12,8 @@ import argparse
 from pathlib import Path
 
 from pct.utils.las_utils import tile_las_folder
+from pct.utils.index_utils import refresh_tile_index
+from pct.utils.metrics_utils import PipelineMetrics
 
 MIN_FILE_SIZE = 1 # threshold for deleting small tiles
 
@@ -26,8 +28,32 @@ if __name__ == '__main__':
                         type=str, required=True)
     parser.add_argument('--out_prefix', type=str, default="filtered_")
     parser.add_argument('--tile_size', type=int, default=50)
-    parser.add_argument('--points_per_iter', type=int, default=30_000_000)
+    parser.add_argument('--points_per_iter', type=int, default=None,
+                        help='points per chunk, by default derived from the available memory')
+    parser.add_argument('--max_open_files', type=int, default=128)
+    parser.add_argument('--buffer_mb', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--roi', type=float, nargs=4, default=None, metavar=('X_MIN', 'Y_MIN', 'X_MAX', 'Y_MAX'),
+                        help='only tile the points inside this bbox')
+    parser.add_argument('--buffer', type=float, default=0,
+                        help='margin around each tile, whose points are also written to the tile and flagged')
+    parser.add_argument('--max_tile_points', type=int, default=None,
+                        help='split tiles with more points into four (adaptive tiling)')
+    parser.add_argument('--max_level', type=int, default=4,
+                        help='maximum number of splits of a tile for adaptive tiling')
+    parser.add_argument('--tile_counts', type=str, default='histogram', choices=['histogram', 'header'],
+                        help='count the points per tile exactly (extra read pass) or estimate them from the headers')
+    parser.add_argument('--tile_format', type=str, default='laz', choices=['laz', 'las'],
+                        help='format of the (intermediate) tiles, las is uncompressed')
+    parser.add_argument('--laz_backend', type=str, default=None, choices=['lazrs-parallel', 'lazrs', 'laszip'],
+                        help='LAZ backend, by default the first one available')
+    parser.add_argument('--resume', action='store_true',
+                        help='journal the tiling and resume an interrupted run at the last committed chunk')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only rebuild the tiles of added, changed and removed input files')
     parser.add_argument('--delete_small', action='store_true')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='write the stage timers, counters and per-file results to this JSON file')
     args = parser.parse_args()
     
     if not os.path.isdir(args.in_folder):
@@ -37,15 +63,27 @@ if __name__ == '__main__':
     if not os.path.isdir(args.out_folder):
         Path(args.out_folder).mkdir(parents=True, exist_ok=True)
     
+    metrics = PipelineMetrics()
     tile_las_folder(args.in_folder, args.out_folder, args.out_prefix,
-                    points_per_iter=args.points_per_iter, tile_size=args.tile_size)
+                    points_per_iter=args.points_per_iter, tile_size=args.tile_size,
+                    max_open_files=args.max_open_files, max_buffer_bytes=args.buffer_mb * 1024 * 1024,
+                    workers=args.workers, roi=args.roi, resume=args.resume,
+                    incremental=args.incremental, extension=f'.{args.tile_format}',
+                    laz_backend=args.laz_backend, buffer=args.buffer,
+                    max_tile_points=args.max_tile_points, max_level=args.max_level, tile_counts=args.tile_counts,
+                    metrics=metrics)
+    
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.save(args.metrics_file)
     
     print("Success.")
     
     if args.delete_small:
         print(f"Deleting small tiles less than {MIN_FILE_SIZE} MB..")
-        for f in Path(args.out_folder).glob(f'{args.out_prefix}*.laz'):
+        for f in Path(args.out_folder).glob(f'{args.out_prefix}*.{args.tile_format}'):
             if os.stat(f).st_size / (1024 * 1024) < MIN_FILE_SIZE:
                 f.unlink()
+        refresh_tile_index(args.out_folder)
     
     print("Done. Exit.")
\ No newline at end of file
@@ -0,0 +1,273 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Distributed tiling utility methods - Module (Python)
+
+Tiling and subsampling of a folder on several nodes, through a job queue on
+shared storage (see `queue_utils.JobQueue`). The coordinator plans the work
+from the file headers and submits the jobs in two phases:
+
+1. 'tile' jobs: tile an input file, or a range of its chunks, into a shard
+   folder of its own in the queue folder.
+2. 'subsample' jobs: merge the shards of a tile, in input order, into the
+   output folder and subsample it.
+
+Workers on any node claim and run jobs until the coordinator closes the queue.
+The coordinator waits for each phase, writes the tile index and closes the
+queue. The input, output and queue folders must be mounted at the same path on
+all nodes.
+"""
+
+import os
+import json
+import time
+import hashlib
+import shutil
+import pathlib
+import multiprocessing
+
+import numpy as np
+
+from ..utils.las_utils import tile_las_file, merge_las_files, subsample_las_file, get_points_in_file
+from ..utils.index_utils import write_tile_index
+from ..utils.metrics_utils import PipelineMetrics, run_file
+from ..utils.plan_utils import plan_work, get_points_per_iter
+from ..utils.queue_utils import JobQueue
+
+# Default queue folder, inside the output folder.
+QUEUE_FOLDER = '.queue'
+
+
+def run_coordinator(in_folder, out_folder, queue_folder=None, out_prefix='filtered_', glob_pattern='**/*.laz',
+                    points_per_iter=None, tile_size=50, grid_size=0.01, min_points=2_000_000, roi=None,
+                    extension='.laz', subsample_points_per_iter=None, chunks_per_job=None, lease_seconds=600,
+                    max_attempts=3, poll_seconds=5, local_workers=0, laz_backend=None, metrics=None):
+    """Tile and subsample a folder with distributed workers, see the module docstring.
+
+    The result equals that of `tile_las_folder` followed by `subsample_las_folder`: the shards of each tile
+    are merged in input order, and tiles with `min_points` points or less are not subsampled. A coordinator
+    that is restarted on the same queue folder continues where it stopped, as jobs are only submitted and run
+    once; remove the queue folder to start over. The tile jobs are numbered by input file, so the queue
+    records a fingerprint of the input files, and a restart with other input files is refused.
+
+    Args:
+        in_folder: The path to the input directory containing LAS files.
+        out_folder: The output directory for the (subsampled) tiles and the tile index.
+        queue_folder: The queue folder, on storage shared by all nodes. Defaults to None, which uses
+            `QUEUE_FOLDER` in `out_folder`.
+        out_prefix: A prefix for the names of the tiles. Defaults to 'filtered_'.
+        glob_pattern: The pattern used to find LAS files in the input directory. Defaults to '**/*.laz'.
+        points_per_iter: The number of points per chunk. Defaults to None, which reuses that of an existing
+            queue, or derives it from the available memory of the coordinator (see
+            `plan_utils.get_points_per_iter`).
+        tile_size: The size of each tile. Defaults to 50.
+        grid_size: The size of the grid cell used in the subsampling process. Defaults to 0.01.
+        min_points: Tiles with this number of points or less are not subsampled. Defaults to 2,000,000.
+        roi: Optional region of interest, a bbox (x_min, y_min, x_max, y_max) or a polygon [(x, y), ...].
+        extension: The extension of the shards and tiles, '.laz' or '.las'. Defaults to '.laz'.
+        subsample_points_per_iter: Stream tiles in chunks of this many points while subsampling.
+            Defaults to None (read at once).
+        chunks_per_job: Split input files into tile jobs of this many chunks. Defaults to None (a job per file).
+        lease_seconds: The time after which the lease of a job that is not renewed expires. Defaults to 600.
+        max_attempts: The number of failed attempts after which a job is not retried. Defaults to 3.
+        poll_seconds: The interval at which the queue is checked. Defaults to 5.
+        local_workers: The number of workers to start on this node. Defaults to 0.
+        laz_backend: The LAZ backend name of the local workers, see `tile_writer.get_laz_backend`.
+            Defaults to None (laspy's default).
+        metrics: Optional `PipelineMetrics` to merge the metrics of all jobs into. Defaults to None.
+
+    Returns:
+        The set of tile codes written to.
+
+    Raises:
+        ValueError: If the queue folder holds a queue with different parameters or input files.
+    """
+    out_folder = pathlib.Path(out_folder)
+    out_folder.mkdir(parents=True, exist_ok=True)
+    queue_folder = pathlib.Path(queue_folder) if queue_folder else out_folder / QUEUE_FOLDER
+    metrics = metrics if metrics is not None else PipelineMetrics()
+
+    files = sorted(pathlib.Path(in_folder).glob(glob_pattern))
+    print(f'Distributed tiling. Found {len(files)} files.')
+    plan = plan_work(files, tile_size, roi=roi)
+    if points_per_iter is None:
+        # A restarted coordinator keeps the chunk size of the queue, as the tile jobs depend on it.
+        if JobQueue.exists(queue_folder):
+            points_per_iter = JobQueue(queue_folder).params['points_per_iter']
+        else:
+            points_per_iter = get_points_per_iter(max((scan['point_size'] for scan in plan.scans), default=0))
+
+    params = dict(inputs=get_inputs_fingerprint(in_folder, plan.scans),
+                  out_folder=str(out_folder), out_prefix=out_prefix, tile_size=tile_size,
+                  points_per_iter=points_per_iter, grid_size=grid_size, min_points=min_points, roi=roi,
+                  extension=extension, subsample_points_per_iter=subsample_points_per_iter)
+    queue = JobQueue.create(queue_folder, params, lease_seconds, max_attempts)
+
+    # Tile jobs, in input order and chunk order, which is the merge order of the shards.
+    for i, scan in enumerate(plan.scans):
+        n_chunks = max(1, int(np.ceil(scan['point_count'] / points_per_iter)))
+        step = chunks_per_job or n_chunks
+        for start in range(0, n_chunks, step):
+            queue.submit(f'tile-{i:06d}-{start:06d}',
+                         {'type': 'tile', 'file': str(scan['file']), 'start_chunk': start,
+                          'stop_chunk': start + step if chunks_per_job else None})
+
+    workers = start_local_workers(queue_folder, local_workers, poll_seconds, laz_backend)
+    try:
+        _wait(queue, 'tile-', poll_seconds)
+        shards, sources = {}, {}
+        for job_id, result in _collect(queue, 'tile-', 'tile', metrics):
+            for tile_code in result['tile_codes']:
+                shards.setdefault(tile_code, []).append(result['shard'])
+                sources.setdefault(tile_code, set()).add(result['file'])
+
+        for tile_code, tile_shards in shards.items():
+            queue.submit(f'subsample-{tile_code}', {'type': 'subsample', 'tile_code': tile_code,
+                                                    'shards': tile_shards})
+        _wait(queue, 'subsample-', poll_seconds)
+        written = {result['tile_code'] for _, result in _collect(queue, 'subsample-', 'subsample', metrics)}
+    finally:
+        queue.close()
+        for worker in workers:
+            worker.join()
+
+    shutil.rmtree(queue.folder / 'shards', ignore_errors=True)
+    sources = {tile_code: files for tile_code, files in sources.items() if tile_code in written}
+    write_tile_index(out_folder, out_prefix, tile_size, extension, sources=sources)
+    return written
+
+
+def get_inputs_fingerprint(in_folder, scans):
+    """SHA-1 of the paths (relative to `in_folder`) and point counts of the input files, in input order."""
+    inputs = [(str(pathlib.Path(scan['file']).relative_to(in_folder)), scan['point_count']) for scan in scans]
+    return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+
+def _wait(queue, prefix, poll_seconds):
+    """Wait for a phase, printing its progress when it changes."""
+    last = None
+
+    def report(status):
+        nonlocal last
+        if status != last:
+            print(f"{prefix.rstrip('-')} jobs: {status['done']} done, {status['running']} running, "
+                  f"{status['pending']} pending, {status['failed']} failed")
+            last = status
+
+    return queue.wait(prefix, poll_seconds, callback=report)
+
+
+def _collect(queue, prefix, stage, metrics):
+    """Yield (job_id, result) of the finished jobs of a phase, merging their metrics and recording failures."""
+    for job_id in queue.job_ids(prefix):
+        done = queue.get_result(job_id)
+        if done is None:
+            failure = queue.get_failure(job_id) or {'error': 'unknown'}
+            print(f"Failed to run job: {job_id}")
+            print(failure['error'])
+            metrics.record_file(stage, job_id, None, error=RuntimeError(failure['error']))
+            continue
+        metrics.merge(done['result'].pop('metrics'))
+        yield job_id, done['result']
+
+
+def run_worker(queue_folder, worker_id=None, poll_seconds=5, laz_backend=None, max_jobs=None):
+    """Claim and run jobs of a queue until it is closed (and empty), see the module docstring.
+
+    Args:
+        queue_folder: The queue folder of the coordinator.
+        worker_id: The name of the worker in the leases. Defaults to None ('<host>-<pid>').
+        poll_seconds: The interval at which the queue is checked when there are no jobs. Defaults to 5.
+        laz_backend: The LAZ backend name, see `tile_writer.get_laz_backend`. Defaults to None (laspy's default).
+        max_jobs: Stop after this number of jobs. Defaults to None (no limit).
+
+    Returns:
+        The number of jobs run, including failed jobs.
+    """
+    while not JobQueue.exists(queue_folder):
+        time.sleep(poll_seconds)
+    queue = JobQueue(queue_folder, worker_id)
+
+    n_jobs = 0
+    while max_jobs is None or n_jobs < max_jobs:
+        job = queue.claim()
+        if job is None:
+            if queue.closed:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        n_jobs += 1
+        try:
+            with job:
+                result = JOB_TYPES[job['type']](queue, job, laz_backend)
+                if not job.complete(result) and job['type'] == 'tile':
+                    # Another attempt of the job finished first, its shards are used.
+                    shutil.rmtree(queue.folder / 'shards' / result['shard'], ignore_errors=True)
+        except Exception as e:
+            print(f"Failed to run job: {job.id}")
+            print(e)
+    return n_jobs
+
+
+def start_local_workers(queue_folder, workers, poll_seconds=5, laz_backend=None):
+    """Start worker processes on this node, see `run_worker`. Returns the list of processes."""
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=run_worker, args=(queue_folder,),
+                             kwargs=dict(poll_seconds=poll_seconds, laz_backend=laz_backend))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def _run_tile_job(queue, job, laz_backend=None):
+    """Tile a file (or a range of its chunks) into a shard folder of this attempt."""
+    params = queue.params
+    shard = f"{job.id}.{job.token}"
+    shard_folder = queue.folder / 'shards' / shard
+    metrics = PipelineMetrics()
+    tile_codes, error = run_file('tile', job['file'], metrics, tile_las_file, job['file'], shard_folder,
+                                 params['out_prefix'], tile_size=params['tile_size'],
+                                 points_per_iter=params['points_per_iter'], roi=params['roi'],
+                                 start_chunk=job['start_chunk'], stop_chunk=job['stop_chunk'],
+                                 extension=params['extension'], laz_backend=laz_backend)
+    try:
+        if error is not None:
+            raise error
+        # Another attempt may be running: its shard is used instead.
+        job.check_lease()
+    except Exception:
+        shutil.rmtree(shard_folder, ignore_errors=True)
+        raise
+    return {'file': job['file'], 'shard': shard, 'tile_codes': sorted(tile_codes), 'metrics': metrics.to_dict()}
+
+
+def _run_subsample_job(queue, job, laz_backend=None):
+    """Merge the shards of a tile into a temporary file, subsample it and move it into place.
+
+    A duplicate attempt writes the same tile, so replacing the tile is harmless.
+    """
+    params = queue.params
+    name = f"{params['out_prefix']}{job['tile_code']}{params['extension']}"
+    out_file = pathlib.Path(params['out_folder']) / name
+    tmp_file = out_file.with_name(f".{job.token}.{name}")
+    metrics = PipelineMetrics()
+    try:
+        with metrics.timer('merge'):
+            merge_las_files([queue.folder / 'shards' / shard / name for shard in job['shards']], tmp_file,
+                            params['points_per_iter'], laz_backend)
+        if get_points_in_file(tmp_file) > params['min_points']:
+            _, error = run_file('subsample', out_file, metrics, subsample_las_file, tmp_file, tmp_file,
+                                params['grid_size'], points_per_iter=params['subsample_points_per_iter'],
+                                laz_backend=laz_backend)
+            if error is not None:
+                raise error
+        job.check_lease()
+        os.replace(tmp_file, out_file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    return {'tile_code': job['tile_code'], 'metrics': metrics.to_dict()}
+
+
+JOB_TYPES = {'tile': _run_tile_job, 'subsample': _run_subsample_job}
@@ -0,0 +1,184 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Tile index utility methods - Module (Python)
+
+A tile index is a compact NumPy table (`tile_index.npz`) stored next to the
+tiles. It records per tile the tile code, file name, tile size, point bounds,
+point count, byte size and source files, so that downstream jobs can plan their
+work and run bbox/radius queries without opening the tiles themselves.
+"""
+
+import os
+import pathlib
+
+import laspy
+import numpy as np
+
+from ..utils.plan_utils import parse_tile_code
+
+INDEX_FILE = 'tile_index.npz'
+
+# Separator for the list of source files of a tile.
+SOURCE_SEP = '\n'
+
+
+class TileIndex(object):
+    """Table with one row per tile, see the module docstring for the columns.
+
+    Usage:
+        index = TileIndex.load(out_folder)
+        tile_codes = index.query_bbox(x_min, y_min, x_max, y_max).tile_codes
+    """
+
+    COLUMNS = ('tile_code', 'file_name', 'tile_x', 'tile_y', 'tile_size', 'x_min', 'y_min', 'z_min',
+               'x_max', 'y_max', 'z_max', 'point_count', 'byte_size', 'sources')
+
+    def __init__(self, data):
+        self.data = {col: np.asarray(data[col]) for col in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.data['tile_code'])
+
+    def __getitem__(self, col):
+        return self.data[col]
+
+    @property
+    def tile_codes(self):
+        return [str(code) for code in self.data['tile_code']]
+
+    def get_sources(self, i):
+        """List of source files of the i-th tile."""
+        sources = str(self.data['sources'][i])
+        return sources.split(SOURCE_SEP) if sources else []
+
+    def tile_bounds(self):
+        """Bounds of the tile squares as an array of rows (x_min, y_min, x_max, y_max)."""
+        x_min = self.data['tile_x'] * self.data['tile_size']
+        y_min = self.data['tile_y'] * self.data['tile_size']
+        return np.vstack([x_min, y_min, x_min + self.data['tile_size'],
+                          y_min + self.data['tile_size']]).T
+
+    def select(self, mask):
+        """Subset of the index for a boolean mask or index array."""
+        return TileIndex({col: values[mask] for col, values in self.data.items()})
+
+    def query_bbox(self, x_min, y_min, x_max, y_max):
+        """Tiles whose point bounds intersect the given bbox."""
+        mask = ((self.data['x_min'] <= x_max) & (self.data['x_max'] >= x_min) &
+                (self.data['y_min'] <= y_max) & (self.data['y_max'] >= y_min))
+        return self.select(mask)
+
+    def query_radius(self, x, y, radius):
+        """Tiles whose point bounds are within `radius` of the point (x, y)."""
+        dx = np.maximum(0, np.maximum(self.data['x_min'] - x, x - self.data['x_max']))
+        dy = np.maximum(0, np.maximum(self.data['y_min'] - y, y - self.data['y_max']))
+        return self.select(dx * dx + dy * dy <= radius * radius)
+
+    def save(self, folder):
+        """Write the index to `folder`, replacing an existing index atomically."""
+        path = pathlib.Path(folder) / INDEX_FILE
+        tmp_path = path.with_name(f'.{INDEX_FILE}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self.data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder):
+        with np.load(pathlib.Path(folder) / INDEX_FILE) as data:
+            return cls({col: data[col] for col in cls.COLUMNS})
+
+    @classmethod
+    def exists(cls, folder):
+        return (pathlib.Path(folder) / INDEX_FILE).is_file()
+
+
+def build_tile_index(folder, prefix='', tile_size=50, extension='.laz', sources=None):
+    """Build a `TileIndex` from the headers of the tiles in a folder.
+
+    Args:
+        folder: The folder with the tiles.
+        prefix: The prefix of the tile file names. Defaults to an empty string.
+        tile_size: The size of the tiles, or of the root tiles of quadtree tile codes (see
+            `plan_utils.get_tile_code`). Defaults to 50.
+        extension: The extension of the tile files. Defaults to '.laz'.
+        sources: Optional dict mapping tile codes to their source files.
+
+    Returns:
+        The `TileIndex` of the folder.
+    """
+    rows = {col: [] for col in TileIndex.COLUMNS}
+    for file in sorted(pathlib.Path(folder).glob(f'{prefix}*{extension}')):
+        tile_code = file.name[len(prefix):-len(extension)]
+        try:
+            tile_x, tile_y, level = parse_tile_code(tile_code)
+        except ValueError:
+            continue
+        with laspy.open(file) as las:
+            header = las.header
+
+        rows['tile_code'].append(tile_code)
+        rows['file_name'].append(file.name)
+        rows['tile_x'].append(tile_x)
+        rows['tile_y'].append(tile_y)
+        rows['tile_size'].append(tile_size / 2**level)
+        for col, value in zip(('x_min', 'y_min', 'z_min'), header.mins):
+            rows[col].append(value)
+        for col, value in zip(('x_max', 'y_max', 'z_max'), header.maxs):
+            rows[col].append(value)
+        rows['point_count'].append(header.point_count)
+        rows['byte_size'].append(file.stat().st_size)
+        rows['sources'].append(SOURCE_SEP.join(sorted(str(s) for s in (sources or {}).get(tile_code, ()))))
+
+    dtypes = {'tile_code': str, 'file_name': str, 'tile_x': np.int64, 'tile_y': np.int64, 'tile_size': np.float64,
+              'point_count': np.int64, 'byte_size': np.int64, 'sources': str}
+    return TileIndex({col: np.array(values, dtype=dtypes.get(col, np.float64))
+                      for col, values in rows.items()})
+
+
+def write_tile_index(folder, prefix='', tile_size=None, extension='.laz', sources=None):
+    """Build and save the tile index of a folder.
+
+    If the folder already has an index, the tile size and sources of the tiles it
+    contains are kept unless given, and new sources are added to the existing ones.
+    """
+    old_sources = {}
+    if TileIndex.exists(folder):
+        old = TileIndex.load(folder)
+        if tile_size is None and len(old) > 0:
+            tile_size = float(old['tile_size'][0]) * 2**parse_tile_code(old.tile_codes[0])[2]
+        old_sources = {code: set(old.get_sources(i)) for i, code in enumerate(old.tile_codes)}
+
+    all_sources = old_sources
+    for tile_code, files in (sources or {}).items():
+        all_sources.setdefault(tile_code, set()).update(str(f) for f in files)
+
+    index = build_tile_index(folder, prefix, 50 if tile_size is None else tile_size, extension, all_sources)
+    index.save(folder)
+    return index
+
+
+def refresh_tile_index(folder):
+    """Re-read the headers of the tiles in the index of a folder, e.g. after subsampling in place.
+
+    Tiles that no longer exist are removed from the index.
+    """
+    index = TileIndex.load(folder)
+    if len(index) == 0:
+        return index
+    keep = np.array([(pathlib.Path(folder) / name).is_file() for name in index['file_name']])
+    index = index.select(keep)
+
+    for i, name in enumerate(index['file_name']):
+        file = pathlib.Path(folder) / name
+        with laspy.open(file) as las:
+            header = las.header
+        for col, value in zip(('x_min', 'y_min', 'z_min'), header.mins):
+            index[col][i] = value
+        for col, value in zip(('x_max', 'y_max', 'z_max'), header.maxs):
+            index[col][i] = value
+        index['point_count'][i] = header.point_count
+        index['byte_size'][i] = file.stat().st_size
+
+    index.save(folder)
+    return index
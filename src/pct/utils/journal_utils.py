@@ -0,0 +1,172 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Journal utility methods - Module (Python)
+
+A tiling journal (`tiling_journal.jsonl`) is an append-only log, stored next to
+the tiles, of the input chunks whose points are fully committed to the tiles.
+The tiles touched by a chunk are first written to temporary copies, which are
+renamed into place only after a 'prepare' record listing them is on disk, and a
+'commit' record follows the renames. After a crash an interrupted commit is
+rolled forward (or, without 'prepare' record, its temporary files are removed),
+so that a resumed run restarts at the exact chunk boundary without duplicating
+points.
+"""
+
+import os
+import json
+import shutil
+import pathlib
+
+JOURNAL_FILE = 'tiling_journal.jsonl'
+
+
+class TilingJournal(object):
+    """Journal of the input files and chunk ranges committed to the tiles in a folder.
+
+    Usage:
+        journal = TilingJournal(out_folder, prefix)
+        journal.recover()
+        for chunk, tile_writes in ...:
+            journal.commit(in_file, chunk + 1, tile_writes)
+        journal.mark_done(in_file)
+    """
+
+    def __init__(self, folder, prefix='', extension='.laz', name=JOURNAL_FILE):
+        self.folder = pathlib.Path(folder)
+        self.prefix = prefix
+        self.extension = extension
+        self.path = self.folder / name
+
+        self.params = None
+        self._next_chunk = {}
+        self._done = set()
+        self._sources = {}
+        self._pending = None
+        if self.path.is_file():
+            self._replay()
+
+    @classmethod
+    def exists(cls, folder, name=JOURNAL_FILE):
+        return (pathlib.Path(folder) / name).is_file()
+
+    def get_path(self, tile_code):
+        """Path of a given tile."""
+        return self.folder / f"{self.prefix}{tile_code}{self.extension}"
+
+    def next_chunk(self, file):
+        """Index of the first chunk of an input file that is not committed yet."""
+        return self._next_chunk.get(str(file), 0)
+
+    def is_done(self, file):
+        """Whether all chunks of an input file are committed."""
+        return str(file) in self._done
+
+    @property
+    def sources(self):
+        """Dict with the committed source files of each tile code."""
+        return {code: set(files) for code, files in self._sources.items()}
+
+    def check_params(self, **params):
+        """Record the run parameters, or check them against those of the journalled run.
+
+        Raises:
+            ValueError: If the journal was written with different parameters.
+        """
+        params = json.loads(json.dumps(params))
+        if self.params is None:
+            self._log({'event': 'start', 'params': params})
+            self.params = params
+        elif self.params != params:
+            raise ValueError(f"The journal {self.path} was written with different parameters: "
+                             f"{self.params} != {params}")
+
+    def recover(self):
+        """Finish an interrupted commit and remove stale temporary tiles."""
+        if self._pending is not None:
+            record = self._pending
+            for tile_code in record['tiles']:
+                tmp_path = self._get_tmp_path(tile_code)
+                if tmp_path.is_file():
+                    os.replace(tmp_path, self.get_path(tile_code))
+            self._log({'event': 'commit', 'file': record['file'], 'chunk': record['chunk']})
+            self._apply(record)
+            self._pending = None
+
+        for tmp_path in self.folder.glob(f'.tmp_{self.prefix}*{self.extension}'):
+            tmp_path.unlink()
+
+    def commit(self, file, chunk, tile_writes):
+        """Atomically commit the points of an input file up to (excluding) chunk `chunk`.
+
+        Args:
+            file: The input file.
+            chunk: The index of the next chunk of the input file after this commit.
+            tile_writes: Dict mapping tile codes to a function that writes or appends the
+                new points of the tile to a given path.
+        """
+        for tile_code, write in tile_writes.items():
+            path, tmp_path = self.get_path(tile_code), self._get_tmp_path(tile_code)
+            if path.is_file():
+                shutil.copyfile(path, tmp_path)
+            write(tmp_path)
+            _fsync(tmp_path)
+
+        record = {'file': str(file), 'chunk': int(chunk), 'tiles': sorted(tile_writes)}
+        self._log({'event': 'prepare', **record})
+        for tile_code in record['tiles']:
+            os.replace(self._get_tmp_path(tile_code), self.get_path(tile_code))
+        self._log({'event': 'commit', 'file': record['file'], 'chunk': record['chunk']})
+        self._apply(record)
+
+    def mark_done(self, file):
+        """Record that all chunks of an input file are committed."""
+        self._log({'event': 'done', 'file': str(file)})
+        self._done.add(str(file))
+
+    def _get_tmp_path(self, tile_code):
+        path = self.get_path(tile_code)
+        # Keep the extension, so the temporary tile is compressed like the tile.
+        return path.with_name(f".tmp_{path.name}")
+
+    def _apply(self, record):
+        self._next_chunk[record['file']] = record['chunk']
+        for tile_code in record['tiles']:
+            self._sources.setdefault(tile_code, set()).add(record['file'])
+
+    def _log(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay(self):
+        with open(self.path) as f:
+            lines = f.readlines()
+
+        for i, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if i < len(lines) - 1:
+                    raise
+                # A record torn by a crash, drop it.
+                with open(self.path, 'w') as f:
+                    f.writelines(lines[:i])
+                break
+
+            event = record['event']
+            if event == 'start':
+                self.params = record['params']
+            elif event == 'prepare':
+                self._pending = record
+            elif event == 'commit':
+                self._apply(self._pending)
+                self._pending = None
+            elif event == 'done':
+                self._done.add(record['file'])
+
+
+def _fsync(path):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
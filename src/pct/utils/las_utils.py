@@ -9,60 +9,357 @@ https://github.com/Amsterdam-AI-Team/Urban_PointCloud_Processing
 
 import re
 import os
+import copy
+import json
 import glob
 import laspy
+import shutil
 import pathlib
+import tempfile
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
-import pycc
-import cccorelib
+try:
+    import pycc
+    import cccorelib
+except ImportError:
+    pycc = cccorelib = None
 
 import numpy as np
 from tqdm import tqdm
 
-from ..utils.math_utils import get_octree_level
+from ..utils.math_utils import get_octree_level, get_octree_bbox, voxel_subsample, VoxelSubsampler
+from ..utils.tile_writer import TileWriterPool, get_laz_backend
+from ..utils.index_utils import TileIndex, write_tile_index, refresh_tile_index
+from ..utils.journal_utils import TilingJournal, JOURNAL_FILE
+from ..utils.manifest_utils import InputManifest, MANIFEST_FILE, fingerprint_files
+from ..utils.metrics_utils import PipelineMetrics, run_file, run_file_worker
+from ..utils.plan_utils import (plan_work, scan_headers, is_copc, get_roi_bbox, bbox_intersects_roi,
+                                points_in_roi, get_lpt_order, get_bbox_tile_codes, get_points_per_iter,
+                                parse_tile_code, estimate_cell_counts, sort_scans_spatially,
+                                get_available_memory, TileQuadtree)
 
 FILE_TYPES = ('.LAS', '.las', '.LAZ', '.laz')
 
+# Extra dimension of buffered tiles, marking the points in the buffer margin of a tile.
+BUFFER_DIMENSION = 'buffer'
+
+# Estimated peak memory of subsample_las_file per input point (LAS record, coordinate and cloud copies).
+SUBSAMPLE_BYTES_PER_POINT = 160
+# Worst case memory per input point of the per-voxel state when streaming (one voxel per point, during a merge).
+VOXEL_STATE_BYTES_PER_POINT = 72
+
 
 def get_bbox_from_tile_code(tile_code, padding=0, width=50, height=50):
     """Get bbox for a given tilecode: ((x_min, y_max), (x_max, y_min))"""
-    tile_split = tile_code.split('_')
+    tile_x, tile_y, level = parse_tile_code(tile_code)
 
     # The tile code of each tile is defined as
-    # 'X-coordinaat/50'_'Y-coordinaat/50'
-    x_min = int(tile_split[0]) * 50
-    y_min = int(tile_split[1]) * 50
+    # 'X-coordinaat/width'_'Y-coordinaat/height', where quadtree tiles at level L
+    # (code 'X_Y_L') are 2**L times smaller than the root tiles.
+    width, height = width / 2**level, height / 2**level
+    x_min = tile_x * width
+    y_min = tile_y * height
 
     return ((x_min - padding, y_min + height + padding),
-            (x_min + height + padding, y_min - padding))
+            (x_min + width + padding, y_min - padding))
 
 
-def get_tilecode_from_filename(filename):
-    """Extract the tile code from a file name."""
-    return re.match(r'.*(\d{4}_\d{4}).*', filename)[1]
+def get_tilecode_from_filename(filename, prefix=''):
+    """Extract the tile code ('X_Y' or 'X_Y_L') from a file name, between the prefix and the extension.
+
+    The prefix is stripped before parsing, as a prefix ending in digits (e.g. 'ahn4_') can not be told
+    apart from the tile code otherwise.
+
+    Raises:
+        ValueError: If the file name does not start with `prefix`, or is not followed by a tile code.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if not stem.startswith(prefix) or re.fullmatch(r'-?\d+_-?\d+(?:_\d+)?', stem[len(prefix):]) is None:
+        raise ValueError(f"No tile code after the prefix '{prefix}' in file name: {filename}")
+    return stem[len(prefix):]
 
 
 def get_tilecodes_from_folder(las_folder, las_prefix='', extension='.laz'):
     """Get a set of unique tilecodes for the LAS files in a given folder."""
     files = pathlib.Path(las_folder).glob(f'{las_prefix}*{extension}')
-    tilecodes = set([get_tilecode_from_filename(file.name) for file in files])
+    tilecodes = set([get_tilecode_from_filename(file.name, las_prefix) for file in files])
     return tilecodes
 
 
-def tile_las_file(in_file, out_folder, prefix='', tile_size=50, points_per_iter=40_000_000):
+def partition_by_tile(x, y, tile_size=50):
+    """Group points by the tile they fall in, using a single sort.
+
+    Integer tile keys are computed with floor division, after which the points are
+    argsorted once on their combined key. Each tile then corresponds to a contiguous
+    slice of the sort order. The sort is stable, so indices within a tile keep their
+    original (ascending) order.
+
+    Args:
+        x: Array with the x-coordinates of the points.
+        y: Array with the y-coordinates of the points.
+        tile_size: The size of each spatial tile. Defaults to 50.
+
+    Yields:
+        Tuples (tile_code, indices) with the tile code 'X/tile_size'_'Y/tile_size' and
+        the indices of the points that fall in that tile.
+    """
+    tile_x = np.floor_divide(np.asarray(x), tile_size).astype(np.int64)
+    tile_y = np.floor_divide(np.asarray(y), tile_size).astype(np.int64)
+    if len(tile_x) == 0:
+        return
+
+    # Combine both tile indices in a single (non-negative) integer key.
+    x_min, y_min = tile_x.min(), tile_y.min()
+    n_y = tile_y.max() - y_min + 1
+    keys = (tile_x - x_min) * n_y + (tile_y - y_min)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.diff(sorted_keys, prepend=sorted_keys[0] - 1))
+    ends = np.append(starts[1:], len(order))
+
+    for start, end in zip(starts, ends):
+        first = order[start]
+        yield f"{tile_x[first]}_{tile_y[first]}", order[start:end]
+
+
+def partition_by_buffered_tile(x, y, tile_size=50, buffer=0):
+    """Group points by the tiles they fall in when each tile is extended by a buffer margin.
+
+    A point falls in its own (core) tile and in the buffers of all neighbouring tiles within `buffer` of it,
+    so points near tile boundaries are assigned to several tiles. As in `partition_by_tile` the indices
+    within a tile are in ascending order.
+
+    Args:
+        x: Array with the x-coordinates of the points.
+        y: Array with the y-coordinates of the points.
+        tile_size: The size of each spatial tile. Defaults to 50.
+        buffer: The buffer margin around each tile. Defaults to 0.
+
+    Yields:
+        Tuples (tile_code, indices, is_buffer) with the tile code, the indices of the points that fall in the
+        buffered tile and a boolean array marking the points in the buffer (outside the core tile).
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    tile_x = np.floor_divide(x, tile_size).astype(np.int64)
+    tile_y = np.floor_divide(y, tile_size).astype(np.int64)
+    if len(tile_x) == 0:
+        return
+
+    # Candidate (point, tile) pairs for all tile offsets within the buffer, kept if inside the buffered tile.
+    n = int(np.ceil(buffer / tile_size))
+    pairs_idx, pairs_x, pairs_y = [], [], []
+    for dx in range(-n, n + 1):
+        in_x = (x >= (tile_x + dx) * tile_size - buffer) & (x < (tile_x + dx + 1) * tile_size + buffer)
+        for dy in range(-n, n + 1):
+            idx = np.flatnonzero(in_x & (y >= (tile_y + dy) * tile_size - buffer) &
+                                 (y < (tile_y + dy + 1) * tile_size + buffer))
+            pairs_idx.append(idx)
+            pairs_x.append(tile_x[idx] + dx)
+            pairs_y.append(tile_y[idx] + dy)
+    pairs_idx = np.concatenate(pairs_idx)
+    pairs_x = np.concatenate(pairs_x)
+    pairs_y = np.concatenate(pairs_y)
+
+    x_min, y_min = pairs_x.min(), pairs_y.min()
+    n_y = pairs_y.max() - y_min + 1
+    keys = (pairs_x - x_min) * n_y + (pairs_y - y_min)
+
+    order = np.lexsort((pairs_idx, keys))
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.diff(sorted_keys, prepend=sorted_keys[0] - 1))
+    ends = np.append(starts[1:], len(order))
+
+    for start, end in zip(starts, ends):
+        first = order[start]
+        idx = pairs_idx[order[start:end]]
+        is_buffer = (tile_x[idx] != pairs_x[first]) | (tile_y[idx] != pairs_y[first])
+        yield f"{pairs_x[first]}_{pairs_y[first]}", idx, is_buffer
+
+
+def get_buffered_header(header):
+    """Copy of a header with the extra dimension `BUFFER_DIMENSION` (1 for buffer points, 0 for core points)."""
+    header = copy.deepcopy(header)
+    if BUFFER_DIMENSION not in header.point_format.dimension_names:
+        header.add_extra_dim(laspy.ExtraBytesParams(name=BUFFER_DIMENSION, type=np.uint8,
+                                                    description="Tile buffer point"))
+    return header
+
+
+def set_buffer_flag(points, header, is_buffer):
+    """Copy of a point record in the point format of a buffered header, with the buffer dimension set."""
+    dtype = header.point_format.dtype()
+    records = np.ascontiguousarray(points.array)
+    if records.dtype.itemsize != dtype.itemsize:
+        # The extra bytes follow the other dimensions, so all of these are copied at once as raw bytes.
+        raw = records.view(np.uint8).reshape(len(records), -1)
+        records = np.zeros(len(raw), dtype=dtype)
+        records.view(np.uint8).reshape(len(raw), -1)[:, :raw.shape[1]] = raw
+    elif records is points.array:
+        records = records.copy()
+    records = records.view(dtype)
+    records[BUFFER_DIMENSION] = is_buffer
+    return laspy.ScaleAwarePointRecord(records, header.point_format, points.scales, points.offsets)
+
+
+def iter_tile_points(points, tile_size=50, buffer=0, header=None, tile_codes=None, quadtree=None):
+    """Split a point record by tile, see `partition_by_tile`.
+
+    With a `buffer` the tiles are extended by the buffer margin (see `partition_by_buffered_tile`), and the
+    tile points are converted to the point format of the buffered `header` (see `get_buffered_header`).
+    With a `quadtree` (see `plan_utils.TileQuadtree`) the points are split by its adaptive tiles instead.
+
+    Args:
+        points: The point record.
+        tile_size: The size of each spatial tile. Defaults to 50.
+        buffer: The buffer margin around each tile. Defaults to 0.
+        header: The buffered header, required with a `buffer`. Defaults to None.
+        tile_codes: Optional set of tile codes, only these tiles are returned. Defaults to None.
+        quadtree: Optional `TileQuadtree`, which replaces the regular grid. Defaults to None.
+
+    Yields:
+        Tuples (tile_code, tile_points).
+    """
+    if quadtree is not None:
+        for tile_code, clip_idx in quadtree.partition(points.x, points.y):
+            if tile_codes is None or tile_code in tile_codes:
+                yield tile_code, points[clip_idx]
+    elif buffer > 0:
+        for tile_code, clip_idx, is_buffer in partition_by_buffered_tile(points.x, points.y, tile_size, buffer):
+            if tile_codes is None or tile_code in tile_codes:
+                yield tile_code, set_buffer_flag(points[clip_idx], header, is_buffer)
+    else:
+        for tile_code, clip_idx in partition_by_tile(points.x, points.y, tile_size):
+            if tile_codes is None or tile_code in tile_codes:
+                yield tile_code, points[clip_idx]
+
+
+def iter_las_chunks(in_file, points_per_iter, roi=None, start_chunk=0, stop_chunk=None):
+    """Iterate over the points of a LAS file in chunks, keeping only the points inside the ROI.
+
+    Files whose header bbox does not intersect the ROI are skipped without being read. For COPC files only
+    the octree nodes intersecting the bbox of the ROI are read and decompressed. The chunks of uncompressed
+    LAS files are views into a memory map of the point records (see `iter_mapped_las_chunks`).
+
+    Args:
+        in_file: The path to the LAS file.
+        points_per_iter: The maximum number of points per chunk.
+        roi: Optional region of interest, a bbox (x_min, y_min, x_max, y_max) or a polygon [(x, y), ...].
+        start_chunk: Skip the chunks before this chunk index. Defaults to 0.
+        stop_chunk: Stop before this chunk index. Defaults to None (read to the end of the file).
+    """
+    for _, points in iter_indexed_las_chunks(in_file, points_per_iter, roi, start_chunk, stop_chunk):
+        if len(points) > 0:
+            yield points
+
+
+def iter_indexed_las_chunks(in_file, points_per_iter, roi=None, start_chunk=0, stop_chunk=None):
+    """Like `iter_las_chunks`, but yields (chunk index, points) for every chunk, including empty ones.
+
+    Chunk i holds the points [i * points_per_iter, (i + 1) * points_per_iter) of the file, before ROI
+    filtering, so chunk indices are stable between runs with the same `points_per_iter`. The reader seeks
+    directly to `start_chunk`, and stops before `stop_chunk`. A `start_chunk` at or past the end of the file
+    (e.g. a resumed file whose last chunk was committed) yields no chunks.
+    """
+    with laspy.open(in_file) as in_las:
+        if roi is not None and not bbox_intersects_roi(in_las.header.mins, in_las.header.maxs, roi):
+            return
+        if start_chunk > 0 and start_chunk * points_per_iter >= in_las.header.point_count:
+            return
+
+        if roi is not None and is_copc(in_las.header):
+            if start_chunk > 0:
+                return
+            x_min, y_min, x_max, y_max = get_roi_bbox(roi)
+            with laspy.CopcReader.open(in_file) as copc_reader:
+                chunks = [copc_reader.query(laspy.Bounds(mins=np.array([x_min, y_min]),
+                                                         maxs=np.array([x_max, y_max])))]
+        elif not in_las.header.are_points_compressed:
+            chunks = iter_mapped_las_chunks(in_file, in_las.header, points_per_iter, start_chunk)
+        else:
+            if start_chunk > 0:
+                in_las.seek(start_chunk * points_per_iter)
+            chunks = in_las.chunk_iterator(points_per_iter)
+
+        for chunk, points in enumerate(chunks, start_chunk):
+            if stop_chunk is not None and chunk >= stop_chunk:
+                break
+            if roi is not None:
+                points = points[points_in_roi(points.x, points.y, roi)]
+            yield chunk, points
+
+
+def iter_mapped_las_chunks(in_file, header, points_per_iter, start_chunk=0):
+    """Iterate over the points of an uncompressed LAS file in chunks, without copying them.
+
+    The point records are memory-mapped, and each chunk is a view into the map, so reading is left to the
+    OS page cache. Indexing a chunk (e.g. with the indices of a tile) gathers the records straight from
+    the map. The map is copy-on-write: rescaling a chunk in place does not modify the file.
+
+    Args:
+        in_file: The path to the LAS file.
+        header: The header of the LAS file.
+        points_per_iter: The maximum number of points per chunk.
+        start_chunk: Skip the chunks before this chunk index. Defaults to 0.
+    """
+    if header.point_count == 0:
+        return
+    records = np.memmap(in_file, dtype=header.point_format.dtype(), mode='c',
+                        offset=header.offset_to_point_data, shape=(header.point_count,))
+    for start in range(start_chunk * points_per_iter, header.point_count, points_per_iter):
+        yield laspy.ScaleAwarePointRecord(records[start:start + points_per_iter], header.point_format,
+                                          header.scales, header.offsets)
+
+
+def tile_las_file(in_file, out_folder, prefix='', tile_size=50, points_per_iter=None,
+                  max_open_files=128, max_buffer_bytes=1_000_000_000, roi=None, start_chunk=0, stop_chunk=None,
+                  journal=None, tile_codes=None, extension='.laz', laz_backend=None, buffer=0, quadtree=None,
+                  metrics=None):
     """Processes a single LAS file to generate multiple tiled LAS files based on specified tile dimensions.
 
     This function opens a LAS file and partitions its point cloud data into smaller, geospatially defined
     tiles. It saves each tile as a new LAS file in the specified output folder. The tiling is based on 
     a grid defined by `tile_size`, with the number of points processed per iteration controlled by
-    `points_per_iter`. This allows handling of large point clouds efficiently.
+    `points_per_iter`. This allows handling of large point clouds efficiently. Tile writers are kept
+    open in a `TileWriterPool`, which buffers points per tile and writes them in large batches.
+    Uncompressed LAS inputs are memory-mapped instead of being copied chunk by chunk.
+
+    With a `journal` (see `journal_utils.TilingJournal`) the tiles touched by each chunk are instead updated
+    atomically and the chunk is committed to the journal, starting after the last committed chunk of the file.
+
+    With a `buffer` each tile is extended by a buffer margin, so points near tile boundaries are written to
+    several tiles in the same pass. The tiles get the extra dimension `BUFFER_DIMENSION`, which is 0 for the
+    core points of the tile and 1 for the points in its buffer.
+
+    With a `quadtree` (see `plan_utils.TileQuadtree`) the points are tiled by its adaptive tiles instead of
+    the regular `tile_size` grid.
 
     Args:
         in_file: The path to the input LAS file.
         out_folder: The directory where the tiled LAS files will be saved.
         prefix: An optional prefix for the output file names. Defaults to an empty string.
         tile_size: The size of each spatial tile, in the same units as the point coordinates. Defaults to 50.
-        points_per_iter: The maximum number of points to process in each iteration. Defaults to 40,000,000.
+        points_per_iter: The maximum number of points to process in each iteration. Defaults to None, which
+            derives it from the available memory (see `plan_utils.get_points_per_iter`).
+        max_open_files: The maximum number of tile writers kept open at the same time. Defaults to 128.
+        max_buffer_bytes: The maximum number of bytes of points buffered before flushing. Defaults to 1 GB.
+        roi: Optional region of interest, only points inside are tiled (see `iter_las_chunks`). Defaults to None.
+        start_chunk: Skip the chunks before this chunk index. Defaults to 0.
+        stop_chunk: Stop before this chunk index, to tile a range of chunks of a file. Defaults to None.
+        journal: Optional `TilingJournal` of `out_folder` to commit each chunk to. Defaults to None.
+        tile_codes: Optional set of tile codes, only the points of these tiles are written. Defaults to None.
+        extension: The extension of the tiles, '.laz' (compressed) or '.las' (uncompressed). Defaults to '.laz'.
+        laz_backend: The LAZ backend name, see `tile_writer.get_laz_backend`. Defaults to None (laspy's default).
+        buffer: The buffer margin around each tile, in the units of `tile_size`. Defaults to 0 (no buffer).
+        quadtree: Optional `TileQuadtree` for adaptive tiling. Defaults to None.
+        metrics: Optional `PipelineMetrics` to add the timers and counters of the 'read', 'partition' and
+            'write' stages to. Defaults to None.
+
+    Returns:
+        The set of tile codes written to.
 
     Raises:
         FileNotFoundError: If the input LAS file does not exist.
@@ -72,40 +369,83 @@ def tile_las_file(in_file, out_folder, prefix='', tile_size=50, points_per_iter=
     
     if not os.path.isdir(out_folder):
         pathlib.Path(out_folder).mkdir(parents=True, exist_ok=True)
-    
+    metrics = metrics if metrics is not None else PipelineMetrics()
+
+    if points_per_iter is None:
+        with laspy.open(in_file) as in_las:
+            points_per_iter = get_points_per_iter(in_las.header.point_format.size, reserved_bytes=max_buffer_bytes)
+
     with laspy.open(in_file) as in_las:
-        x_bins = np.arange(in_las.header.x_min//tile_size - 1, 2 + in_las.header.x_max//tile_size, dtype=int) * tile_size
-        y_bins = np.arange(in_las.header.y_min//tile_size - 1, 2 + in_las.header.y_max//tile_size, dtype=int) * tile_size
-        
+        header = get_buffered_header(in_las.header) if buffer > 0 else in_las.header
+
+    if journal is not None:
+        return _tile_las_file_journaled(in_file, journal, header, tile_size, points_per_iter, roi, tile_codes,
+                                        laz_backend, buffer, quadtree, metrics)
+    
+    with laspy.open(in_file) as in_las, \
+         TileWriterPool(out_folder, header, prefix, extension, max_open_files=max_open_files,
+                        max_buffer_bytes=max_buffer_bytes, laz_backend=laz_backend) as pool:
         with tqdm(total=in_las.header.point_count//points_per_iter + 1, leave=False) as pbar: 
             
-            for points in in_las.chunk_iterator(points_per_iter):
-                tile_codes = np.vstack([np.digitize(points.x, x_bins), np.digitize(points.y, y_bins)]).T - 1
-                for x_ in range(len(x_bins)):
-                    xm_ = np.where(tile_codes[:,0] == x_)[0]
-                    for y_ in np.unique(tile_codes[xm_,1]):
-                        if y_ in range(len(y_bins)):
-                            
-                            clip_idx = xm_[tile_codes[xm_,1] == y_]
-                            
-                            if len(clip_idx) > 0:
-                                tile_code = f"{int(x_bins[x_]//tile_size)}_{int(y_bins[y_]//tile_size)}"
-                                tile_points = points[clip_idx]
-                                output_path = pathlib.Path(out_folder) / f"{prefix}{tile_code}.laz"
-                                
-                                # write or append
-                                if not output_path.is_file():
-                                    with laspy.open(output_path, mode="w", header=in_las.header) as out_las:
-                                        out_las.write_points(tile_points)
-                                else:
-                                    with laspy.open(output_path, mode="a") as out_las:
-                                        tile_points.change_scaling(offsets=out_las.header.offsets)
-                                        out_las.append_points(tile_points)
+            chunks = iter_las_chunks(in_file, points_per_iter, roi, start_chunk, stop_chunk)
+            for points in metrics.timed('read', chunks):
+                _count_points(metrics, 'tile', 'in', points)
+                for tile_code, tile_points in metrics.timed('partition', iter_tile_points(
+                        points, tile_size, buffer, header, tile_codes, quadtree)):
+                    with metrics.timer('write'):
+                        pool.write(tile_code, tile_points)
+                    _count_points(metrics, 'tile', 'out', tile_points)
                 pbar.update()
+
+        # Flush the remaining buffers within the write stage.
+        with metrics.timer('write'):
+            pool.close()
+    return pool.tile_codes
+
+
+def _count_points(metrics, stage, direction, points):
+    metrics.count(f'{stage}_points_{direction}', len(points))
+    metrics.count(f'{stage}_bytes_{direction}', points.array.nbytes)
+
+
+def _tile_las_file_journaled(in_file, journal, header, tile_size, points_per_iter, roi, tile_codes=None,
+                             laz_backend=None, buffer=0, quadtree=None, metrics=None):
+    """Tile a file chunk by chunk, committing each chunk to the journal."""
+    write = functools.partial(_write_tile_points, header=header, laz_backend=get_laz_backend(laz_backend))
+    metrics = metrics if metrics is not None else PipelineMetrics()
+
+    written = set()
+    chunks = iter_indexed_las_chunks(in_file, points_per_iter, roi, journal.next_chunk(in_file))
+    for chunk, points in metrics.timed('read', chunks):
+        _count_points(metrics, 'tile', 'in', points)
+        tile_writes = {}
+        for tile_code, tile_points in metrics.timed('partition', iter_tile_points(
+                points, tile_size, buffer, header, tile_codes, quadtree)):
+            tile_writes[tile_code] = functools.partial(write, points=tile_points)
+            _count_points(metrics, 'tile', 'out', tile_points)
+        with metrics.timer('write'):
+            journal.commit(in_file, chunk + 1, tile_writes)
+        written.update(tile_writes)
+    journal.mark_done(in_file)
+    return written
+
+
+def _write_tile_points(path, header, points, laz_backend=None):
+    """Write points to a new tile, or append them to an existing one."""
+    if os.path.isfile(path):
+        with laspy.open(path, mode="a", laz_backend=laz_backend) as out_las:
+            points.change_scaling(offsets=out_las.header.offsets)
+            out_las.append_points(points)
+    else:
+        with laspy.open(path, mode="w", header=header, laz_backend=laz_backend) as out_las:
+            out_las.write_points(points)
   
                                     
 def tile_las_folder(in_folder, out_folder, out_prefix='filtered_', glob_pattern='**/*.laz',
-                    points_per_iter=40_000_000, tile_size=50):
+                    points_per_iter=None, tile_size=50, max_open_files=128,
+                    max_buffer_bytes=1_000_000_000, workers=1, roi=None, resume=False, incremental=False,
+                    extension='.laz', laz_backend=None, buffer=0, max_tile_points=None, max_level=4,
+                    tile_counts='histogram', metrics=None):
     """Tiles all LAS files within a specified directory based on the given tiling parameters.
 
     This function scans a directory for LAS files matching a specific pattern, then processes each file
@@ -113,123 +453,866 @@ def tile_las_folder(in_folder, out_folder, out_prefix='filtered_', glob_pattern=
     organized into tiles of specified size. It handles large files by iterating through points in manageable
     chunks.
 
+    After tiling, a tile index (see `index_utils.TileIndex`) with the bounds, point counts and source
+    files of all tiles is written to the output folder.
+
+    With `workers` > 1 the input files are tiled in a process pool. Each input file is tiled into a private
+    shard folder, after which the shards of each tile are merged in input order. The merged tiles are
+    identical to those of a serial run. Note that the writer limits apply per worker.
+
+    The input headers are first scanned with `plan_utils.plan_work`. Files outside the `roi` are skipped,
+    and in parallel mode the files are scheduled largest first.
+
+    With `resume` the tiling is crash-safe: the chunks committed to the tiles are recorded in a journal (see
+    `journal_utils.TilingJournal`) and each chunk updates its tiles atomically. Rerunning with `resume` after
+    an interruption skips the committed input files and restarts at the exact chunk boundary. The journal
+    requires the same tiling parameters on each run, and the files are tiled serially.
+
+    With `incremental` the input files are fingerprinted (see `manifest_utils.InputManifest`). On a rerun only
+    the tiles of added, changed and removed input files are deleted and rebuilt, from the input files that
+    contribute to them. Tiles of new or changed files are found from their header bounds.
+
+    Intermediate tiles that are subsampled right away can be written uncompressed with `extension` '.las',
+    which saves the LAZ compression and decompression. For '.laz' tiles the `laz_backend` can be selected;
+    by default laspy uses multithreaded lazrs compression if it is installed.
+
+    With a `buffer` the tiles overlap: each tile also holds the points within the buffer margin around it,
+    marked by the extra dimension `BUFFER_DIMENSION` (see `tile_las_file`).
+
+    With `max_tile_points` the tiling is adaptive: `tile_size` is the size of the root tiles, and tiles with
+    more than `max_tile_points` points are split into four, up to `max_level` times (see
+    `plan_utils.TileQuadtree`). The tile codes of split tiles encode their level ('X_Y_L'). The points per
+    tile are counted up front, either exactly with an extra read pass over the coordinates of the inputs
+    ('histogram') or estimated from the headers only ('header'). The quadtree is saved to the output folder.
+
     Args:
         in_folder: The path to the input directory containing LAS files.
         out_folder: The path to the output directory where tiled LAS files will be saved.
         out_prefix: A prefix to append to the names of the output files. Defaults to 'filtered_'.
         glob_pattern: The pattern used to find LAS files in the input directory. Defaults to '**/*.laz'.
-        points_per_iter: The number of points to process in each iteration. Defaults to 40,000,000.
+        points_per_iter: The number of points to process in each iteration. Defaults to None, which derives it
+            from the available memory, the number of workers and the buffer size. A resumed run uses the
+            `points_per_iter` of the journal.
         tile_size: The size of each tile, in units consistent with the LAS file coordinates. Defaults to 50.
+        max_open_files: The maximum number of tile writers kept open at the same time. Defaults to 128.
+        max_buffer_bytes: The maximum number of bytes of points buffered before flushing. Defaults to 1 GB.
+        workers: The number of worker processes. Defaults to 1 (serial).
+        roi: Optional region of interest, a bbox (x_min, y_min, x_max, y_max) or a polygon [(x, y), ...].
+            Only points inside are tiled. Defaults to None.
+        resume: Whether to journal the tiling, and resume from the journal in `out_folder`. Defaults to False.
+        incremental: Whether to only rebuild the tiles of added, changed and removed files. Defaults to False.
+        extension: The extension of the tiles, '.laz' (compressed) or '.las' (uncompressed). Defaults to '.laz'.
+        laz_backend: The LAZ backend name, see `tile_writer.get_laz_backend`. Defaults to None (laspy's default).
+        buffer: The buffer margin around each tile. Defaults to 0 (disjoint tiles).
+        max_tile_points: The target maximum number of points per tile for adaptive tiling. Defaults to None
+            (a regular grid).
+        max_level: The maximum number of splits of a root tile for adaptive tiling. Defaults to 4.
+        tile_counts: How the points per tile are counted for adaptive tiling, 'histogram' or 'header'.
+            Defaults to 'histogram'.
+        metrics: Optional `PipelineMetrics` to add the stage timers, counters and a 'tile' record per input
+            file to, also for files tiled in worker processes. Defaults to None.
+
+    Returns:
+        The set of tile codes written to.
 
     Raises:
         Exception: If an error occurs during the tiling process for any file.
+        ValueError: If resuming or updating with tiling parameters that differ from the earlier run, if
+            both `resume` and `incremental` are set, or if adaptive tiling is combined with `incremental` or
+            a `buffer`.
 
     """
     
+    if resume and incremental:
+        raise ValueError("Resumable tiling cannot be combined with incremental tiling.")
+    if max_tile_points is not None and (incremental or buffer > 0):
+        raise ValueError("Adaptive tiling cannot be combined with incremental tiling or a buffer.")
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    
     # Create out_folder
     if not os.path.isdir(out_folder):
         pathlib.Path(out_folder).mkdir(parents=True, exist_ok=True)
     
-    files = [file for file in pathlib.Path(in_folder).glob(glob_pattern)]
+    files = sorted(pathlib.Path(in_folder).glob(glob_pattern))
     print(f'Tiling Folder. Found {len(files)} files.')
+
+    plan = plan_work(files, tile_size, workers, roi)
+    if roi is not None:
+        print(f'Skipping {len(plan.skipped)} files outside the region of interest.')
+    files = plan.files
+    file_points = [scan['point_count'] for scan in plan.scans]
+
+    if points_per_iter is None:
+        journal = TilingJournal(out_folder, out_prefix, extension) if resume else None
+        if journal is not None and journal.params is not None:
+            points_per_iter = journal.params['points_per_iter']
+        else:
+            point_size = max((scan['point_size'] for scan in plan.scans), default=0)
+            points_per_iter = get_points_per_iter(point_size, workers, reserved_bytes=max_buffer_bytes)
+        print(f'Tiling with {points_per_iter:,d} points per iteration.')
     
-    for in_file in tqdm(files, unit="file"):
-        try:
-            tile_las_file(in_file, out_folder, out_prefix, tile_size=tile_size, points_per_iter=points_per_iter)
-        except Exception as e:
-            print(f"Failed to tile file: {in_file.name}")
-            print(e)
+    tile_kwargs = dict(tile_size=tile_size, points_per_iter=points_per_iter,
+                       max_open_files=max_open_files, max_buffer_bytes=max_buffer_bytes, roi=roi,
+                       extension=extension, laz_backend=laz_backend, buffer=buffer)
+
+    if max_tile_points is not None:
+        tile_kwargs['quadtree'] = _plan_quadtree(plan.scans, out_folder, tile_size, max_tile_points, max_level,
+                                                 tile_counts, resume, points_per_iter, roi)
+    elif TileQuadtree.exists(out_folder):
+        os.remove(pathlib.Path(out_folder) / TileQuadtree.FILE)
+
+    # A run without journal (manifest) invalidates the journal (manifest) of an earlier run.
+    if not resume and TilingJournal.exists(out_folder):
+        os.remove(pathlib.Path(out_folder) / JOURNAL_FILE)
+    if not incremental and InputManifest.exists(out_folder):
+        os.remove(pathlib.Path(out_folder) / MANIFEST_FILE)
+
+    if incremental:
+        params = dict(out_prefix=out_prefix, tile_size=tile_size, roi=roi, buffer=buffer)
+        manifest, fingerprints, changes, tile_codes = _plan_incremental(plan.scans, out_folder, params)
+        keep = [i for i in range(len(files)) if fingerprints[files[i]] is not None]
+        files = [files[i] for i in keep]
+        file_points = [file_points[i] for i in keep]
+        tile_kwargs['tile_codes'] = tile_codes
+
+        # Remove the tiles to rebuild (also subsampled tiles in another format), also from the tile index.
+        for tile_code in tile_codes:
+            for ext in ('.las', '.laz'):
+                (pathlib.Path(out_folder) / f"{out_prefix}{tile_code}{ext}").unlink(missing_ok=True)
+        if TileIndex.exists(out_folder):
+            index = TileIndex.load(out_folder)
+            index.select(~np.isin(index['tile_code'], list(tile_codes))).save(out_folder)
+
+    sources = {}
+    failed = []
+    if resume:
+        if workers > 1:
+            print('Resumable tiling is serial, ignoring workers.')
+        sources = _tile_las_files_journaled(files, out_folder, out_prefix, tile_kwargs, metrics)
+    elif workers > 1:
+        sources, failed = _tile_las_files_parallel(files, out_folder, out_prefix, workers, tile_kwargs, extension,
+                                                   order=get_lpt_order(file_points),
+                                                   metrics=metrics)
+    else:
+        for in_file in tqdm(files, unit="file"):
+            written, error = run_file('tile', in_file, metrics, tile_las_file, in_file, out_folder, out_prefix,
+                                      **tile_kwargs)
+            if error is not None:
+                failed.append(in_file)
+                continue
+            for tile_code in written:
+                sources.setdefault(tile_code, set()).add(str(in_file))
+
+    if incremental:
+        _update_manifest(manifest, fingerprints, changes, sources, failed)
+        manifest.save(out_folder)
+
+    write_tile_index(out_folder, out_prefix, tile_size, extension, sources=sources)
+    return set(sources)
+
+
+def count_points_per_cell(files, cell_size, points_per_iter, roi=None):
+    """Count the points of the files per cell (x, y) of a regular grid, in one read pass.
+
+    Returns:
+        Dict mapping cells (x, y), in units of `cell_size`, to point counts.
+    """
+    counts = {}
+    for in_file in tqdm(files, unit="file", desc="counting"):
+        for points in iter_las_chunks(in_file, points_per_iter, roi):
+            cells = np.vstack([np.floor_divide(points.x, cell_size),
+                               np.floor_divide(points.y, cell_size)]).T.astype(np.int64)
+            cells, n = np.unique(cells, axis=0, return_counts=True)
+            for (cell_x, cell_y), cell_n in zip(cells, n):
+                counts[(int(cell_x), int(cell_y))] = counts.get((int(cell_x), int(cell_y)), 0) + int(cell_n)
+    return counts
+
+
+def _plan_quadtree(scans, out_folder, tile_size, max_points, max_level, tile_counts, resume, points_per_iter,
+                   roi):
+    """Build and save the quadtree for adaptive tiling, or load the saved quadtree when resuming."""
+    if resume and TileQuadtree.exists(out_folder):
+        return TileQuadtree.load(out_folder)
+
+    cell_size = tile_size / 2**max_level
+    if tile_counts == 'header':
+        cell_counts = estimate_cell_counts(scans, cell_size)
+    elif tile_counts == 'histogram':
+        cell_counts = count_points_per_cell([scan['file'] for scan in scans], cell_size, points_per_iter, roi)
+    else:
+        raise ValueError(f"Unknown tile counts: {tile_counts}")
+
+    quadtree = TileQuadtree.build(cell_counts, tile_size, max_points, max_level)
+    quadtree.save(out_folder)
+    print(f'Adaptive tiling into {len(quadtree.tile_codes)} tiles.')
+    return quadtree
+
+
+def _plan_incremental(scans, out_folder, params):
+    """Find the tiles to rebuild, and the input files contributing to them, from the manifest of a folder.
+
+    Returns a tuple (manifest, fingerprints, changes, tile_codes). The fingerprints are keyed by input file
+    and are None for the files that need not be read. Changes is a tuple (added, changed, removed).
+    """
+    params = json.loads(json.dumps(params))
+    manifest = InputManifest.load(out_folder)
+    if len(manifest) > 0 and manifest.params != params:
+        raise ValueError(f"The tiles in {out_folder} were made with different parameters: "
+                         f"{manifest.params} != {params}")
+    manifest.params = params
+
+    fingerprints = fingerprint_files([scan['file'] for scan in scans])
+    added, changed, removed = manifest.diff(fingerprints)
+    print(f'Incremental tiling. {len(added)} added, {len(changed)} changed and {len(removed)} removed files.')
+
+    # The old tiles of changed and removed files, and the tiles overlapping new and changed files.
+    tile_codes = set()
+    for file in changed + removed:
+        tile_codes |= manifest.get_tiles(file)
+    new = set(added + changed)
+    for scan in scans:
+        if str(scan['file']) in new:
+            tile_codes |= get_bbox_tile_codes(scan['mins'] - params['buffer'], scan['maxs'] + params['buffer'],
+                                              params['tile_size'], params['roi'])
 
+    # Only new, changed and unchanged files contributing to the rebuilt tiles are read.
+    fingerprints = {file: (fp if str(file) in new or manifest.get_tiles(file) & tile_codes else None)
+                    for file, fp in fingerprints.items()}
+    print(f'Rebuilding {len(tile_codes)} tiles from {sum(fp is not None for fp in fingerprints.values())} files.')
+    return manifest, fingerprints, (added, changed, removed), tile_codes
 
-def subsample_las_file(in_file, out_file, grid_size=0.01):
+
+def _update_manifest(manifest, fingerprints, changes, sources, failed):
+    """Record the tiles of the new and changed files in the manifest, and drop removed and failed files."""
+    added, changed, removed = changes
+    fingerprints = {str(file): fp for file, fp in fingerprints.items()}
+    file_tiles = {}
+    for tile_code, files in sources.items():
+        for file in files:
+            file_tiles.setdefault(file, set()).add(tile_code)
+
+    for file in removed:
+        manifest.remove(file)
+    for file in set(added + changed):
+        manifest.update(file, fingerprints[file], file_tiles.get(file, ()))
+    # Failed files are tiled again on the next run.
+    for file in failed:
+        manifest.remove(file)
+
+
+def _tile_las_files_journaled(files, out_folder, out_prefix, tile_kwargs, metrics):
+    """Tile files serially with a journal, skipping the chunks committed by an earlier run.
+
+    Returns a dict with the source files of each tile code, including those of the earlier run.
+    """
+    journal = TilingJournal(out_folder, out_prefix, tile_kwargs['extension'])
+    journal.check_params(tile_size=tile_kwargs['tile_size'], points_per_iter=tile_kwargs['points_per_iter'],
+                         roi=tile_kwargs['roi'], buffer=tile_kwargs['buffer'],
+                         adaptive=tile_kwargs.get('quadtree') is not None)
+    journal.recover()
+
+    todo = [in_file for in_file in files if not journal.is_done(in_file)]
+    if len(todo) < len(files):
+        print(f'Resuming. Skipping {len(files) - len(todo)} files that are already tiled.')
+
+    for in_file in tqdm(todo, unit="file"):
+        run_file('tile', in_file, metrics, tile_las_file, in_file, out_folder, out_prefix, journal=journal,
+                 **tile_kwargs)
+    return journal.sources
+
+
+def _get_executor(workers):
+    # Use spawned workers, as forking after numba's (parallel) threading layer was started can deadlock.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def merge_las_files(in_files, out_file, points_per_iter=10_000_000, laz_backend=None):
+    """Concatenate LAS files into a single file, in the given order.
+
+    The header of the first file is used for the output. If `out_file` already exists the points are
+    appended to it instead. Points are rescaled to the offsets of the output file. The output is
+    compressed if its extension is '.laz', see `tile_writer.get_laz_backend` for the `laz_backend`.
+    """
+    laz_backend = get_laz_backend(laz_backend)
+    if os.path.isfile(out_file):
+        out_las = laspy.open(out_file, mode="a", laz_backend=laz_backend)
+        write = out_las.append_points
+    else:
+        with laspy.open(in_files[0]) as first:
+            out_las = laspy.open(out_file, mode="w", header=first.header, laz_backend=laz_backend)
+        write = out_las.write_points
+
+    with out_las:
+        for in_file in in_files:
+            with laspy.open(in_file) as in_las:
+                for points in in_las.chunk_iterator(points_per_iter):
+                    points.change_scaling(offsets=out_las.header.offsets)
+                    write(points)
+
+
+def _tile_las_files_parallel(files, out_folder, out_prefix, workers, tile_kwargs, extension='.laz', order=None,
+                             metrics=None):
+    """Tile files in a process pool using per-file shard folders, then merge the shards per tile.
+
+    The files are submitted in the given `order` (indices into files), the merge always follows the input
+    order. The metrics of the workers are merged into `metrics`, the merge of the shards is timed as a
+    whole. Returns a tuple with a dict with the source files of each tile code, and the list of failed files.
+    """
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    shard_root = pathlib.Path(tempfile.mkdtemp(prefix='.shards_', dir=out_folder))
+    shard_folders = [shard_root / str(i) for i in range(len(files))]
+    sources = {}
+    failed = []
+
+    try:
+        with _get_executor(workers) as executor:
+            order = range(len(files)) if order is None else order
+            futures = {executor.submit(run_file_worker, 'tile', files[i], tile_las_file, files[i], shard_folders[i],
+                                       out_prefix, **tile_kwargs): files[i]
+                       for i in order}
+            for future in tqdm(as_completed(futures), total=len(futures), unit="file"):
+                in_file = futures[future]
+                try:
+                    written, is_failed, report = future.result()
+                except Exception as e:
+                    failed.append(in_file)
+                    metrics.record_file('tile', in_file, None, error=e)
+                    print(f"Failed to tile file: {in_file.name}")
+                    print(e)
+                    continue
+                metrics.merge(report)
+                if is_failed:
+                    failed.append(in_file)
+                    continue
+                for tile_code in written:
+                    sources.setdefault(tile_code, set()).add(str(in_file))
+
+            with metrics.timer('merge'):
+                # Collect the shards of each tile in input order, so the merge matches a serial run.
+                shards = {}
+                for shard_folder in shard_folders:
+                    for shard in sorted(shard_folder.glob(f'{out_prefix}*{extension}')):
+                        shards.setdefault(shard.name, []).append(shard)
+
+                # Tiles with a single shard can simply be moved into place.
+                for name in [name for name, tile_shards in shards.items() if len(tile_shards) == 1]:
+                    out_file = pathlib.Path(out_folder) / name
+                    if not out_file.is_file():
+                        os.replace(shards.pop(name)[0], out_file)
+
+                points_per_iter = tile_kwargs.get('points_per_iter', 10_000_000)
+                futures = {executor.submit(merge_las_files, tile_shards, pathlib.Path(out_folder) / name,
+                                           points_per_iter, tile_kwargs.get('laz_backend')): name
+                           for name, tile_shards in shards.items()}
+                for future in tqdm(as_completed(futures), total=len(futures), unit="tile", leave=False):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Failed to merge tile: {futures[future]}")
+                        print(e)
+    finally:
+        shutil.rmtree(shard_root, ignore_errors=True)
+    return sources, failed
+
+
+def get_subsample_indices(xyz, grid_size=0.01, backend='numpy', metrics=None):
+    """Get the indices of the points kept when subsampling with a given grid size.
+
+    The nearest point to the cell center is selected within each cell of the octree level closest to
+    `grid_size`. The returned indices can be used to select the points (and all their dimensions)
+    from the original point record.
+
+    Args:
+        xyz: Array of shape (n, 3) with the point coordinates.
+        grid_size: The size of the grid cell used in the subsampling process. Defaults to 0.01.
+        backend: The subsampling backend, 'numpy' or 'cloudcompare'. Defaults to 'numpy'.
+        metrics: Optional `PipelineMetrics` to add the 'subsample' timer (and for 'cloudcompare' the
+            'index_export' timer) to. Defaults to None.
+
+    Returns:
+        Sorted array with the indices of the kept points.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ImportError: If the 'cloudcompare' backend is used without `pycc` and `cccorelib` installed.
+    """
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    octree_level = get_octree_level(xyz, grid_size)
+
+    if backend == 'numpy':
+        with metrics.timer('subsample'):
+            return voxel_subsample(xyz, octree_level)
+    elif backend == 'cloudcompare':
+        return _subsample_cloudcompare(xyz, octree_level, metrics)
+    raise ValueError(f"Unknown subsampling backend: {backend}")
+
+
+def _subsample_cloudcompare(xyz, octree_level, metrics=None):
+    """Subsample with CloudCompare, returns the indices of the kept points.
+
+    The cccorelib bindings expose the indices of a ReferenceCloud only one at a time
+    (`getPointGlobalIndex`), so exporting them costs one Python call per kept point: linear in the
+    number of kept points, but with interpreter overhead. This export is timed as the 'index_export'
+    stage, apart from the 'subsample' stage, so that the backends can be compared on the subsampling itself.
+    """
+    if pycc is None:
+        raise ImportError("The 'cloudcompare' backend requires pycc and cccorelib.")
+    metrics = metrics if metrics is not None else PipelineMetrics()
+
+    with metrics.timer('subsample'):
+        # Coordinates relative to the minimum, to limit the float32 precision loss.
+        local_xyz = (xyz - xyz.min(axis=0)).astype(pycc.PointCoordinateType)
+        pc = pycc.ccPointCloud(local_xyz[:, 0], local_xyz[:, 1], local_xyz[:, 2])
+
+        assert np.all(local_xyz[:, 0] == pc.points()[..., 0])
+
+        # Subsample 
+        submethod = cccorelib.CloudSamplingTools.NEAREST_POINT_TO_CELL_CENTER
+        refCloud = cccorelib.CloudSamplingTools.subsampleCloudWithOctreeAtLevel(pc, octree_level, submethod)
+
+    with metrics.timer('index_export'):
+        idx = np.fromiter(map(refCloud.getPointGlobalIndex, range(refCloud.size())),
+                          dtype=np.int64, count=refCloud.size())
+        return np.sort(idx)
+
+
+def subsample_las_file(in_file, out_file, grid_size=0.01, backend='numpy', points_per_iter=None, laz_backend=None,
+                       metrics=None):
     """Subsamples a LAS file to reduce the number of points based on a specified grid size.
 
     This function reads a LAS file, extracts the points, and applies a subsampling process using an octree structure. The subsampling aims to reduce the point cloud density by selecting the nearest point to the cell center within each grid cell defined by the specified grid size. The output is a new LAS file with the subsampled point cloud.
 
+    The kept points are selected by index from the original point record, so all point dimensions (classification, return numbers, GPS time, extra bytes, ...), the header and the VLRs are preserved, and the coordinates are not modified.
+
+    Two backends are available: 'numpy' (default) uses the built-in `voxel_subsample`, 'cloudcompare' uses the octree of `pycc`/`cccorelib`, which must be installed separately.
+
+    If `points_per_iter` is given, the file is streamed in chunks with a `VoxelSubsampler` instead of being read at once, so memory is bounded by the chunk size plus the number of occupied voxels. The octree is then derived from the header bounds, which gives the same result as the in-memory path for files with accurate headers. Only the 'numpy' backend supports streaming.
+
     Args:
         in_file: The path to the input LAS file that will be subsampled.
         out_file: The path where the subsampled LAS file will be saved.
         grid_size: The size of the grid cell used in the subsampling process. Defaults to 0.01.
+        backend: The subsampling backend, 'numpy' or 'cloudcompare'. Defaults to 'numpy'.
+        points_per_iter: Stream files in chunks of this many points. Defaults to None (read at once).
+        laz_backend: The LAZ backend name for a '.laz' out_file, see `tile_writer.get_laz_backend`.
+            Defaults to None (laspy's default).
+        metrics: Optional `PipelineMetrics` to add the timers and counters of the 'read', 'subsample' and
+            'write' stages to. Defaults to None.
 
     Raises:
+        ValueError: If the backend is unknown, or does not support streaming.
+        ImportError: If the 'cloudcompare' backend is used without `pycc` and `cccorelib` installed.
         AssertionError: If there is a mismatch between the points array and the points in the point cloud after creation.
         Exception: If there are issues during the reading, processing, or writing of the LAS files.
 
     """
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    if points_per_iter is not None:
+        if backend != 'numpy':
+            raise ValueError(f"Streaming is not supported by the subsampling backend: {backend}")
+        _subsample_las_file_streaming(in_file, out_file, grid_size, points_per_iter, laz_backend, metrics)
+        return
         
-    las = laspy.read(in_file)
+    with metrics.timer('read'):
+        las = laspy.read(in_file)
+    _count_points(metrics, 'subsample', 'in', las.points)
+    idx = get_subsample_indices(las.xyz, grid_size, backend=backend, metrics=metrics)
 
-    xs = np.asarray(las.x - las.header.x_min).astype(pycc.PointCoordinateType)
-    ys = np.asarray(las.y - las.header.y_min).astype(pycc.PointCoordinateType)
-    zs = np.asarray(las.z - las.header.z_min).astype(pycc.PointCoordinateType)
-    pc = pycc.ccPointCloud(xs, ys, zs)
+    # Export
+    las.points = las.points[idx]
+    _count_points(metrics, 'subsample', 'out', las.points)
+    with metrics.timer('write'):
+        las.write(out_file, laz_backend=get_laz_backend(laz_backend))
 
-    assert np.all(xs == pc.points()[..., 0])
 
-    # Or give the values directly
-    idx1 = pc.addScalarField("intensity", las.intensity)
-    idx2 = pc.addScalarField("red", las.red)
-    idx3 = pc.addScalarField("green", las.green)
-    idx4 = pc.addScalarField("blue", las.blue)
+def _subsample_las_file_streaming(in_file, out_file, grid_size, points_per_iter, laz_backend=None, metrics=None):
+    """Subsample a LAS file chunk by chunk: a first pass selects the points, a second pass writes them."""
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    with laspy.open(in_file) as in_las:
+        bounds = np.vstack([in_las.header.mins, in_las.header.maxs])
+        sampler = VoxelSubsampler(get_octree_bbox(bounds), get_octree_level(bounds, grid_size))
+        for points in metrics.timed('read', in_las.chunk_iterator(points_per_iter)):
+            _count_points(metrics, 'subsample', 'in', points)
+            with metrics.timer('subsample'):
+                sampler.add(np.vstack([points.x, points.y, points.z]).T)
+    with metrics.timer('subsample'):
+        idx = sampler.indices()
 
-    # Subsample 
-    octree_level = get_octree_level(las.xyz, grid_size)
-    submethod = cccorelib.CloudSamplingTools.NEAREST_POINT_TO_CELL_CENTER
-    refCloud = cccorelib.CloudSamplingTools.subsampleCloudWithOctreeAtLevel(pc, octree_level, submethod)
-    sampledPc = pc.partialClone(refCloud)
+    # Write to a temporary file first, as out_file may be the input file.
+    tmp_file = pathlib.Path(out_file).with_name(f".{pathlib.Path(out_file).name}.tmp")
+    with laspy.open(in_file) as in_las, \
+         laspy.open(tmp_file, mode="w", header=in_las.header, do_compress=_is_laz(out_file),
+                    laz_backend=get_laz_backend(laz_backend)) as out_las:
+        start = 0
+        for points in metrics.timed('read', in_las.chunk_iterator(points_per_iter)):
+            end = start + len(points)
+            chunk_idx = idx[np.searchsorted(idx, start):np.searchsorted(idx, end)] - start
+            if len(chunk_idx) > 0:
+                points = points[chunk_idx]
+                _count_points(metrics, 'subsample', 'out', points)
+                with metrics.timer('write'):
+                    out_las.write_points(points)
+            start = end
+    os.replace(tmp_file, out_file)
+
+
+def _is_laz(file):
+    return str(file).lower().endswith('.laz')
 
-    # Export
-    header = laspy.LasHeader(point_format=las.header.point_format, version=las.header.version)
-    header.offset = las.header.offset
-    header.scales = las.header.scale
 
-    out_las = laspy.LasData(header)
-    out_las.xyz = (sampledPc.points().astype(np.float64) + las.header.mins)
-    out_las.intensity = sampledPc.getScalarField(idx1).asArray()
-    out_las.red = sampledPc.getScalarField(idx2).asArray()
-    out_las.green = sampledPc.getScalarField(idx3).asArray()
-    out_las.blue = sampledPc.getScalarField(idx4).asArray()
+def _convert_las_file(in_file, out_file, laz_backend=None):
+    """Convert a LAS file to the format of `out_file` (by extension) and remove the input file."""
+    if os.path.isfile(out_file):
+        os.remove(out_file)
+    merge_las_files([in_file], out_file, laz_backend=laz_backend)
+    os.remove(in_file)
 
-    # 3. Export
-    out_las.write(out_file)
+
+def get_points_in_file(file):
+    """Get the number of points in a LAS file from its header."""
+    with laspy.open(file, 'r') as las:
+        file_points = las.header.point_count
+    return file_points
 
 
 def subsample_las_folder(in_folder, out_folder=None, out_prefix='filtered_', grid_size=0.01, resume=False, 
-                         min_points=2_000_000):
-    
+                         min_points=2_000_000, workers=1, max_memory_bytes=None, backend='numpy',
+                         points_per_iter=None, tile_codes=None, extension=None, laz_backend=None, in_prefix=None,
+                         metrics=None):
+    """Subsamples all LAS files in a folder, see `subsample_las_file`.
+
+    With `workers` > 1 the files are subsampled in a process pool. The memory needed per file is
+    estimated from its header point count (`estimate_subsample_memory`), and new files are only
+    started while the estimates of all running files fit in `max_memory_bytes`. Files are scheduled
+    largest first; a file that exceeds the budget on its own is run alone.
+
+    If `in_folder` has a tile index, the index is updated (or, with an `out_folder`, written there).
+
+    With an `extension` the files are written in that format, e.g. to compress uncompressed intermediate tiles
+    ('.las') into the final product ('.laz'). When subsampling in place, the input files are then replaced,
+    including the files with `min_points` points or less, which are only converted.
+
+    Args:
+        in_folder: The path to the folder with the LAS files to subsample.
+        out_folder: The output folder. Defaults to None, which overwrites the input files.
+        out_prefix: A prefix for the output file names. Defaults to 'filtered_'.
+        grid_size: The size of the grid cell used in the subsampling process. Defaults to 0.01.
+        resume: Skip files for which a tile already exists in `out_folder`. Defaults to False.
+        min_points: Skip files with this number of points or less. Defaults to 2,000,000.
+        workers: The number of worker processes. Defaults to 1 (serial).
+        max_memory_bytes: The memory budget shared by the workers. Defaults to None, which uses the available
+            memory at the start (`plan_utils.get_available_memory`).
+        backend: The subsampling backend, 'numpy' or 'cloudcompare'. Defaults to 'numpy'.
+        points_per_iter: Stream files in chunks of this many points. Defaults to None (read at once).
+        tile_codes: Optional set of tile codes, only these tiles are subsampled. Defaults to None (all).
+        extension: The extension of the output files, '.laz' or '.las'. Defaults to None, which keeps the
+            extension of the input files in place and writes '.laz' files to an `out_folder`.
+        laz_backend: The LAZ backend name, see `tile_writer.get_laz_backend`. Defaults to None (laspy's default).
+        in_prefix: The prefix of the input files, only files with this prefix are subsampled. Defaults to None,
+            which uses `out_prefix`.
+        metrics: Optional `PipelineMetrics` to add the stage timers, counters and a 'subsample' record per file
+            to, also for files subsampled in worker processes. Defaults to None.
+
+    """
     
     file_types = ('.LAS', '.las', '.LAZ', '.laz') # valid pointcloud file types
+    metrics = metrics if metrics is not None else PipelineMetrics()
     
     if out_folder and not os.path.isdir(out_folder):
         pathlib.Path(out_folder).mkdir(parents=True, exist_ok=True)
         
-    files = [f for f in glob.glob(os.path.join(in_folder, '*'))
+    in_prefix = out_prefix if in_prefix is None else in_prefix
+    files = [f for f in glob.glob(os.path.join(in_folder, f'{glob.escape(in_prefix)}*'))
             if f.endswith(file_types)]
+    if tile_codes is not None:
+        files = [f for f in files if get_tilecode_from_filename(f, in_prefix) in tile_codes]
     
     # Find which files have already been processed.
     if resume:
-        done = set([get_tilecode_from_filename(file.name) for file
-                    in pathlib.Path(out_folder).glob('*.laz')])
-        files = [f for f in files if get_tilecode_from_filename(f) not in done]
+        done = set([get_tilecode_from_filename(file.name, out_prefix) for file
+                    in pathlib.Path(out_folder).glob(f'{out_prefix}*{extension or ".laz"}')])
+        files = [f for f in files if get_tilecode_from_filename(f, in_prefix) not in done]
+    all_files = files
     
-    
-    def get_points_in_file(file):
-        with laspy.open(file, 'r') as las:
-            file_points = las.header.point_count
-        return file_points
+    # Point counts from the tile index if available, otherwise from the headers.
+    file_points = {}
+    if TileIndex.exists(in_folder):
+        index = TileIndex.load(in_folder)
+        names = {os.path.basename(f): f for f in files}
+        file_points = {names[name]: int(n) for name, n in zip(index['file_name'], index['point_count'])
+                       if name in names}
+    missing = [f for f in files if f not in file_points]
+    file_points.update({scan['file']: scan['point_count'] for scan in scan_headers(missing)})
         
     if min_points is not None:
-        files = [f for f in files if get_points_in_file(f) > min_points]
+        files = [f for f in files if file_points[f] > min_points]
 
     print(f"Subsampling {len(files)} files.")
 
-    for in_file in tqdm(files, unit="file"):
-        try:
-            if out_folder is None:
-                out_file = in_file
-            else:
-                tilecode = get_tilecode_from_filename(in_file)
-                out_file = os.path.join(out_folder, out_prefix + tilecode + ".laz")
-            subsample_las_file(in_file, out_file, grid_size)
-        except:
-            print(f"Failed to subsample file: {in_file.name}")
\ No newline at end of file
+    def get_out_file(in_file):
+        if out_folder is None:
+            return in_file if extension is None else os.path.splitext(in_file)[0] + extension
+        tilecode = get_tilecode_from_filename(in_file, in_prefix)
+        return os.path.join(out_folder, out_prefix + tilecode + (extension or ".laz"))
+
+    if workers > 1:
+        _subsample_las_files_parallel(files, get_out_file, workers, file_points, max_memory_bytes, metrics,
+                                      grid_size=grid_size, backend=backend, points_per_iter=points_per_iter,
+                                      laz_backend=laz_backend)
+    else:
+        for in_file in tqdm(files, unit="file"):
+            run_file('subsample', in_file, metrics, subsample_las_file, in_file, get_out_file(in_file), grid_size,
+                     backend=backend, points_per_iter=points_per_iter, laz_backend=laz_backend)
+
+    # Replace the input files by the subsampled (or, if not subsampled, converted) files.
+    if out_folder is None and extension is not None:
+        subsampled = set(files)
+        for in_file in all_files:
+            out_file = get_out_file(in_file)
+            if out_file == in_file:
+                continue
+            if in_file not in subsampled:
+                try:
+                    _convert_las_file(in_file, out_file, laz_backend)
+                except Exception as e:
+                    print(f"Failed to convert file: {os.path.basename(in_file)}")
+                    print(e)
+            elif os.path.isfile(out_file):
+                os.remove(in_file)
+
+    if TileIndex.exists(in_folder):
+        if out_folder is None:
+            if extension is not None:
+                index = TileIndex.load(in_folder)
+                names = [os.path.splitext(name)[0] + extension for name in index['file_name']]
+                index.data['file_name'] = np.array([new if os.path.isfile(os.path.join(in_folder, new)) else name
+                                                    for name, new in zip(index['file_name'], names)])
+                index.save(in_folder)
+            refresh_tile_index(in_folder)
+        else:
+            index = TileIndex.load(in_folder)
+            sources = {code: index.get_sources(i) for i, code in enumerate(index.tile_codes)}
+            tile_size = float(index['tile_size'][0]) if len(index) > 0 else None
+            write_tile_index(out_folder, out_prefix, tile_size, extension or '.laz', sources=sources)
+
+
+def estimate_subsample_memory(n_points, points_per_iter=None):
+    """Estimate the peak memory (in bytes) of `subsample_las_file` for a file with n_points."""
+    if points_per_iter is None:
+        return n_points * SUBSAMPLE_BYTES_PER_POINT
+    return min(n_points, points_per_iter) * SUBSAMPLE_BYTES_PER_POINT + n_points * VOXEL_STATE_BYTES_PER_POINT
+
+
+def _subsample_las_files_parallel(files, get_out_file, workers, file_points, max_memory_bytes=None, metrics=None,
+                                  **subsample_kwargs):
+    """Subsample files in a process pool, bounding the estimated memory of the running jobs."""
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    if max_memory_bytes is None:
+        max_memory_bytes = get_available_memory()
+    queue = sorted(files, key=file_points.get, reverse=True)
+    running = {}
+    in_use = 0
+
+    with _get_executor(workers) as executor, \
+         tqdm(total=len(queue), unit="file") as pbar:
+        while queue or running:
+            # Start jobs while there are free workers and the memory budget allows it.
+            while queue and len(running) < workers:
+                estimate = estimate_subsample_memory(file_points[queue[0]], subsample_kwargs.get('points_per_iter'))
+                if running and in_use + estimate > max_memory_bytes:
+                    break
+                in_file = queue.pop(0)
+                future = executor.submit(run_file_worker, 'subsample', in_file, subsample_las_file, in_file,
+                                         get_out_file(in_file), **subsample_kwargs)
+                running[future] = (in_file, estimate)
+                in_use += estimate
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_file, estimate = running.pop(future)
+                in_use -= estimate
+                try:
+                    metrics.merge(future.result()[2])
+                except Exception as e:
+                    metrics.record_file('subsample', in_file, None, error=e)
+                    print(f"Failed to subsample file: {os.path.basename(in_file)}")
+                    print(e)
+                pbar.update()
+
+
+def tile_subsample_las_folder(in_folder, out_folder, out_prefix='filtered_', glob_pattern='**/*.laz',
+                              points_per_iter=None, tile_size=50, grid_size=0.01, min_points=2_000_000,
+                              roi=None, laz_backend=None, max_memory_bytes=None, metrics=None):
+    """Tiles and subsamples all LAS files within a directory in a single pass.
+
+    This is the fused equivalent of `tile_las_folder` followed by `subsample_las_folder`. Input chunks are
+    partitioned by tile and directly reduced per tile with a `VoxelSubsampler`, so only the subsampled tiles
+    are written and the full resolution tiles never touch the disk. A tile is written as soon as no remaining
+    input file (according to its header bounds) overlaps it. The input files are processed in spatial order,
+    sweeping along the longest axis of their extent, so that tiles are finished early.
+
+    The tiles kept in memory are those overlapped by the files still to be processed, which depends on the
+    layout of the inputs. If their states (the raw points of tiles with `min_points` points or less, the
+    voxel representatives of larger tiles) exceed `max_memory_bytes`, the largest states are spilled to
+    temporary uncompressed files in `out_folder`, which are read back when the tile is written. As the
+    representatives of a voxel over all points are among those of the spilled and the remaining points, the
+    result does not depend on the spilling.
+
+    Since the tile content is not known up front, the octree of each tile is built over the tile square and
+    the z-range of all inputs, instead of over the bounds of the tile points. The selected points can
+    therefore differ slightly from the two-pass pipeline. As in `subsample_las_folder`, tiles with
+    `min_points` points or less are written without subsampling. All input files must share the same point
+    format; points are rescaled to the scales and offsets of the first file. A tile index is written to the
+    output folder.
+
+    Args:
+        in_folder: The path to the input directory containing LAS files.
+        out_folder: The path to the output directory where the subsampled tiles will be saved.
+        out_prefix: A prefix to append to the names of the output files. Defaults to 'filtered_'.
+        glob_pattern: The pattern used to find LAS files in the input directory. Defaults to '**/*.laz'.
+        points_per_iter: The number of points to process in each iteration. Defaults to None, which derives it
+            from the available memory (see `plan_utils.get_points_per_iter`).
+        tile_size: The size of each tile, in units consistent with the LAS file coordinates. Defaults to 50.
+        grid_size: The size of the grid cell used in the subsampling process. Defaults to 0.01.
+        min_points: Tiles with this number of points or less are not subsampled. Defaults to 2,000,000.
+        roi: Optional region of interest, a bbox (x_min, y_min, x_max, y_max) or a polygon [(x, y), ...].
+            Only points inside are tiled. Defaults to None.
+        laz_backend: The LAZ backend name, see `tile_writer.get_laz_backend`. Defaults to None (laspy's default).
+        max_memory_bytes: The memory budget for the tile states. Defaults to None, which uses half of the
+            available memory (the other half is left for the chunks, see `points_per_iter`).
+        metrics: Optional `PipelineMetrics` to add the stage timers, counters and a 'tile' record per input
+            file to. Defaults to None.
+
+    Raises:
+        ValueError: If the input files do not share the same point format.
+
+    """
+    
+    if not os.path.isdir(out_folder):
+        pathlib.Path(out_folder).mkdir(parents=True, exist_ok=True)
+
+    files = sorted(pathlib.Path(in_folder).glob(glob_pattern))
+    print(f'Tiling and subsampling Folder. Found {len(files)} files.')
+    metrics = metrics if metrics is not None else PipelineMetrics()
+
+    plan = plan_work(files, tile_size, roi=roi)
+    scans = sort_scans_spatially(plan.scans)
+    files = [scan['file'] for scan in scans]
+    if len(files) == 0:
+        return
+    if any(scan['point_format'] != scans[0]['point_format'] for scan in scans):
+        raise ValueError("All input files must have the same point format.")
+    with laspy.open(files[0]) as las:
+        header = las.header
+    if points_per_iter is None:
+        points_per_iter = get_points_per_iter(max(scan['point_size'] for scan in scans))
+    if max_memory_bytes is None:
+        max_memory_bytes = get_available_memory() // 2
+
+    # A cube over the tile square and the z-range of all inputs defines the octree of each tile.
+    z_min = min(scan['mins'][2] for scan in scans)
+    size = max(tile_size, max(scan['maxs'][2] for scan in scans) - z_min)
+    octree_level = get_octree_level(np.array([[0., 0., 0.], [size, size, size]]), grid_size)
+
+    tiles = {}
+    sources = {}
+    laz_backend = get_laz_backend(laz_backend)
+    for spill_path in pathlib.Path(out_folder).glob(f'.spill_{out_prefix}*.las'):
+        spill_path.unlink()
+
+    def get_spill_path(tile_code):
+        return pathlib.Path(out_folder) / f".spill_{out_prefix}{tile_code}.las"
+
+    def new_sampler(tile_code):
+        tile_x, tile_y = (int(c) for c in tile_code.split('_'))
+        return VoxelSubsampler((np.array([tile_x * tile_size, tile_y * tile_size, z_min]), size), octree_level)
+
+    def add_records(sampler, records):
+        points = laspy.ScaleAwarePointRecord(records, header.point_format, header.scales, header.offsets)
+        with metrics.timer('subsample'):
+            sampler.add(np.vstack([points.x, points.y, points.z]).T, records)
+
+    def spill_tile(tile_code):
+        """Append the state of a tile to its spill file, and reset the state."""
+        tile = tiles[tile_code]
+        records = np.concatenate(tile['raw']) if tile['sampler'] is None else tile['sampler'].records()
+        with metrics.timer('spill'):
+            _write_tile_points(get_spill_path(tile_code), header, laspy.ScaleAwarePointRecord(
+                records, header.point_format, header.scales, header.offsets))
+        metrics.count('spilled_tiles')
+        if tile['sampler'] is not None:
+            tile['sampler'] = new_sampler(tile_code)
+        tile['raw'], tile['nbytes'] = [], 0
+
+    def write_tile(tile_code):
+        tile = tiles.pop(tile_code)
+        spill_path = get_spill_path(tile_code)
+        parts = [laspy.read(spill_path).points.array] if spill_path.is_file() else []
+        if tile['sampler'] is None:
+            parts.extend(tile['raw'])
+        elif tile['sampler'].n_points > 0:
+            parts.append(tile['sampler'].records())
+
+        # Below the threshold all points were kept raw. Otherwise, the spilled points (the raw points or
+        # representatives of earlier points) come first, so ties are still broken by input order.
+        if tile['n_points'] <= min_points:
+            records = np.concatenate(parts)
+        else:
+            sampler = new_sampler(tile_code)
+            for records in parts:
+                add_records(sampler, records)
+            records = sampler.records()
+        spill_path.unlink(missing_ok=True)
+
+        points = laspy.ScaleAwarePointRecord(records, header.point_format, header.scales, header.offsets)
+        _count_points(metrics, 'subsample', 'out', points)
+        output_path = pathlib.Path(out_folder) / f"{out_prefix}{tile_code}.laz"
+        with metrics.timer('write'), \
+             laspy.open(output_path, mode="w", header=header, laz_backend=laz_backend) as out_las:
+            out_las.write_points(points)
+
+    def tile_file(in_file, metrics):
+        for points in metrics.timed('read', iter_las_chunks(in_file, points_per_iter, roi)):
+            _count_points(metrics, 'tile', 'in', points)
+            points.change_scaling(scales=header.scales, offsets=header.offsets)
+            for tile_code, clip_idx in metrics.timed('partition', partition_by_tile(points.x, points.y, tile_size)):
+                tile_points = points[clip_idx]
+                _count_points(metrics, 'tile', 'out', tile_points)
+                tile = tiles.setdefault(tile_code, {'n_points': 0, 'raw': [], 'sampler': None, 'nbytes': 0})
+                sources.setdefault(tile_code, set()).add(str(in_file))
+                tile['n_points'] += len(tile_points)
+
+                # Small tiles are not subsampled, so only their raw points are kept. A tile that grows past
+                # `min_points` continues with the raw points in a sampler.
+                if tile['sampler'] is None and tile['n_points'] > min_points:
+                    tile['sampler'] = new_sampler(tile_code)
+                    for records in tile['raw']:
+                        add_records(tile['sampler'], records)
+                    tile['raw'] = []
+                if tile['sampler'] is None:
+                    tile['raw'].append(tile_points.array)
+                    tile['nbytes'] += tile_points.array.nbytes
+                else:
+                    add_records(tile['sampler'], tile_points.array)
+                    tile['nbytes'] = tile['sampler'].nbytes
+
+            # Spill the largest tile states until they fit in the budget.
+            total = sum(tile['nbytes'] for tile in tiles.values())
+            for tile_code in sorted(tiles, key=lambda code: tiles[code]['nbytes'], reverse=True):
+                if total <= max_memory_bytes:
+                    break
+                total -= tiles[tile_code]['nbytes']
+                spill_tile(tile_code)
+
+    for i, in_file in enumerate(tqdm(files, unit="file")):
+        run_file('tile', in_file, metrics, tile_file, in_file)
+
+        # Write the tiles that do not overlap any of the remaining input files.
+        remaining = scans[i + 1:]
+        for tile_code in list(tiles):
+            tile_x, tile_y = (int(c) * tile_size for c in tile_code.split('_'))
+            if not any(scan['mins'][0] < tile_x + tile_size and scan['maxs'][0] >= tile_x and
+                       scan['mins'][1] < tile_y + tile_size and scan['maxs'][1] >= tile_y for scan in remaining):
+                write_tile(tile_code)
+
+    write_tile_index(out_folder, out_prefix, tile_size, sources=sources)
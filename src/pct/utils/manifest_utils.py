@@ -0,0 +1,105 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Input manifest utility methods - Module (Python)
+
+An input manifest (`input_manifest.json`) is stored next to the tiles and
+records, per input file, a fingerprint (size, mtime and a hash of the raw
+header and VLRs) and the codes of the tiles it contributed points to. On an
+incremental rerun the fingerprints of the current inputs are compared with the
+manifest to find the added, changed and removed files, and from those the tiles
+that have to be rebuilt.
+"""
+
+import os
+import json
+import hashlib
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+import laspy
+
+MANIFEST_FILE = 'input_manifest.json'
+
+
+def fingerprint_file(file):
+    """Fingerprint of a LAS file: dict with its size, mtime and the SHA-1 of its header and VLRs."""
+    with laspy.open(file) as las:
+        header_size = las.header.offset_to_point_data
+    with open(file, 'rb') as f:
+        header_hash = hashlib.sha1(f.read(header_size)).hexdigest()
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'header_hash': header_hash}
+
+
+def fingerprint_files(files, workers=8):
+    """Fingerprint files in a thread pool, see `fingerprint_file`. Returns a dict keyed by file."""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(zip(files, executor.map(fingerprint_file, files)))
+
+
+class InputManifest(object):
+    """Fingerprints and tile codes of the input files of a tile folder.
+
+    Usage:
+        manifest = InputManifest.load(out_folder)
+        changes = manifest.diff(fingerprints)
+        ...
+        manifest.update(file, fingerprint, tile_codes)
+        manifest.save(out_folder)
+    """
+
+    def __init__(self, params=None, files=None):
+        self.params = params
+        self.files = files or {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def get_tiles(self, file):
+        """Set of tile codes an input file contributed to."""
+        return set(self.files.get(str(file), {}).get('tiles', ()))
+
+    def diff(self, fingerprints):
+        """Compare the fingerprints of the current input files with the manifest.
+
+        Args:
+            fingerprints: Dict mapping the current input files to their fingerprint.
+
+        Returns:
+            A tuple (added, changed, removed) of lists of files.
+        """
+        fingerprints = {str(file): fp for file, fp in fingerprints.items()}
+        added = [file for file in fingerprints if file not in self.files]
+        changed = [file for file in fingerprints if file in self.files and
+                   self.files[file]['fingerprint'] != fingerprints[file]]
+        removed = [file for file in self.files if file not in fingerprints]
+        return added, changed, removed
+
+    def update(self, file, fingerprint, tile_codes):
+        self.files[str(file)] = {'fingerprint': fingerprint, 'tiles': sorted(tile_codes)}
+
+    def remove(self, file):
+        self.files.pop(str(file), None)
+
+    def save(self, folder):
+        """Write the manifest to `folder`, replacing an existing manifest atomically."""
+        path = pathlib.Path(folder) / MANIFEST_FILE
+        tmp_path = path.with_name(f'.{MANIFEST_FILE}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'params': self.params, 'files': self.files}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder):
+        """Load the manifest of a folder, or an empty manifest if there is none."""
+        path = pathlib.Path(folder) / MANIFEST_FILE
+        if not path.is_file():
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['params'], data['files'])
+
+    @classmethod
+    def exists(cls, folder):
+        return (pathlib.Path(folder) / MANIFEST_FILE).is_file()
@@ -10,6 +10,9 @@ https://github.com/Amsterdam-AI-Team/Urban_PointCloud_Processing
 import numpy as np
 from numba import jit
 
+# Maximum octree level of CloudCompare (cell codes of 3 * 21 bits).
+MAX_OCTREE_LEVEL = 21
+
 
 @jit(nopython=True, cache=True, parallel=True)
 def get_octree_level(points, grid_size):
@@ -23,4 +26,151 @@ def get_octree_level(points, grid_size):
     octree_level = np.rint(-np.log(grid_size / max_dim) / (np.log(2)))
     if octree_level > 0:
         return np.int64(octree_level)
-    return 1
\ No newline at end of file
+    return 1
+
+def get_octree_bbox(points, enlarge_factor=0.01):
+    """Cubical bounding box (min corner, size) around the points, as built by CloudCompare's octree."""
+    mins = points.min(axis=0)
+    maxs = points.max(axis=0)
+    size = np.max(maxs - mins) * (1 + enlarge_factor)
+    return (mins + maxs) / 2 - size / 2, size
+
+
+def get_voxel_keys(points, origin, cell_size, n_cells):
+    """Integer voxel keys of the points and their squared distance (in cells) to the voxel centre."""
+    keys = np.zeros(len(points), dtype=np.uint64)
+    dist = np.zeros(len(points), dtype=np.float64)
+    for d in range(points.shape[1]):
+        rel = (points[:, d] - origin[d]) / cell_size
+        cell = np.clip(rel.astype(np.int64), 0, n_cells - 1)
+        keys *= np.uint64(n_cells)
+        keys += cell.astype(np.uint64)
+        rel -= cell + 0.5
+        dist += rel * rel
+        del rel, cell
+    return keys, dist
+
+
+def select_voxel_representatives(keys, dist, idx):
+    """Positions of the entry with the smallest distance per voxel key (ties: lowest idx), sorted by key."""
+    order = np.lexsort((idx, dist, keys))
+    sorted_keys = keys[order]
+    return order[np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]]
+
+
+def voxel_subsample(points, octree_level, bbox=None):
+    """Indices of the points nearest to the centre of each occupied octree cell.
+
+    Reproduces CloudCompare's NEAREST_POINT_TO_CELL_CENTER subsampling at a given
+    octree level: points are binned in a regular grid of 2**octree_level cells per
+    axis over the cubical octree bounding box, and per occupied cell the point
+    closest to the cell centre is kept (ties are broken by the lowest index).
+    A precomputed `bbox` (see `get_octree_bbox`) can be passed. Returns the sorted
+    indices of the kept points.
+    """
+    points = np.asarray(points)
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    origin, size = get_octree_bbox(points) if bbox is None else bbox
+    n_cells = 2 ** min(int(octree_level), MAX_OCTREE_LEVEL)
+    cell_size = max(size / n_cells, np.finfo(float).tiny)
+
+    # Sort on key, then distance; the first point of each key is the representative.
+    keys, dist = get_voxel_keys(points, origin, cell_size, n_cells)
+    first = select_voxel_representatives(keys, dist, np.arange(len(points)))
+    return np.sort(first)
+
+
+class VoxelSubsampler(object):
+    """Streaming version of `voxel_subsample`, fed with consecutive chunks of points.
+
+    Only the current representative (key, distance, global index) of each occupied
+    voxel is kept between chunks, sorted by key, so memory is bounded by the chunk
+    size plus the number of occupied voxels. Each chunk is reduced on its own and
+    its representatives are merged into the state with a sorted merge, so a chunk
+    costs time linear (not log-linear) in the size of the state. The octree bounding box must be known up front, e.g.
+    from the LAS header bounds. The result equals `voxel_subsample` on all points.
+
+    Optionally, a record array aligned with the points can be passed to `add`. The
+    records of the representatives are then kept as well (see `records`), so the
+    points do not have to be read again.
+
+    Usage:
+        sampler = VoxelSubsampler(get_octree_bbox(np.vstack([mins, maxs])), octree_level)
+        for chunk in chunks:
+            sampler.add(chunk)
+        idx = sampler.indices()
+    """
+
+    def __init__(self, bbox, octree_level):
+        self.origin, size = bbox
+        self.n_cells = 2 ** min(int(octree_level), MAX_OCTREE_LEVEL)
+        self.cell_size = max(size / self.n_cells, np.finfo(float).tiny)
+        self.n_points = 0
+
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._dist = np.zeros(0, dtype=np.float64)
+        self._idx = np.zeros(0, dtype=np.int64)
+        self._records = None
+
+    def add(self, points, records=None):
+        """Add the next chunk of points (array of shape (n, 3)) and optionally their records."""
+        points = np.asarray(points)
+        keys, dist = get_voxel_keys(points, self.origin, self.cell_size, self.n_cells)
+        idx = np.arange(self.n_points, self.n_points + len(points))
+        self.n_points += len(points)
+
+        # Reduce the chunk first, its representatives are sorted by key like the state.
+        first = select_voxel_representatives(keys, dist, idx)
+        keys, dist, idx = keys[first], dist[first], idx[first]
+        if records is not None:
+            records = records[first]
+            if self._records is None:
+                self._records = records[:0]
+
+        # Voxels in the state keep the closer point; on equal distance the state, with the lower index.
+        pos = np.searchsorted(self._keys, keys)
+        known = pos < len(self._keys)
+        known[known] = self._keys[pos[known]] == keys[known]
+        better = known.copy()
+        better[known] = dist[known] < self._dist[pos[known]]
+        self._dist[pos[better]] = dist[better]
+        self._idx[pos[better]] = idx[better]
+        if records is not None:
+            self._records[pos[better]] = records[better]
+
+        # New voxels are inserted at their sorted position.
+        new = ~known
+        self._keys = np.insert(self._keys, pos[new], keys[new])
+        self._dist = np.insert(self._dist, pos[new], dist[new])
+        self._idx = np.insert(self._idx, pos[new], idx[new])
+        if records is not None:
+            self._records = np.insert(self._records, pos[new], records[new])
+
+    @property
+    def nbytes(self):
+        """Memory used by the state."""
+        return (self._keys.nbytes + self._dist.nbytes + self._idx.nbytes +
+                (0 if self._records is None else self._records.nbytes))
+
+    def indices(self):
+        """Sorted global indices of the kept points."""
+        return np.sort(self._idx)
+
+    def records(self):
+        """Records of the kept points, in the order of their global indices."""
+        return self._records[np.argsort(self._idx)]
+
+
+def points_in_polygon(x, y, polygon):
+    """Boolean mask of the points (x, y) inside a polygon (array of (x, y) vertices), even-odd rule."""
+    inside = np.zeros(len(x), dtype=bool)
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        if y1 != y2:
+            crosses = (y1 > y) != (y2 > y)
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (x < x_cross)
+        x1, y1 = x2, y2
+    return inside
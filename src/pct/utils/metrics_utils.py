@@ -0,0 +1,175 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Pipeline metrics utility methods - Module (Python)
+
+Instrumentation of the tiling and subsampling hot paths: the time spent per
+stage (read/decompress, partition, write, subsample, merge), point and byte
+counters, the peak memory, and a structured record per processed file
+(success, error, points in and out). The metrics of worker processes are merged
+into those of the main process, and can be written as a JSON report or passed
+record by record to a callback, e.g. to ship them to a monitoring system.
+"""
+
+import os
+import sys
+import json
+import time
+import pathlib
+import resource
+import contextlib
+
+
+def get_peak_rss_bytes(who=resource.RUSAGE_SELF):
+    """Peak resident set size in bytes, of this process or (RUSAGE_CHILDREN) of its terminated children."""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PipelineMetrics(object):
+    """Timers, counters, peak memory and file records of a pipeline run.
+
+    Stage timers sum the seconds and calls per stage. Counters are named '<stage>_<unit>_<in|out>', e.g.
+    'tile_points_in', so that the points in and out of each file record can be derived from them. The
+    `callback` is called with every file record, including those merged from worker processes.
+
+    Usage:
+        metrics = PipelineMetrics(callback=send_to_monitoring)
+        tile_las_folder(in_folder, out_folder, metrics=metrics)
+        subsample_las_folder(out_folder, metrics=metrics)
+        metrics.save('metrics.json')
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timers = {}
+        self.counters = {}
+        self.files = []
+        self._peak_rss_bytes = 0
+        self._start = time.perf_counter()
+
+    def add_time(self, stage, seconds, calls=1):
+        timer = self.timers.setdefault(stage, {'seconds': 0., 'calls': 0})
+        timer['seconds'] += seconds
+        timer['calls'] += calls
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Context manager adding the time spent in its block to a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed(self, stage, iterable):
+        """Iterate, adding the time spent in the iterator itself (e.g. reading chunks) to a stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def get_count(self, name):
+        return self.counters.get(name, 0)
+
+    def record_file(self, stage, file, seconds, points_in=0, points_out=0, error=None):
+        """Add the record of a processed file and pass it to the callback."""
+        record = {'stage': stage, 'file': str(file), 'success': error is None,
+                  'error': None if error is None else f"{type(error).__name__}: {error}",
+                  'points_in': int(points_in), 'points_out': int(points_out), 'seconds': seconds}
+        self._add_record(record)
+        return record
+
+    @property
+    def failed(self):
+        """The records of the failed files."""
+        return [record for record in self.files if not record['success']]
+
+    @property
+    def peak_rss_bytes(self):
+        return max(self._peak_rss_bytes, get_peak_rss_bytes(), get_peak_rss_bytes(resource.RUSAGE_CHILDREN))
+
+    def merge(self, report):
+        """Merge the report of another run (`to_dict`), e.g. of a worker process, into these metrics."""
+        for stage, timer in report['timers'].items():
+            self.add_time(stage, timer['seconds'], timer['calls'])
+        for name, value in report['counters'].items():
+            self.count(name, value)
+        for record in report['files']:
+            self._add_record(record)
+        self._peak_rss_bytes = max(self._peak_rss_bytes, report['peak_rss_bytes'])
+
+    def to_dict(self):
+        return {'wall_seconds': time.perf_counter() - self._start, 'timers': self.timers,
+                'counters': self.counters, 'peak_rss_bytes': self.peak_rss_bytes, 'files': self.files}
+
+    def save(self, path):
+        """Write the metrics as a JSON report, replacing an existing report atomically."""
+        path = pathlib.Path(path)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """Short human readable summary of the timers, throughput and failures."""
+        lines = [f"{stage:>10s}: {timer['seconds']:9.2f}s in {timer['calls']:,d} calls"
+                 for stage, timer in self.timers.items()]
+        for stage in sorted({record['stage'] for record in self.files}):
+            records = [record for record in self.files if record['stage'] == stage]
+            failed = sum(not record['success'] for record in records)
+            lines.append(f"{stage:>10s}: {len(records) - failed} files done, {failed} failed, "
+                         f"{sum(record['points_in'] for record in records):,d} points in, "
+                         f"{sum(record['points_out'] for record in records):,d} points out")
+        lines.append(f"peak memory: {self.peak_rss_bytes / 1024**2:,.0f} MB")
+        return '\n'.join(lines)
+
+    def _add_record(self, record):
+        self.files.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+
+def run_file(stage, file, metrics, func, *args, **kwargs):
+    """Run `func(*args, metrics=metrics, **kwargs)` for a file and record the file in the metrics.
+
+    Errors are printed and recorded instead of raised, the points in and out are taken from the
+    '<stage>_points_in' and '<stage>_points_out' counters.
+
+    Returns:
+        A tuple (result, error), with result None if the function failed.
+    """
+    points_in = metrics.get_count(f'{stage}_points_in')
+    points_out = metrics.get_count(f'{stage}_points_out')
+    start = time.perf_counter()
+    try:
+        result, error = func(*args, metrics=metrics, **kwargs), None
+    except Exception as e:
+        result, error = None, e
+        print(f"Failed to {stage} file: {os.path.basename(file)}")
+        print(e)
+    metrics.record_file(stage, file, time.perf_counter() - start,
+                        points_in=metrics.get_count(f'{stage}_points_in') - points_in,
+                        points_out=metrics.get_count(f'{stage}_points_out') - points_out, error=error)
+    return result, error
+
+
+def run_file_worker(stage, file, func, *args, **kwargs):
+    """Like `run_file`, in a worker process with its own metrics.
+
+    Returns:
+        A tuple (result, failed, report), with the report of the worker metrics to merge in the main process.
+    """
+    metrics = PipelineMetrics()
+    result, error = run_file(stage, file, metrics, func, *args, **kwargs)
+    return result, error is not None, metrics.to_dict()
@@ -0,0 +1,406 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Work planning utility methods - Module (Python)
+
+Header-only pre-scan of the input files: a single global tile grid, an estimate
+of the number of points per tile, a region of interest (ROI) filter, a
+balanced schedule of the input files over a number of workers, a chunk size
+that fits in the available memory and an adaptive (quadtree) tile grid.
+"""
+
+import os
+import json
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+import laspy
+import numpy as np
+
+from ..utils.math_utils import points_in_polygon
+
+# Estimated memory per point of a tiling chunk, besides its point records (coordinates, tile keys, sort order).
+TILE_BYTES_PER_POINT = 64
+
+
+def scan_header(file):
+    """Read the header of a LAS file and summarize it in a dict."""
+    with laspy.open(file) as las:
+        header = las.header
+    return {'file': file,
+            'point_count': header.point_count,
+            'mins': np.asarray(header.mins),
+            'maxs': np.asarray(header.maxs),
+            'point_format': header.point_format.id,
+            'point_size': header.point_format.size,
+            'copc': is_copc(header)}
+
+
+def scan_headers(files, workers=8):
+    """Read the headers of all files in a thread pool, see `scan_header`."""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(scan_header, files))
+
+
+def is_copc(header):
+    """Whether a LAS header belongs to a Cloud Optimized Point Cloud (COPC) file."""
+    return any(vlr.user_id == 'copc' and vlr.record_id == 1 for vlr in header.vlrs)
+
+
+def get_roi_bbox(roi):
+    """Bbox (x_min, y_min, x_max, y_max) of a ROI, given as bbox or as polygon [(x, y), ...]."""
+    if roi is None:
+        return None
+    if np.ndim(roi) == 1:
+        return tuple(float(v) for v in roi)
+    polygon = np.asarray(roi, dtype=float)
+    return (*polygon.min(axis=0), *polygon.max(axis=0))
+
+
+def bbox_intersects_roi(mins, maxs, roi):
+    """Whether a bbox (mins, maxs) intersects the bbox of the ROI (always True without ROI)."""
+    if roi is None:
+        return True
+    x_min, y_min, x_max, y_max = get_roi_bbox(roi)
+    return mins[0] <= x_max and maxs[0] >= x_min and mins[1] <= y_max and maxs[1] >= y_min
+
+
+def points_in_roi(x, y, roi):
+    """Boolean mask of the points (x, y) inside the ROI."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if roi is None:
+        return np.ones(len(x), dtype=bool)
+    if np.ndim(roi) == 1:
+        x_min, y_min, x_max, y_max = roi
+        return (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    return points_in_polygon(x, y, np.asarray(roi, dtype=float))
+
+
+def get_available_memory():
+    """Available physical memory in bytes, including reclaimable page cache on Linux."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Without /proc/meminfo (e.g. MacOS), assume half of the physical memory is available.
+    return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+
+
+def get_points_per_iter(point_size, workers=1, reserved_bytes=0, memory_fraction=0.5, min_points=1_000_000):
+    """Number of points per tiling chunk, such that the chunks of all workers fit in the available memory.
+
+    Args:
+        point_size: The size of a point record in bytes.
+        workers: The number of workers, each processing one chunk at a time. Defaults to 1.
+        reserved_bytes: Memory reserved per worker besides the chunk, e.g. for write buffers. Defaults to 0.
+        memory_fraction: The fraction of the available memory to use. Defaults to 0.5.
+        min_points: The minimum number of points per chunk. Defaults to 1,000,000.
+
+    Returns:
+        The number of points per chunk.
+    """
+    budget = get_available_memory() * memory_fraction / max(1, workers) - reserved_bytes
+    return max(min_points, int(budget // (point_size + TILE_BYTES_PER_POINT)))
+
+
+def estimate_tile_points(scans, tile_size=50):
+    """Estimate the number of points per tile code from the file headers.
+
+    The points of each file are assumed to be spread uniformly over its bbox, and
+    are distributed over the tiles of the global grid by overlap area.
+    """
+    tile_points = {}
+    for scan in scans:
+        (x_min, y_min), (x_max, y_max) = scan['mins'][:2], scan['maxs'][:2]
+        tx = np.arange(x_min // tile_size, x_max // tile_size + 1, dtype=np.int64)
+        ty = np.arange(y_min // tile_size, y_max // tile_size + 1, dtype=np.int64)
+
+        # Overlap of the file bbox with each tile column and row.
+        wx = np.minimum(x_max, (tx + 1) * tile_size) - np.maximum(x_min, tx * tile_size)
+        wy = np.minimum(y_max, (ty + 1) * tile_size) - np.maximum(y_min, ty * tile_size)
+        weights = np.outer(np.maximum(wx, 0), np.maximum(wy, 0))
+        if weights.sum() > 0:
+            weights /= weights.sum()
+        else:
+            weights[:] = 1 / weights.size
+
+        for i, j in zip(*np.nonzero(weights)):
+            tile_code = f"{tx[i]}_{ty[j]}"
+            tile_points[tile_code] = tile_points.get(tile_code, 0) + scan['point_count'] * weights[i, j]
+    return {code: int(round(n)) for code, n in tile_points.items()}
+
+
+def get_bbox_tile_codes(mins, maxs, tile_size=50, roi=None):
+    """Codes of all tiles of the global grid that intersect a bbox (mins, maxs), and the bbox of the ROI."""
+    tx = np.arange(mins[0] // tile_size, maxs[0] // tile_size + 1, dtype=np.int64)
+    ty = np.arange(mins[1] // tile_size, maxs[1] // tile_size + 1, dtype=np.int64)
+    tile_codes = {f"{x}_{y}" for x in tx for y in ty}
+    if roi is not None:
+        x_min, y_min, x_max, y_max = get_roi_bbox(roi)
+        tile_codes = {code for code in tile_codes
+                      if _tile_intersects_bbox(code, tile_size, x_min, y_min, x_max, y_max)}
+    return tile_codes
+
+
+def get_tile_code(tile_x, tile_y, level=0):
+    """Tile code of a tile of the quadtree grid: 'x_y' for root tiles, 'x_y_level' for deeper levels."""
+    return f"{tile_x}_{tile_y}" if level == 0 else f"{tile_x}_{tile_y}_{level}"
+
+
+def parse_tile_code(tile_code):
+    """Tuple (tile_x, tile_y, level) of a tile code, see `get_tile_code`.
+
+    Raises:
+        ValueError: If the tile code is invalid.
+    """
+    parts = [int(c) for c in tile_code.split('_')]
+    if len(parts) == 2:
+        return parts[0], parts[1], 0
+    if len(parts) == 3:
+        return tuple(parts)
+    raise ValueError(f"Invalid tile code: {tile_code}")
+
+
+class TileQuadtree(object):
+    """Adaptive tile grid: root tiles of `tile_size`, of which dense tiles are split into four children.
+
+    A tile at level L has size tile_size / 2**L and coordinates in units of that size, and is only split if
+    it holds more than `max_points` points and L < `max_level`. The tree is stored by its split (internal)
+    tiles only; a point belongs to the first tile on its path from the root that is not split.
+
+    Usage:
+        quadtree = TileQuadtree.build(cell_counts, tile_size, max_points, max_level)
+        for tile_code, idx in quadtree.partition(x, y):
+            ...
+    """
+
+    FILE = 'tile_quadtree.json'
+
+    def __init__(self, tile_size, max_level, split, tile_points=None):
+        self.tile_size = tile_size
+        self.max_level = max_level
+        # Sorted keys of the split tiles, per level.
+        self._split = [np.unique(np.asarray(keys, dtype=np.int64)) for keys in split]
+        self.tile_points = tile_points or {}
+
+    @classmethod
+    def build(cls, cell_counts, tile_size=400, max_points=20_000_000, max_level=4):
+        """Build the quadtree from point counts per cell of the finest level.
+
+        Args:
+            cell_counts: Dict mapping (x, y) of the cells of size tile_size / 2**max_level to point counts.
+            tile_size: The size of the root tiles. Defaults to 400.
+            max_points: The maximum number of points per tile, unless at `max_level`. Defaults to 20,000,000.
+            max_level: The maximum number of splits. Defaults to 4.
+        """
+        cells = np.array(list(cell_counts.keys()), dtype=np.int64).reshape(-1, 2)
+        counts = np.array(list(cell_counts.values()), dtype=np.int64)
+        split, tile_points = [], {}
+        for level in range(max_level + 1):
+            scale = 2 ** (max_level - level)
+            tiles, inverse = np.unique(cells // scale, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            tile_counts = np.bincount(inverse, weights=counts, minlength=len(tiles))
+            is_split = tile_counts > max_points if level < max_level else np.zeros(len(tiles), dtype=bool)
+
+            for (tile_x, tile_y), n in zip(tiles[~is_split], tile_counts[~is_split]):
+                tile_points[get_tile_code(tile_x, tile_y, level)] = int(n)
+            split.append(_get_cell_keys(tiles[is_split, 0], tiles[is_split, 1]))
+
+            # Continue with the cells of the split tiles only.
+            keep = is_split[inverse]
+            cells, counts = cells[keep], counts[keep]
+        return cls(tile_size, max_level, split, tile_points)
+
+    @property
+    def tile_codes(self):
+        """Codes of the (leaf) tiles of the counted points."""
+        return list(self.tile_points)
+
+    def get_tile_size(self, level):
+        return self.tile_size / 2**level
+
+    def partition(self, x, y):
+        """Group points by quadtree tile, like `las_utils.partition_by_tile` does for a regular grid.
+
+        Yields:
+            Tuples (tile_code, indices), the indices within a tile are in ascending order.
+        """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if len(x) == 0:
+            return
+        scale = 2 ** self.max_level
+        cell_x = np.floor_divide(x, self.get_tile_size(self.max_level)).astype(np.int64)
+        cell_y = np.floor_divide(y, self.get_tile_size(self.max_level)).astype(np.int64)
+
+        # The level of each point is the first level at which its tile is not split.
+        levels = np.zeros(len(x), dtype=np.int64)
+        active = np.ones(len(x), dtype=bool)
+        for level in range(self.max_level):
+            shift = 2 ** (self.max_level - level)
+            keys = _get_cell_keys(cell_x[active] // shift, cell_y[active] // shift)
+            is_split = np.isin(keys, self._split[level])
+            idx = np.flatnonzero(active)
+            levels[idx[is_split]] = level + 1
+            active[idx[~is_split]] = False
+
+        shift = scale // 2**levels
+        tile_x = cell_x // shift
+        tile_y = cell_y // shift
+        order = np.lexsort((tile_y, tile_x, levels))
+        sorted_keys = np.vstack([levels[order], tile_x[order], tile_y[order]])
+        starts = np.flatnonzero(np.r_[True, np.any(sorted_keys[:, 1:] != sorted_keys[:, :-1], axis=0)])
+        ends = np.append(starts[1:], len(order))
+
+        for start, end in zip(starts, ends):
+            first = order[start]
+            yield get_tile_code(tile_x[first], tile_y[first], levels[first]), order[start:end]
+
+    def save(self, folder):
+        """Write the quadtree to `folder`, replacing an existing file atomically."""
+        path = pathlib.Path(folder) / self.FILE
+        tmp_path = path.with_name(f'.{self.FILE}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'tile_size': self.tile_size, 'max_level': self.max_level,
+                       'split': [keys.tolist() for keys in self._split], 'tile_points': self.tile_points}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder):
+        with open(pathlib.Path(folder) / cls.FILE) as f:
+            data = json.load(f)
+        return cls(data['tile_size'], data['max_level'], data['split'], data['tile_points'])
+
+    @classmethod
+    def exists(cls, folder):
+        return (pathlib.Path(folder) / cls.FILE).is_file()
+
+
+def _get_cell_keys(cell_x, cell_y):
+    """Single int64 key per cell (x, y), for cell coordinates within +-2**31."""
+    return (np.asarray(cell_x, dtype=np.int64) << 32) + (np.asarray(cell_y, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def estimate_cell_counts(scans, cell_size):
+    """Estimate the number of points per cell (x, y) of a regular grid from the file headers.
+
+    See `estimate_tile_points`; the result can be used to build a `TileQuadtree` without reading the points.
+    """
+    return {tuple(int(c) for c in code.split('_')): n for code, n in estimate_tile_points(scans, cell_size).items()}
+
+
+def sort_scans_spatially(scans):
+    """Sort header scans along the longest axis of their total extent (by bbox minimum, then the other axis).
+
+    Processing files in this order sweeps over the area, so that tiles behind the sweep are no longer
+    overlapped by the remaining files early on.
+    """
+    if len(scans) == 0:
+        return []
+    mins = np.array([scan['mins'][:2] for scan in scans])
+    maxs = np.array([scan['maxs'][:2] for scan in scans])
+    axis = int(np.argmax(maxs.max(axis=0) - mins.min(axis=0)))
+    order = np.lexsort((mins[:, 1 - axis], mins[:, axis]))
+    return [scans[i] for i in order]
+
+
+def get_lpt_order(costs):
+    """Job indices largest first, equal costs in input order.
+
+    Submitting jobs in this order to a pool, whose idle workers take the next job, gives the LPT schedule of
+    `balance_schedule`.
+    """
+    return [int(job) for job in np.argsort(-np.asarray(costs, dtype=np.float64), kind='stable')]
+
+
+def balance_schedule(costs, workers):
+    """Assign jobs to workers, largest first to the least loaded worker (LPT scheduling).
+
+    Args:
+        costs: List with the cost of each job.
+        workers: The number of workers.
+
+    Returns:
+        A list with, for each worker, the list of job indices.
+    """
+    schedule = [[] for _ in range(max(1, workers))]
+    loads = np.zeros(len(schedule))
+    for job in get_lpt_order(costs):
+        worker = int(np.argmin(loads))
+        schedule[worker].append(int(job))
+        loads[worker] += costs[job]
+    return schedule
+
+
+class WorkPlan(object):
+    """Result of `plan_work`: the input files to process and the expected work.
+
+    Attributes:
+        scans: The header scans (see `scan_header`) of the files inside the ROI, in input order.
+        skipped: The files skipped because they do not intersect the ROI.
+        schedule: For each worker, the indices (into `scans`) of the files it processes.
+        tile_points: Dict with the estimated number of points per tile code, computed on first access.
+    """
+
+    def __init__(self, scans, skipped, schedule, tile_size, roi=None):
+        self.scans = scans
+        self.skipped = skipped
+        self.schedule = schedule
+        self.tile_size = tile_size
+        self.roi = roi
+        self._tile_points = None
+
+    @property
+    def tile_points(self):
+        if self._tile_points is None:
+            tile_points = estimate_tile_points(self.scans, self.tile_size)
+            if self.roi is not None:
+                x_min, y_min, x_max, y_max = get_roi_bbox(self.roi)
+                tile_points = {code: n for code, n in tile_points.items()
+                               if _tile_intersects_bbox(code, self.tile_size, x_min, y_min, x_max, y_max)}
+            self._tile_points = tile_points
+        return self._tile_points
+
+    @property
+    def files(self):
+        return [scan['file'] for scan in self.scans]
+
+    @property
+    def point_count(self):
+        return sum(scan['point_count'] for scan in self.scans)
+
+    def __repr__(self):
+        return (f"WorkPlan({len(self.scans)} files, {len(self.skipped)} skipped, "
+                f"{self.point_count:,d} points, {len(self.schedule)} workers)")
+
+
+def plan_work(files, tile_size=50, workers=1, roi=None, scan_workers=8):
+    """Plan the tiling of a set of input files from their headers only.
+
+    Args:
+        files: The input files.
+        tile_size: The size of the tiles of the global grid. Defaults to 50.
+        workers: The number of workers to schedule the files over. Defaults to 1.
+        roi: Optional region of interest, a bbox (x_min, y_min, x_max, y_max) or a polygon [(x, y), ...].
+            Files whose bbox does not intersect the bbox of the ROI are skipped.
+        scan_workers: The number of threads used to read the headers. Defaults to 8.
+
+    Returns:
+        A `WorkPlan`.
+    """
+    scans = scan_headers([pathlib.Path(f) for f in files], scan_workers)
+    skipped = [scan['file'] for scan in scans if not bbox_intersects_roi(scan['mins'], scan['maxs'], roi)]
+    scans = [scan for scan in scans if bbox_intersects_roi(scan['mins'], scan['maxs'], roi)]
+
+    schedule = balance_schedule([scan['point_count'] for scan in scans], workers)
+    return WorkPlan(scans, skipped, schedule, tile_size, roi)
+
+
+def _tile_intersects_bbox(tile_code, tile_size, x_min, y_min, x_max, y_max):
+    tile_x, tile_y = (int(c) * tile_size for c in tile_code.split('_'))
+    return tile_x <= x_max and tile_x + tile_size >= x_min and tile_y <= y_max and tile_y + tile_size >= y_min
@@ -1,6 +1,6 @@
 # PointCloud_Tiling, GPL-3.0 license
 
-""" 
+"""
 Plot utility methods - Module (Python)
 
 The module is adapted from:
@@ -9,33 +9,106 @@ https://github.com/Amsterdam-AI-Team/Urban_PointCloud_Processing
 
 
 import folium
+import numpy as np
 import pandas as pd
 
 
-from ..utils.las_utils import get_bbox_from_tile_code
 from ..utils.rd_converter import RDWGS84Converter
+from ..utils.plan_utils import parse_tile_code
+
+
+def get_tiles_frame(tiles, train_tiles=(), tile_size=50):
+    """Build a frame with the tile grid indices and bounds of the tiles.
+
+    Args:
+        tiles: The tile codes.
+        train_tiles: Optional tile codes to mark as train tiles.
+        tile_size: The size of the tiles. Defaults to 50.
+
+    Returns:
+        A DataFrame indexed by tile code with the columns TX, TY (grid indices),
+        X1, Y1 (lower left corner) and Train.
+
+    Raises:
+        ValueError: If a tile code is invalid or a quadtree tile code ('X_Y_L'),
+            as the tiles are drawn on a regular grid.
+    """
+    codes = pd.Index(sorted(set(tiles)), name='Tilecode')
+    grid = [parse_tile_code(code) for code in codes]
+    quadtree_codes = [code for code, (_, _, level) in zip(codes, grid) if level > 0]
+    if len(quadtree_codes) > 0:
+        raise ValueError(f"Quadtree tile codes can not be plotted on a regular grid: {quadtree_codes[0]}")
+    tx = np.array([tile_x for tile_x, _, _ in grid], dtype=np.int64)
+    ty = np.array([tile_y for _, tile_y, _ in grid], dtype=np.int64)
+    return pd.DataFrame({'TX': tx, 'TY': ty, 'X1': tx * tile_size, 'Y1': ty * tile_size,
+                         'Train': codes.isin(list(train_tiles))}, index=codes)
+
+
+def aggregate_tiles_frame(tile_df, factor):
+    """Aggregate the tiles in blocks of factor x factor tiles.
+
+    Returns:
+        A DataFrame indexed by block code with the columns TX, TY (block indices),
+        Tiles (number of tiles in the block) and Train (number of train tiles).
+    """
+    blocks = (tile_df.assign(TX=tile_df.TX // factor, TY=tile_df.TY // factor)
+              .groupby(['TX', 'TY'], sort=True)
+              .agg(Tiles=('Train', 'size'), Train=('Train', 'sum'))
+              .reset_index())
+    blocks.index = blocks.TX.astype(str) + '_' + blocks.TY.astype(str)
+    return blocks
 
 
-def plot_tiles_map(tiles, train_tiles=[], width=1024, height=1024,    
-                   zoom_control=True, zoom_start=14, opacity=0.25):
+def merge_tile_runs(tile_df):
+    """Merge horizontally adjacent tiles with the same train flag into runs.
+
+    Returns:
+        A DataFrame with the columns TX, TY (first tile of the run), Length
+        (number of tiles in the run), Train and Label.
+    """
+    df = tile_df.sort_values(['Train', 'TY', 'TX'])
+    tx, ty, train = df.TX.to_numpy(), df.TY.to_numpy(), df.Train.to_numpy()
+    breaks = np.ones(len(df), dtype=bool)
+    breaks[1:] = (train[1:] != train[:-1]) | (ty[1:] != ty[:-1]) | (tx[1:] != tx[:-1] + 1)
+    starts = np.flatnonzero(breaks)
+    lengths = np.diff(np.append(starts, len(df)))
+    first, last = df.index[starts], df.index[starts + lengths - 1]
+    return pd.DataFrame({'TX': tx[starts], 'TY': ty[starts], 'Length': lengths, 'Train': train[starts],
+                         'Label': np.where(lengths > 1, first + ' - ' + last, first)})
+
+
+def _rect_features(x1, y1, x2, y2, properties):
+    """GeoJSON polygon features for RD rectangles, converting all corners in one batch."""
+    conv = RDWGS84Converter()
+    xs = np.stack([x1, x2, x2, x1, x1], axis=-1).astype(float)
+    ys = np.stack([y1, y1, y2, y2, y1], axis=-1).astype(float)
+    lat, lon = conv.from_rd_array(xs, ys)
+    rings = np.round(np.stack([lon, lat], axis=-1), 7).tolist()
+    return [{'type': 'Feature',
+             'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+             'properties': props}
+            for ring, props in zip(rings, properties)]
+
+
+def plot_tiles_map(tiles, train_tiles=[], width=1024, height=1024,
+                   zoom_control=True, zoom_start=14, opacity=0.25,
+                   tile_size=50, merge=True, max_features=10_000):
     """
     Visualise the locations of all point cloud tiles in a given folder and
     overlay them on an OpenStreetMap of the area. The returned map is
     interactive, i.e. it allows panning and zooming, and tilecodes are
     displayed as tooltip on hoovering.
+
+    All tiles are drawn as a single GeoJSON layer. Horizontally adjacent tiles
+    are merged into one polygon if `merge` is set, and if there are more than
+    `max_features` tiles they are aggregated into blocks of 2^k x 2^k tiles,
+    with the fill opacity showing the fraction of the block that is covered.
     """
-    tile_df = (pd.DataFrame(columns=['Tilecode', 'X1', 'Y1', 'Train'])
-               .set_index('Tilecode'))
-    for tilecode in tiles:
-        ((x1, _), (_, y1)) = get_bbox_from_tile_code(tilecode)
-        tile_df.loc[tilecode] = [x1, y1, False]
-    for tilecode in train_tiles:
-        tile_df.loc[tilecode, 'Train'] = True
+    tile_df = get_tiles_frame(tiles, train_tiles, tile_size)
 
     conv = RDWGS84Converter()
-
-    center = conv.from_rd(int((tile_df.X1.max() + 50 + tile_df.X1.min()) / 2),
-                          int((tile_df.Y1.max() + 50 + tile_df.Y1.min()) / 2))
+    center = conv.from_rd(int((tile_df.X1.max() + tile_size + tile_df.X1.min()) / 2),
+                          int((tile_df.Y1.max() + tile_size + tile_df.Y1.min()) / 2))
 
     f = folium.Figure(width=width, height=height)
 
@@ -45,17 +118,40 @@ def plot_tiles_map(tiles, train_tiles=[], width=1024, height=1024,
                             zoom_control=zoom_control, control_scale=True)
                  .add_to(f))
 
-    for index, row in tile_df.iterrows():
-        rect = [conv.from_rd(row.X1, row.Y1),
-                conv.from_rd(row.X1 + 50, row.Y1 + 50)]
-        if row.Train:
-            fc = 'darkorange'
-            fop = opacity
+    # Aggregate to coarser blocks until the number of features fits.
+    factor, blocks = 1, tile_df
+    while len(blocks) > max_features:
+        factor *= 2
+        blocks = aggregate_tiles_frame(tile_df, factor)
+
+    if factor > 1:
+        size = factor * tile_size
+        properties = [{'label': f"{code}: {n} tiles, {n_train} train",
+                       'fill': 'darkorange' if n_train > 0 else 'royalblue',
+                       'opacity': (opacity if n_train > 0 else 0.1) * max(n / factor ** 2, 0.25)}
+                      for code, n, n_train in zip(blocks.index, blocks.Tiles, blocks.Train)]
+        features = _rect_features(blocks.TX * size, blocks.TY * size,
+                                  (blocks.TX + 1) * size, (blocks.TY + 1) * size, properties)
+    else:
+        if merge:
+            runs = merge_tile_runs(tile_df)
         else:
-            fc = 'royalblue'
-            fop = 0.1
-        (folium.Rectangle(bounds=rect, tooltip=index, color='royalblue',
-                          weight=1, fill_color=fc, fill_opacity=fop)
-         .add_to(tiles_map))
+            runs = pd.DataFrame({'TX': tile_df.TX, 'TY': tile_df.TY, 'Length': 1,
+                                 'Train': tile_df.Train, 'Label': tile_df.index})
+        properties = [{'label': label,
+                       'fill': 'darkorange' if train else 'royalblue',
+                       'opacity': opacity if train else 0.1}
+                      for label, train in zip(runs.Label, runs.Train)]
+        features = _rect_features(runs.TX * tile_size, runs.TY * tile_size,
+                                  (runs.TX + runs.Length) * tile_size, (runs.TY + 1) * tile_size,
+                                  properties)
+
+    (folium.GeoJson({'type': 'FeatureCollection', 'features': features},
+                    style_function=lambda feature: {
+                        'color': 'royalblue', 'weight': 1,
+                        'fillColor': feature['properties']['fill'],
+                        'fillOpacity': feature['properties']['opacity']},
+                    tooltip=folium.GeoJsonTooltip(fields=['label'], labels=False))
+     .add_to(tiles_map))
 
-    return tiles_map
\ No newline at end of file
+    return tiles_map
@@ -0,0 +1,147 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Level of detail (LOD) pyramid utility methods - Module (Python)
+
+A LOD pyramid is built bottom-up from a folder of tiles. Level 0 subsamples
+each tile at the finest grid size. Each next level doubles the tile size and
+subsamples the union of the (already subsampled) four child tiles at a coarser
+grid size, so the full resolution tiles are read only once. Quadtree tiles (see
+`plan_utils.TileQuadtree`) keep their own size at level 0; from level 1 on all
+levels are regular grids of twice the root tile size per level. Every level gets
+its own folder (`lod<level>`) with a tile index, and a level index
+(`lod_index.json`) lists the levels, so that clients can select the level for
+their zoom and query its tile index for the tiles they need.
+"""
+
+import os
+import json
+import pathlib
+
+import laspy
+import numpy as np
+from tqdm import tqdm
+
+from ..utils.las_utils import BUFFER_DIMENSION
+from ..utils.math_utils import get_octree_level, voxel_subsample
+from ..utils.index_utils import TileIndex, write_tile_index
+from ..utils.plan_utils import scan_headers, parse_tile_code
+from ..utils.tile_writer import get_laz_backend
+
+LOD_INDEX_FILE = 'lod_index.json'
+
+
+def get_parent_tile_code(tile_code):
+    """Code of the parent tile, of twice the (root) tile size, of a tile.
+
+    The parent of a quadtree tile at level L ('X_Y_L') is its ancestor in the regular grid of twice the root
+    tile size, L + 1 levels up.
+    """
+    tile_x, tile_y, level = parse_tile_code(tile_code)
+    return f"{tile_x >> (level + 1)}_{tile_y >> (level + 1)}"
+
+
+def build_lod_pyramid(in_folder, out_folder, grid_sizes=(0.01, 0.05, 0.25, 1.0), prefix='filtered_',
+                      tile_size=None, extension='.laz', laz_backend=None):
+    """Build a LOD pyramid from the tiles in a folder, see the module docstring.
+
+    The buffer points of buffered tiles (see `las_utils.tile_las_file`) are left out. The voxel grid of each
+    output tile is aligned to the tile corner and the z-minimum of all tiles, as in
+    `las_utils.tile_subsample_las_folder`, so the grids of neighbouring tiles match. All tiles must share the
+    same point format; points are rescaled to the scales and offsets of the first child tile.
+
+    Args:
+        in_folder: The folder with the (full resolution) tiles.
+        out_folder: The output folder, which gets a subfolder per level and the level index.
+        grid_sizes: The grid size of each level, from fine to coarse. Defaults to 1 cm, 5 cm, 25 cm and 1 m.
+        prefix: The prefix of the tile file names, also used for the output tiles. Defaults to 'filtered_'.
+        tile_size: The size of the input tiles, or of the root tiles of quadtree tiles. Defaults to None,
+            which takes it from the tile index of `in_folder`, or 50 without index.
+        extension: The extension of the input and output tiles. Defaults to '.laz'.
+        laz_backend: The LAZ backend name, see `tile_writer.get_laz_backend`. Defaults to None (laspy's default).
+
+    Returns:
+        The list of levels, as written to the level index.
+    """
+    out_folder = pathlib.Path(out_folder)
+    out_folder.mkdir(parents=True, exist_ok=True)
+    laz_backend = get_laz_backend(laz_backend)
+
+    if tile_size is None:
+        index = TileIndex.load(in_folder) if TileIndex.exists(in_folder) else None
+        tile_size = (float(index['tile_size'][0]) * 2**parse_tile_code(index.tile_codes[0])[2]
+                     if index is not None and len(index) > 0 else 50)
+
+    tiles = {}
+    for file in sorted(pathlib.Path(in_folder).glob(f'{prefix}*{extension}')):
+        tile_code = file.name[len(prefix):-len(extension)]
+        tiles[tile_code] = [file]
+    print(f'Building LOD pyramid. Found {len(tiles)} tiles.')
+    if len(tiles) == 0:
+        return []
+
+    scans = scan_headers([files[0] for files in tiles.values()])
+    z_min = min(scan['mins'][2] for scan in scans)
+    z_max = max(scan['maxs'][2] for scan in scans)
+
+    levels = []
+    for level, grid_size in enumerate(grid_sizes):
+        level_tile_size = tile_size * 2**level
+        level_folder = out_folder / f'lod{level}'
+        level_folder.mkdir(exist_ok=True)
+
+        # A cube over the tile square and the z-range of all tiles defines the voxel grid of each tile.
+        size = max(level_tile_size, z_max - z_min)
+        octree_level = get_octree_level(np.array([[0., 0., 0.], [size, size, size]]), grid_size)
+
+        for tile_code, files in tqdm(tiles.items(), unit="tile", desc=f"lod{level}"):
+            tile_x, tile_y, tile_level = parse_tile_code(tile_code)
+            tile_width = level_tile_size / 2**tile_level
+            origin = np.array([tile_x * tile_width, tile_y * tile_width, z_min])
+            out_file = level_folder / f"{prefix}{tile_code}{extension}"
+            try:
+                _subsample_lod_tile(files, out_file, (origin, size), octree_level, laz_backend)
+            except Exception as e:
+                print(f"Failed to build tile: {out_file.name}")
+                print(e)
+
+        index = write_tile_index(level_folder, prefix, level_tile_size, extension)
+        levels.append({'level': level, 'grid_size': grid_size, 'tile_size': level_tile_size,
+                       'folder': level_folder.name, 'tile_count': len(index),
+                       'point_count': int(index['point_count'].sum())})
+
+        # The tiles of this level are the children of the next level.
+        parents = {}
+        for file_name in index['file_name']:
+            tile_code = str(file_name)[len(prefix):-len(extension)]
+            parents.setdefault(get_parent_tile_code(tile_code), []).append(level_folder / str(file_name))
+        tiles = parents
+
+    path = out_folder / LOD_INDEX_FILE
+    tmp_path = path.with_name(f'.{LOD_INDEX_FILE}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'prefix': prefix, 'extension': extension, 'levels': levels}, f, indent=2)
+    os.replace(tmp_path, path)
+    return levels
+
+
+def _subsample_lod_tile(files, out_file, bbox, octree_level, laz_backend=None):
+    """Subsample the union of the points of the given tiles on a voxel grid, keeping all point dimensions."""
+    header = None
+    records = []
+    for file in files:
+        las = laspy.read(file)
+        points = las.points
+        if header is None:
+            header = las.header
+        else:
+            points.change_scaling(scales=header.scales, offsets=header.offsets)
+        if BUFFER_DIMENSION in points.point_format.dimension_names:
+            points = points[np.asarray(points[BUFFER_DIMENSION]) == 0]
+        records.append(points.array)
+
+    points = laspy.ScaleAwarePointRecord(np.concatenate(records), header.point_format,
+                                         header.scales, header.offsets)
+    idx = voxel_subsample(np.vstack([points.x, points.y, points.z]).T, octree_level, bbox)
+    with laspy.open(out_file, mode="w", header=header, laz_backend=laz_backend) as out_las:
+        out_las.write_points(points[idx])
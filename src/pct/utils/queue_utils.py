@@ -0,0 +1,396 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Job queue utility methods - Module (Python)
+
+A job queue on a shared (POSIX) file system, without an external broker, so
+workers on any node that mounts the queue folder can take part. The queue
+folder holds:
+
+* `jobs/<job_id>.json`: the job descriptors, written once by the coordinator.
+* `leases/<job_id>.json`: the lease of the worker running a job, with an expiry
+  time that the worker renews while the job runs.
+* `done/<job_id>.json`: the result of a finished job.
+* `failed/<job_id>.<attempt>.json`: the error of each failed attempt.
+
+Leases, results and failures are created with a hard link of a completely
+written file, which either fails or succeeds atomically, also on NFS. A lease
+is renewed in place with an atomic rename over it, only while a third of the
+lease time is left, so it can not be broken (which requires it to be expired)
+in the meantime. It is removed after moving it aside with a rename and checking
+that it is still the lease of the attempt, so an attempt can not remove the
+lease of another one. A worker may claim a
+job without lease, or a job whose lease expired (its worker died or hangs); a
+job is retried until it failed `max_attempts` times. Only the first result of a
+job is kept, so jobs must write their output such that a duplicate run (after
+an expired lease) is harmless. The clocks of the nodes are assumed to be in
+sync to well within the lease time.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import pathlib
+import threading
+
+QUEUE_FILE = 'queue.json'
+CLOSED_FILE = 'closed'
+
+
+class LeaseLostError(RuntimeError):
+    """The lease of a running job could not be renewed, so another attempt may run the job."""
+
+
+class JobQueue(object):
+    """Job queue in a folder on a shared file system, see the module docstring.
+
+    The run parameters, the lease time and the maximum number of attempts are stored in the queue folder
+    by the coordinator (`create`), so that all workers share them.
+
+    Usage:
+        queue = JobQueue.create(queue_folder, params)
+        queue.submit('tile-00000', {'file': ...})
+        ...
+        queue = JobQueue(queue_folder)
+        while (job := queue.claim()) is not None:
+            with job:
+                job.complete(result)
+    """
+
+    def __init__(self, folder, worker_id=None):
+        self.folder = pathlib.Path(folder)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        settings = _read_json(self.folder / QUEUE_FILE)
+        if settings is None:
+            raise FileNotFoundError(f"No job queue found in: {folder}")
+        self.params = settings['params']
+        self.lease_seconds = settings['lease_seconds']
+        self.max_attempts = settings['max_attempts']
+
+    @classmethod
+    def create(cls, folder, params=None, lease_seconds=600, max_attempts=3):
+        """Create a queue (or reopen an existing one, which is then no longer closed) with the given run parameters.
+
+        Args:
+            folder: The queue folder, on storage shared by all nodes.
+            params: JSON serializable run parameters for the workers. Defaults to None.
+            lease_seconds: The time after which the lease of a job that is not renewed expires.
+                Defaults to 600.
+            max_attempts: The number of failed attempts after which a job is not retried. Defaults to 3.
+
+        Raises:
+            ValueError: If the queue exists with different parameters.
+        """
+        folder = pathlib.Path(folder)
+        for name in ('jobs', 'leases', 'done', 'failed'):
+            (folder / name).mkdir(parents=True, exist_ok=True)
+        settings = {'params': json.loads(json.dumps(params)), 'lease_seconds': lease_seconds,
+                    'max_attempts': max_attempts}
+        old = _read_json(folder / QUEUE_FILE)
+        if old is None:
+            _write_json(folder / QUEUE_FILE, settings)
+        elif old != settings:
+            raise ValueError(f"The queue {folder} was created with different parameters: {old} != {settings}")
+        (folder / CLOSED_FILE).unlink(missing_ok=True)
+        return cls(folder)
+
+    @classmethod
+    def exists(cls, folder):
+        return (pathlib.Path(folder) / QUEUE_FILE).is_file()
+
+    def submit(self, job_id, descriptor):
+        """Add a job, unless a job with this id was already submitted. Returns True if it was added."""
+        return _link_json(self.folder / 'jobs' / f'{job_id}.json', {'id': job_id, **descriptor})
+
+    def close(self):
+        """Mark that no more jobs will be submitted, so idle workers can stop."""
+        (self.folder / CLOSED_FILE).touch()
+
+    @property
+    def closed(self):
+        return (self.folder / CLOSED_FILE).is_file()
+
+    def job_ids(self, prefix=''):
+        return sorted(job_id for job_id in _list_json(self.folder / 'jobs') if job_id.startswith(prefix))
+
+    def get_result(self, job_id):
+        """The result of a finished job, or None."""
+        return _read_json(self.folder / 'done' / f'{job_id}.json')
+
+    def get_failure(self, job_id):
+        """The failure record {'attempts', 'error'} of a job, with the error of the last attempt, or None."""
+        failure, attempts = None, 0
+        while True:
+            record = _read_json(self._failure_path(job_id, attempts))
+            if record is None:
+                return failure
+            attempts += 1
+            failure = {'attempts': attempts, 'error': record['error']}
+
+    def is_failed(self, job_id):
+        """Whether a job failed `max_attempts` times (and is not retried anymore)."""
+        failure = self.get_failure(job_id)
+        return failure is not None and failure['attempts'] >= self.max_attempts
+
+    def status(self, prefix=''):
+        """Dict with the number of 'pending', 'running', 'done' and 'failed' jobs with an id prefix."""
+        status = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        done, leased, attempts = self._scan()
+        for job_id in self.job_ids(prefix):
+            if job_id in done:
+                status['done'] += 1
+            elif attempts.get(job_id, 0) >= self.max_attempts:
+                status['failed'] += 1
+            elif job_id in leased:
+                status['running'] += 1
+            else:
+                status['pending'] += 1
+        return status
+
+    def wait(self, prefix='', poll_seconds=5, callback=None):
+        """Wait until all jobs with an id prefix are done or failed. Returns the final status."""
+        while True:
+            status = self.status(prefix)
+            if callback is not None:
+                callback(status)
+            if status['pending'] == 0 and status['running'] == 0:
+                return status
+            time.sleep(poll_seconds)
+
+    def claim(self, prefix=''):
+        """Claim an available job with an id prefix: without lease, or with an expired lease.
+
+        The done, failed and leased jobs are found by listing their folders once, so a claim only opens the
+        leases of running jobs. Each claim starts at a random job, so that workers do not all race for the
+        same job.
+
+        Returns:
+            A `Job`, or None if no job is available right now.
+        """
+        job_ids = self.job_ids(prefix)
+        done, leased, attempts = self._scan()
+        start = random.randrange(len(job_ids)) if job_ids else 0
+        for job_id in job_ids[start:] + job_ids[:start]:
+            if job_id in done or attempts.get(job_id, 0) >= self.max_attempts:
+                continue
+            lease_path = self.folder / 'leases' / f'{job_id}.json'
+            lease = _read_json(lease_path) if job_id in leased else None
+            if lease is not None:
+                if lease['expires'] > time.time() or not self._break_lease(job_id, lease):
+                    continue
+                # The expired lease may have been the last attempt.
+                if self.is_failed(job_id):
+                    continue
+
+            token = uuid.uuid4().hex
+            if not _link_json(lease_path, self._lease(token)):
+                continue
+            # The job may have finished between the check above and taking the lease.
+            if (self.folder / 'done' / f'{job_id}.json').is_file():
+                lease_path.unlink(missing_ok=True)
+                continue
+            return Job(self, _read_json(self.folder / 'jobs' / f'{job_id}.json'), token)
+        return None
+
+    def _scan(self):
+        """Sets of the done and leased job ids, and a dict with the failed attempts per job id."""
+        attempts = {}
+        for name in _list_json(self.folder / 'failed'):
+            job_id = name.rsplit('.', 1)[0]
+            attempts[job_id] = attempts.get(job_id, 0) + 1
+        return _list_json(self.folder / 'done'), _list_json(self.folder / 'leases'), attempts
+
+    def _lease(self, token):
+        return {'worker': self.worker_id, 'token': token, 'expires': time.time() + self.lease_seconds}
+
+    def _break_lease(self, job_id, lease):
+        """Remove an expired lease, counting it as a failed attempt. Returns False if another worker was first."""
+        lease_path = self.folder / 'leases' / f'{job_id}.json'
+        broken_path = _take_file(lease_path)
+        if broken_path is None:
+            return False
+        try:
+            # The lease may have been renewed, or replaced by a new one, in the meantime: restore it.
+            if _read_json(broken_path) != lease:
+                _restore_file(broken_path, lease_path)
+                return False
+            self._add_failure(job_id, f"Lease of worker {lease['worker']} expired.")
+            return True
+        finally:
+            broken_path.unlink(missing_ok=True)
+
+    def _failure_path(self, job_id, attempt):
+        return self.folder / 'failed' / f'{job_id}.{attempt}.json'
+
+    def _add_failure(self, job_id, error):
+        """Record a failed attempt in a file of its own, created atomically with the first free number."""
+        attempt = 0
+        while not _link_json(self._failure_path(job_id, attempt), {'error': error}):
+            attempt += 1
+
+
+class Job(object):
+    """A claimed job, with a lease that is renewed in a background thread while the job is used as context.
+
+    Leaving the context without `complete` (e.g. on an exception) records a failed attempt. If the lease can
+    not be renewed, `lease_lost` is set, and `check_lease` raises a `LeaseLostError`; long jobs should call it
+    before publishing their output.
+    """
+
+    def __init__(self, queue, descriptor, token):
+        self.queue = queue
+        self.descriptor = descriptor
+        self.id = descriptor['id']
+        self.token = token
+        self.finished = False
+        self.lease_lost = threading.Event()
+        self._stop = threading.Event()
+        self._renewer = threading.Thread(target=self._renew, daemon=True)
+
+    def __getitem__(self, key):
+        return self.descriptor[key]
+
+    def __enter__(self):
+        self._renewer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._renewer.join()
+        if not self.finished:
+            self.fail(exc_val if exc_val is not None else "The job was not completed.")
+
+    @property
+    def lease_path(self):
+        return self.queue.folder / 'leases' / f'{self.id}.json'
+
+    def owns_lease(self):
+        lease = _read_json(self.lease_path)
+        return lease is not None and lease['token'] == self.token
+
+    def check_lease(self):
+        """Raise a `LeaseLostError` if the lease of this attempt could not be renewed."""
+        if self.lease_lost.is_set():
+            raise LeaseLostError(f"Lost the lease of job: {self.id}")
+
+    def complete(self, result=None):
+        """Store the result and release the lease. Returns False if another attempt finished first."""
+        self.finished = True
+        stored = _link_json(self.queue.folder / 'done' / f'{self.id}.json',
+                            {'worker': self.queue.worker_id, 'result': result})
+        self._release()
+        return stored
+
+    def fail(self, error):
+        """Record a failed attempt and release the lease, so the job can be retried.
+
+        The failure is not recorded if the lease expired and was broken, which already counted the attempt.
+        """
+        self.finished = True
+        taken_path = self._take_lease()
+        if taken_path is None:
+            return
+        try:
+            self.queue._add_failure(self.id, f"{type(error).__name__}: {error}"
+                                    if isinstance(error, BaseException) else str(error))
+        finally:
+            taken_path.unlink(missing_ok=True)
+
+    def _release(self):
+        taken_path = self._take_lease()
+        if taken_path is not None:
+            taken_path.unlink(missing_ok=True)
+
+    def _take_lease(self):
+        """Move the lease of this attempt aside. Returns the moved lease, or None if the attempt lost its lease."""
+        taken_path = _take_file(self.lease_path)
+        if taken_path is None:
+            return None
+        lease = _read_json(taken_path)
+        if lease['token'] != self.token:
+            # The lease of another attempt: restore it.
+            _restore_file(taken_path, self.lease_path)
+            taken_path.unlink(missing_ok=True)
+            return None
+        return taken_path
+
+    def _renew(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            if not self._renew_lease():
+                self.lease_lost.set()
+                print(f"Lost the lease of job: {self.id}")
+                return
+
+    def _renew_lease(self):
+        """Replace the lease by one with a new expiry time, in place. Returns False if the lease was lost.
+
+        A lease with less than a third of the lease time left is not renewed, as a worker that finds it
+        expired may break it between the check and the replacement.
+        """
+        lease = _read_json(self.lease_path)
+        if (lease is None or lease['token'] != self.token
+                or lease['expires'] - time.time() < self.queue.lease_seconds / 3):
+            return False
+        _write_json(self.lease_path, self.queue._lease(self.token))
+        return True
+
+
+def _list_json(folder):
+    """Set of the names (without extension) of the JSON files in a folder, with a single directory read."""
+    return {name[:-len('.json')] for name in os.listdir(folder)
+            if name.endswith('.json') and not name.startswith('.')}
+
+
+def _read_json(path):
+    """Read a JSON file, or None if it does not exist."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_json(path, data):
+    """Write a JSON file, replacing an existing file atomically."""
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _take_file(path):
+    """Move a file aside under a unique name, atomically. Returns the new path, or None if there was no file."""
+    path = pathlib.Path(path)
+    taken_path = path.with_name(f'.{path.stem}.{uuid.uuid4().hex}.taken')
+    try:
+        os.rename(path, taken_path)
+    except FileNotFoundError:
+        return None
+    return taken_path
+
+
+def _restore_file(taken_path, path):
+    """Link a file moved aside with `_take_file` back, unless a new file was created in the meantime."""
+    try:
+        os.link(taken_path, path)
+    except FileExistsError:
+        pass
+
+
+def _link_json(path, data):
+    """Create a JSON file only if it does not exist yet, atomically. Returns False if it already existed."""
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        tmp_path.unlink()
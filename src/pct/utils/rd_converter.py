@@ -39,6 +39,9 @@ All credit for the formulas go to F.H. Schreutelkamp and G.L. Strang van Hees.
 """
 from builtins import enumerate
 
+import numpy as np
+from numba import njit, prange
+
 
 class RDWGS84Converter(object):
 
@@ -68,6 +71,12 @@ class RDWGS84Converter(object):
     Spq = [309056.544, 3638.893, 73.077, -157.984, 59.788, 0.433, -6.439,
            -0.032, 0.092, -0.054]
 
+    # Exponent and coefficient tables as arrays, for the array conversions
+    K_table = (np.array(Kp), np.array(Kq), np.array(Kpq))
+    L_table = (np.array(Lp), np.array(Lq), np.array(Lpq))
+    R_table = (np.array(Rp), np.array(Rq), np.array(Rpq))
+    S_table = (np.array(Sp), np.array(Sq), np.array(Spq))
+
     def from_rd(self, x: int, y: int) -> tuple:
         """
         Converts RD coordinates into WGS84 coordinates
@@ -93,3 +102,81 @@ class RDWGS84Converter(object):
                            for i, v in enumerate(self.Spq)])
 
         return x, y
+
+    def from_rd_array(self, x, y) -> tuple:
+        """
+        Converts arrays (of any, broadcastable, shape) of RD coordinates into
+        WGS84 coordinates, returns arrays (latitude, longitude)
+        """
+        latitude, longitude = _convert_array(x, y, self.x0, self.y0, 1E-5,
+                                             self.K_table, self.L_table)
+        latitude /= 3600
+        latitude += self.phi0
+        longitude /= 3600
+        longitude += self.lam0
+
+        return latitude, longitude
+
+    def from_wgs84_array(self, latitude, longitude) -> tuple:
+        """
+        Converts arrays (of any, broadcastable, shape) of WGS84 coordinates
+        into RD coordinates, returns arrays (x, y)
+        """
+        x, y = _convert_array(latitude, longitude, self.phi0, self.lam0, 0.36,
+                              self.R_table, self.S_table)
+        x += self.x0
+        y += self.y0
+
+        return x, y
+
+
+@njit(parallel=True, cache=True)
+def _series_kernel(a, b, a0, b0, scale, p1, q1, coefs1, p2, q2, coefs2,
+                   out1, out2):
+    n = a.shape[0]
+    block = 1024
+    max_p = max(p1.max(), p2.max())
+    max_q = max(q1.max(), q2.max())
+    for blk in prange((n + block - 1) // block):
+        start = blk * block
+        size = min(block, n - start)
+
+        # Tables with the powers of da and db for this block
+        a_pow = np.ones((max_p + 1, size))
+        b_pow = np.ones((max_q + 1, size))
+        for j in range(size):
+            a_pow[1, j] = scale * (a[start + j] - a0)
+            b_pow[1, j] = scale * (b[start + j] - b0)
+        for k in range(2, max_p + 1):
+            for j in range(size):
+                a_pow[k, j] = a_pow[k - 1, j] * a_pow[1, j]
+        for k in range(2, max_q + 1):
+            for j in range(size):
+                b_pow[k, j] = b_pow[k - 1, j] * b_pow[1, j]
+
+        for p, q, coefs, out in ((p1, q1, coefs1, out1),
+                                 (p2, q2, coefs2, out2)):
+            for j in range(size):
+                out[start + j] = 0.0
+            for k in range(coefs.shape[0]):
+                c = coefs[k]
+                ap = a_pow[p[k]]
+                bq = b_pow[q[k]]
+                for j in range(size):
+                    out[start + j] += c * ap[j] * bq[j]
+
+
+def _convert_array(a, b, a0, b0, scale, table1, table2):
+    """
+    Evaluates the series sum_k coefs[k] * da ** p[k] * db ** q[k] of two
+    tables (p, q, coefs) element-wise, with da = scale * (a - a0) and
+    db = scale * (b - b0), in a single pass over the arrays
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64),
+                               np.asarray(b, dtype=np.float64))
+    out1 = np.empty(a.size)
+    out2 = np.empty(a.size)
+    _series_kernel(np.ascontiguousarray(a).ravel(),
+                   np.ascontiguousarray(b).ravel(), a0, b0, scale,
+                   *table1, *table2, out1, out2)
+    return out1.reshape(a.shape), out2.reshape(a.shape)
@@ -0,0 +1,157 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+"""
+Tile writer pool - Module (Python)
+
+Keeps a bounded set of tile writers open and buffers points per tile, so each
+tile is written in a few large batches instead of being reopened for every chunk.
+"""
+
+import pathlib
+from collections import OrderedDict
+
+import laspy
+import numpy as np
+from laspy.lasappender import LasAppender
+
+# LAZ backends by name. Without a backend laspy uses the first available of these, in this order.
+LAZ_BACKENDS = {'lazrs-parallel': laspy.LazBackend.LazrsParallel,
+                'lazrs': laspy.LazBackend.Lazrs,
+                'laszip': laspy.LazBackend.Laszip}
+
+
+def get_laz_backend(name):
+    """The laspy `LazBackend` for a name in `LAZ_BACKENDS`, or None (laspy's default) for None.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ImportError: If the backend is not installed.
+    """
+    if name is None:
+        return None
+    if name not in LAZ_BACKENDS:
+        raise ValueError(f"Unknown LAZ backend: {name}")
+    backend = LAZ_BACKENDS[name]
+    if not backend.is_available():
+        raise ImportError(f"The LAZ backend '{name}' is not installed.")
+    return backend
+
+
+class TileWriterPool(object):
+    """Pool of open LAS/LAZ writers with per-tile point buffers.
+
+    Points are buffered per tile until the total buffered size exceeds
+    `max_buffer_bytes`, after which the largest buffers are flushed. At most
+    `max_open_files` writers are kept open; the least recently used writer is
+    closed when another tile needs one. Tiles whose writer was closed, or that
+    already exist on disk (e.g. written from a neighbouring input file), are
+    appended to. All writers are closed once in `close()`.
+
+    The tiles are compressed if `extension` is '.laz', with the given `laz_backend`
+    (see `get_laz_backend`). Uncompressed '.las' tiles avoid the compression cost
+    for intermediate tiles that are read again right away.
+
+    Usage:
+        with TileWriterPool(out_folder, in_las.header, prefix) as pool:
+            for points in in_las.chunk_iterator(points_per_iter):
+                ...
+                pool.write(tile_code, tile_points)
+    """
+
+    def __init__(self, out_folder, header, prefix='', extension='.laz',
+                 max_open_files=128, max_buffer_bytes=1_000_000_000, laz_backend=None):
+        self.out_folder = pathlib.Path(out_folder)
+        self.header = header
+        self.prefix = prefix
+        self.extension = extension
+        self.max_open_files = max(1, max_open_files)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.laz_backend = get_laz_backend(laz_backend)
+
+        self._buffers = {}
+        self._buffer_bytes = {}
+        self._buffered = 0
+        self._writers = OrderedDict()
+        self._started = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def tile_codes(self):
+        """Codes of the tiles written by this pool so far."""
+        return set(self._started)
+
+    def get_path(self, tile_code):
+        """Output path of a given tile."""
+        return self.out_folder / f"{self.prefix}{tile_code}{self.extension}"
+
+    def write(self, tile_code, points):
+        """Buffer the points of a tile, flushing if the memory budget is exceeded."""
+        if len(points) == 0:
+            return
+        self._buffers.setdefault(tile_code, []).append(points)
+        self._buffer_bytes[tile_code] = self._buffer_bytes.get(tile_code, 0) + points.array.nbytes
+        self._buffered += points.array.nbytes
+
+        if self._buffered > self.max_buffer_bytes:
+            # Flush the largest buffers first, until half of the budget is free.
+            for code in sorted(self._buffer_bytes, key=self._buffer_bytes.get, reverse=True):
+                self.flush(code)
+                if self._buffered <= self.max_buffer_bytes // 2:
+                    break
+
+    def flush(self, tile_code=None):
+        """Write the buffered points of one tile (or all tiles if None) to disk."""
+        if tile_code is None:
+            for code in list(self._buffers):
+                self.flush(code)
+            return
+
+        buffers = self._buffers.pop(tile_code, None)
+        if not buffers:
+            return
+        self._buffered -= self._buffer_bytes.pop(tile_code)
+
+        points = buffers[0]
+        if len(buffers) > 1:
+            points = laspy.ScaleAwarePointRecord(np.concatenate([p.array for p in buffers]),
+                                                 points.point_format, points.scales, points.offsets)
+
+        writer = self._get_writer(tile_code)
+        if isinstance(writer, LasAppender):
+            points.change_scaling(offsets=writer.header.offsets)
+            writer.append_points(points)
+        else:
+            writer.write_points(points)
+
+    def close(self):
+        """Flush all buffers and close all open writers."""
+        try:
+            self.flush()
+        finally:
+            while self._writers:
+                _, writer = self._writers.popitem(last=False)
+                writer.close()
+
+    def _get_writer(self, tile_code):
+        if tile_code in self._writers:
+            self._writers.move_to_end(tile_code)
+            return self._writers[tile_code]
+
+        while len(self._writers) >= self.max_open_files:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+
+        # write or append
+        output_path = self.get_path(tile_code)
+        if tile_code not in self._started and not output_path.is_file():
+            writer = laspy.open(output_path, mode="w", header=self.header, laz_backend=self.laz_backend)
+        else:
+            writer = laspy.open(output_path, mode="a", laz_backend=self.laz_backend)
+        self._started.add(tile_code)
+        self._writers[tile_code] = writer
+        return writer
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Import the package from the source folder, like the scripts do with set_path.
+module_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+if module_path not in sys.path:
+    sys.path.insert(0, module_path)
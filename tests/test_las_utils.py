@@ -0,0 +1,101 @@
+# PointCloud_Tiling, GPL-3.0 license
+
+import pytest
+
+np = pytest.importorskip('numpy')
+laspy = pytest.importorskip('laspy')
+
+from pct.utils.las_utils import tile_las_folder, tile_subsample_las_folder, get_tilecode_from_filename  # noqa: E402
+from pct.utils.metrics_utils import PipelineMetrics  # noqa: E402
+from pct.utils.journal_utils import TilingJournal  # noqa: E402
+
+
+class Crash(BaseException):
+    """Simulates a kill: not caught by the per-file error handling."""
+
+
+def make_laz(path, n_points, seed=0, x_offset=0):
+    rng = np.random.default_rng(seed)
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = np.array([0.001, 0.001, 0.001])
+    header.offsets = np.array([120_000, 480_000, 0])
+    las = laspy.LasData(header)
+    las.x = 120_000 + x_offset + rng.random(n_points) * 100
+    las.y = 480_000 + rng.random(n_points) * 100
+    las.z = rng.random(n_points) * 20
+    las.write(path)
+
+
+def count_tile_points(folder, prefix='filtered_'):
+    return sum(laspy.open(path).header.point_count for path in folder.glob(f'{prefix}*.laz'))
+
+
+@pytest.mark.parametrize('n_points', [3_000, 2_500])
+def test_resume_after_final_commit(tmp_path, monkeypatch, n_points):
+    if len(laspy.LazBackend.detect_available()) == 0:
+        pytest.skip('no LAZ backend installed')
+    in_folder, out_folder = tmp_path / 'in', tmp_path / 'out'
+    in_folder.mkdir()
+    in_file = in_folder / 'scan.laz'
+    make_laz(in_file, n_points)
+
+    # Crash after the commit of the last chunk, before the file is marked done.
+    def crash(self, file):
+        raise Crash()
+
+    with monkeypatch.context() as m:
+        m.setattr(TilingJournal, 'mark_done', crash)
+        with pytest.raises(Crash):
+            tile_las_folder(in_folder, out_folder, glob_pattern='*.laz', points_per_iter=1_000, resume=True)
+    assert TilingJournal(out_folder, 'filtered_').next_chunk(in_file) == 3
+
+    tile_las_folder(in_folder, out_folder, glob_pattern='*.laz', points_per_iter=1_000, resume=True)
+    assert TilingJournal(out_folder, 'filtered_').is_done(in_file)
+    assert count_tile_points(out_folder) == n_points
+
+
+@pytest.mark.parametrize('filename, prefix, tile_code', [
+    ('filtered_2400_9600.laz', 'filtered_', '2400_9600'),
+    ('filtered_19200_76800_3.laz', 'filtered_', '19200_76800_3'),
+    ('/data/tiles/filtered_-5_10.las', 'filtered_', '-5_10'),
+    ('ahn4_2400_9600.laz', 'ahn4_', '2400_9600'),
+    ('run_2_2400_9600.laz', 'run_2_', '2400_9600'),
+    ('run_2_2400_9600_1.laz', 'run_2_', '2400_9600_1'),
+])
+def test_get_tilecode_from_filename(filename, prefix, tile_code):
+    assert get_tilecode_from_filename(filename, prefix) == tile_code
+
+
+@pytest.mark.parametrize('filename, prefix', [
+    ('ahn4_2400_9600.laz', 'filtered_'),
+    ('filtered_tile.laz', 'filtered_'),
+    ('filtered_2400_9600_1_2.laz', 'filtered_'),
+])
+def test_get_tilecode_from_filename_invalid(filename, prefix):
+    with pytest.raises(ValueError):
+        get_tilecode_from_filename(filename, prefix)
+
+
+def test_tile_subsample_spilling(tmp_path):
+    if len(laspy.LazBackend.detect_available()) == 0:
+        pytest.skip('no LAZ backend installed')
+    in_folder = tmp_path / 'in'
+    in_folder.mkdir()
+    # Overlapping files, so that tiles stay open over several files.
+    for i in range(3):
+        make_laz(in_folder / f'scan_{i}.laz', 40_000, seed=i, x_offset=i * 50)
+
+    kwargs = dict(glob_pattern='*.laz', points_per_iter=5_000, tile_size=25, grid_size=0.5, min_points=3_000)
+    tile_subsample_las_folder(in_folder, tmp_path / 'memory', **kwargs)
+    metrics = PipelineMetrics()
+    tile_subsample_las_folder(in_folder, tmp_path / 'spilled', max_memory_bytes=100_000, metrics=metrics,
+                              **kwargs)
+    assert metrics.get_count('spilled_tiles') > 0
+
+    names = sorted(path.name for path in (tmp_path / 'memory').glob('filtered_*.laz'))
+    assert len(names) > 0
+    assert names == sorted(path.name for path in (tmp_path / 'spilled').glob('filtered_*.laz'))
+    for name in names:
+        expected = laspy.read(tmp_path / 'memory' / name).points.array
+        assert np.array_equal(laspy.read(tmp_path / 'spilled' / name).points.array, expected)
+    assert list((tmp_path / 'spilled').glob('.spill_*')) == []